@@ -0,0 +1,149 @@
+"""
+Certification expiry and equipment maintenance alerts.
+
+`due_item` holds one precomputed row per certification that has expired or
+expires within the alert window, and per piece of equipment whose next
+maintenance is overdue or falls within it. Items past due by more than the
+grace period drop out, so a certification that lapsed years ago or retired
+kit nobody services does not stay on the dashboard for good. It is derived data: refresh()
+rebuilds it with two INSERT ... SELECTs driven by range scans on the
+certification.expiration_date and equipment.next_maintenance indexes, so
+pages read a user's handful of due items instead of classifying every
+certification and piece of kit on each render.
+
+Statuses depend on today's date, so the table is refreshed on a schedule
+(in-process with start_scheduler(), or from cron with alerts_job.py) and for
+a single user after every write that changes their certifications or
+equipment.
+"""
+
+import threading
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import DateTime, String, case, func, literal, select
+
+import tenants
+
+DEFAULT_WINDOW_DAYS = 90
+DEFAULT_GRACE_DAYS = 90
+
+# status -> (label, badge background, badge colour)
+STATUSES = {
+    'expired': ('Expired', '#fadbd8', '#e74c3c'),
+    'expiring': ('Expiring Soon', '#fde3d1', '#e67e22'),
+    'overdue': ('Service Overdue', '#fadbd8', '#e74c3c'),
+    'due_soon': ('Service Due', '#fde3d1', '#e67e22'),
+}
+KINDS = ('certification', 'equipment')
+
+
+def _sources(tables, today, horizon, floor):
+    """(kind, SELECT) pairs producing due_item rows for every user."""
+    diver, certification, equipment = tables['diver'], tables['certification'], tables['equipment']
+    diver_name = diver.c.first_name + ' ' + diver.c.last_name
+    computed_at = literal(datetime.utcnow(), DateTime)
+
+    certifications = select(
+        diver.c.user_id, certification.c.diver_id, literal('certification', String), certification.c.id,
+        certification.c.cert_type, diver_name, certification.c.expiration_date,
+        case((certification.c.expiration_date < today, 'expired'), else_='expiring'), computed_at,
+    ).join(diver, diver.c.id == certification.c.diver_id).where(
+        certification.c.expiration_date.between(floor, horizon))
+
+    label = equipment.c.equipment_type + func.coalesce(' ' + equipment.c.brand, '') + \
+        func.coalesce(' ' + equipment.c.model, '')
+    kit = select(
+        diver.c.user_id, equipment.c.diver_id, literal('equipment', String), equipment.c.id,
+        label, diver_name, equipment.c.next_maintenance,
+        case((equipment.c.next_maintenance < today, 'overdue'), else_='due_soon'), computed_at,
+    ).join(diver, diver.c.id == equipment.c.diver_id).where(
+        equipment.c.next_maintenance.between(floor, horizon))
+
+    return [('certification', certifications), ('equipment', kit)]
+
+
+def refresh(conn, tables, user_id=None, today=None, window_days=DEFAULT_WINDOW_DAYS, grace_days=DEFAULT_GRACE_DAYS):
+    """Rebuild due items for one user, or for everyone when user_id is None. Returns the row count.
+
+    Items are due from grace_days before today to window_days after it.
+    """
+    today = today or date.today()
+    horizon = today + timedelta(days=window_days)
+    floor = today - timedelta(days=grace_days)
+    due_item = tables['due_item']
+    columns = ['user_id', 'diver_id', 'kind', 'ref_id', 'label', 'diver_name', 'due_date', 'status', 'computed_at']
+
+    delete = due_item.delete()
+    if user_id is not None:
+        delete = delete.where(due_item.c.user_id == user_id)
+    conn.execute(delete)
+
+    count = 0
+    for _, source in _sources(tables, today, horizon, floor):
+        if user_id is not None:
+            source = source.where(tables['diver'].c.user_id == user_id)
+        count += conn.execute(due_item.insert().from_select(columns, source)).rowcount
+    return count
+
+
+def summary(conn, tables, user_id, today=None, limit=5):
+    """Counts by status plus the next `limit` upcoming items, for the dashboard widget."""
+    today = today or date.today()
+    due_item = tables['due_item']
+    counts = dict(conn.execute(
+        select(due_item.c.status, func.count()).where(due_item.c.user_id == user_id).group_by(due_item.c.status)
+    ).all())
+    upcoming = conn.execute(
+        select(due_item).where(due_item.c.user_id == user_id, due_item.c.due_date >= today)
+        .order_by(due_item.c.due_date).limit(limit)
+    ).mappings().all()
+    return {'counts': {status: counts.get(status, 0) for status in STATUSES},
+            'upcoming': [dict(row) for row in upcoming]}
+
+
+def statuses(conn, tables, user_id, kind):
+    """{ref_id: status} for one user's due items of `kind`; anything missing is not due."""
+    due_item = tables['due_item']
+    return dict(conn.execute(
+        select(due_item.c.ref_id, due_item.c.status).where(due_item.c.user_id == user_id, due_item.c.kind == kind)
+    ).all())
+
+
+def digest(conn, tables, user_id=None):
+    """Due items with their owner's username and email, ordered by user then due date."""
+    due_item, user = tables['due_item'], tables['user']
+    query = select(due_item, user.c.username, user.c.email).join(
+        user, user.c.id == due_item.c.user_id).order_by(due_item.c.user_id, due_item.c.due_date, due_item.c.id)
+    if user_id is not None:
+        query = query.where(due_item.c.user_id == user_id)
+    return [dict(row) for row in conn.execute(query).mappings()]
+
+
+def start_scheduler(app, db, interval, window_days=DEFAULT_WINDOW_DAYS, on_refresh=None, delay=0,
+                    grace_days=DEFAULT_GRACE_DAYS):
+    """Refresh every user's due items after `delay` seconds and then every `interval` seconds on a daemon thread.
+
+    Returns a threading.Event; set it to stop the scheduler.
+    """
+    stop = threading.Event()
+
+    def run():
+        if stop.wait(delay):
+            return
+        while True:
+            try:
+                count = 0
+                with app.app_context():
+                    for _, engine in tenants.engines(db):
+                        with engine.begin() as conn:
+                            count += refresh(conn, db.metadata.tables, window_days=window_days, grace_days=grace_days)
+                app.logger.info('Refreshed %d due items', count)
+                if on_refresh is not None:
+                    on_refresh()
+            except Exception:
+                app.logger.exception('Due item refresh failed')
+            if stop.wait(interval):
+                return
+
+    threading.Thread(target=run, name='alert-scheduler', daemon=True).start()
+    return stop
@@ -0,0 +1,53 @@
+#!/usr/bin/env python
+"""
+Refresh expiry and maintenance alerts and print a digest.
+
+Run from cron when the server's in-process scheduler is disabled
+(ALERT_REFRESH_INTERVAL=0), e.g. once a night shortly after midnight.
+
+Usage:
+    python alerts_job.py                 # refresh every user's due items
+    python alerts_job.py --digest        # refresh, then print a digest per user
+    python alerts_job.py --digest --user peter --no-refresh
+"""
+
+import argparse
+from itertools import groupby
+
+from app import app, db, User
+import alerts
+import tenants
+
+parser = argparse.ArgumentParser(description='Refresh expiry and maintenance alerts')
+parser.add_argument('--digest', action='store_true', help='print every due item grouped by user')
+parser.add_argument('--user', help='limit the digest to this username')
+parser.add_argument('--no-refresh', action='store_true', help='print the digest from the existing table')
+args = parser.parse_args()
+
+with app.app_context():
+    tables = db.metadata.tables
+    if not args.no_refresh:
+        count = 0
+        for _, engine in tenants.engines(db):
+            with engine.begin() as conn:
+                count += alerts.refresh(conn, tables, window_days=app.config['ALERT_WINDOW_DAYS'],
+                                        grace_days=app.config['ALERT_GRACE_DAYS'])
+        print(f"✓ {count} due item(s) within {app.config['ALERT_WINDOW_DAYS']} days")
+
+    if args.digest:
+        user_id = None
+        if args.user:
+            user = User.query.filter_by(username=args.user).first()
+            if user is None:
+                raise SystemExit(f"User '{args.user}' not found")
+            user_id = user.id
+        items = []
+        for _, engine in tenants.engines(db):
+            with engine.connect() as conn:
+                items += alerts.digest(conn, tables, user_id)
+        items.sort(key=lambda item: (item['user_id'], item['due_date'], item['id']))
+        for (username, email), rows in groupby(items, key=lambda item: (item['username'], item['email'])):
+            print(f"\n{username} <{email}>")
+            for item in rows:
+                label = alerts.STATUSES[item['status']][0]
+                print(f"  {item['due_date']}  {label:<16} {item['diver_name']}: {item['label']}")
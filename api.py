@@ -0,0 +1,642 @@
+"""
+Versioned JSON API over divers, dives, equipment, certifications and dive sites.
+
+    GET    /api/v1/<resource>?fields=a,b&limit=50&cursor=<next_cursor>
+    POST   /api/v1/<resource>                   create one
+    GET    /api/v1/<resource>/<id>?fields=a,b
+    PATCH  /api/v1/<resource>/<id>              update the given fields
+    DELETE /api/v1/<resource>/<id>
+    POST   /api/v1/<resource>/batch             {"create": [..], "update": [{"id": .., ..}], "delete": [ids]}
+    GET    /api/v1/dive-sites/nearby?lat=..&lon=..&radius_km=20     sites within a radius, nearest first
+    GET    /api/v1/dive-sites/nearest?site=<id>&k=10                 the k nearest sites to a point or site
+    GET    /api/v1/trips/<id>/eligibility       who on a trip's roster may dive, with reasons
+    POST   /api/v1/trips/eligibility            the same for {"site_id": .., "date": .., "divers": [ids]}
+    GET    /api/v1/trips/<id>/plan?depth=18&minutes=40&o2=32      no-deco limits and gas for the roster
+
+Lists are paged by id with an opaque cursor. Batches are validated as a whole
+and written in one transaction: either every operation applies or none does.
+
+Reads carry an ETag and Last-Modified built from the caller's data version
+(see versions.py) and answer If-None-Match / If-Modified-Since with a 304
+before running the query, so polling costs one primary key lookup.
+
+Clients authenticate with the same session cookie as the web app (POST /login).
+"""
+
+import hashlib
+from datetime import date, datetime
+
+from flask import Blueprint, current_app, jsonify, request
+from flask_login import current_user
+from sqlalchemy import delete, or_, select, true, update
+from sqlalchemy.exc import IntegrityError
+from werkzeug.exceptions import HTTPException
+from werkzeug.http import is_resource_modified
+
+import audit
+import deletes
+import geo
+import importer
+import manifests
+import planner
+import profiles
+import stats
+import tenants
+import versions
+
+bp = Blueprint('api', __name__, url_prefix='/api/v1')
+
+DEFAULT_LIMIT = 50
+MAX_LIMIT = 500
+MAX_BATCH = 1000
+
+
+def _id(value):
+    if isinstance(value, bool) or not isinstance(value, (int, str)):
+        raise ValueError(value)
+    return int(value)
+
+
+# resource -> table, writable fields and references: {name: (converter, required on create)}
+RESOURCES = {
+    'divers': {'table': 'diver', 'fields': importer.DIVER_FIELDS, 'references': {}},
+    'dives': {'table': 'dive', 'fields': importer.DIVE_FIELDS, 'references': {'site_id': (_id, True)}},
+    'equipment': {'table': 'equipment', 'fields': importer.EQUIPMENT_FIELDS,
+                  'references': {'diver_id': (_id, True)}},
+    'certifications': {'table': 'certification', 'fields': importer.CERTIFICATION_FIELDS,
+                       'references': {'diver_id': (_id, True)}},
+    'dive-sites': {'table': 'dive_site', 'fields': importer.SITE_FIELDS, 'references': {}},
+}
+# Dives also accept and return the ids of their divers.
+DIVE_DIVERS = 'divers'
+
+
+class ApiError(Exception):
+    def __init__(self, message, status=400, errors=None):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+        self.errors = errors
+
+
+def init_app(app, db, after_write=None):
+    """Register the API. after_write(user_id, resource, other_user_ids) runs after each committed write.
+
+    other_user_ids holds the other users with a diver on a dive the write changed or deleted.
+    """
+    app.extensions['api'] = {'db': db, 'after_write': after_write}
+    app.register_blueprint(bp)
+
+    def json_errors(e):
+        # Unmatched URLs never reach the blueprint's handlers.
+        if request.path.startswith(bp.url_prefix):
+            return jsonify({'error': e.description}), e.code
+        return e
+
+    app.register_error_handler(404, json_errors)
+    app.register_error_handler(405, json_errors)
+
+
+def _db():
+    return current_app.extensions['api']['db']
+
+
+@bp.errorhandler(ApiError)
+def api_error(e):
+    body = {'error': e.message}
+    if e.errors:
+        body['errors'] = e.errors
+    return jsonify(body), e.status
+
+
+@bp.errorhandler(HTTPException)
+def http_error(e):
+    return jsonify({'error': e.description}), e.code
+
+
+@bp.before_request
+def require_login():
+    if not current_user.is_authenticated:
+        return jsonify({'error': 'Authentication required'}), 401
+
+
+def _resource(name):
+    resource = RESOURCES.get(name)
+    if resource is None:
+        raise ApiError(f'Unknown resource {name!r}', 404)
+    return resource, _db().metadata.tables[resource['table']]
+
+
+def _scope(tables, name, table, user_id, write=False):
+    """WHERE clause limiting `table` to rows owned by user_id.
+
+    Dive sites are readable when shared or the active centre's, and writable only when the active centre's
+    (any site outside a centre).
+    """
+    if name == 'dive-sites':
+        centre_id = tenants.current()
+        if not write or centre_id is None:
+            return _visible_sites(table)
+        return table.c.centre_id == centre_id
+    diver = tables['diver']
+    own_diver_ids = select(diver.c.id).where(diver.c.user_id == user_id)
+    if name == 'divers':
+        return table.c.user_id == user_id
+    if name == 'dives':
+        dive_diver = tables['dive_diver']
+        return table.c.id.in_(select(dive_diver.c.dive_id).where(dive_diver.c.diver_id.in_(own_diver_ids)))
+    if name in ('equipment', 'certifications'):
+        return table.c.diver_id.in_(own_diver_ids)
+    return true()
+
+
+# ============ Reading ============
+
+def _fields(name, table):
+    available = list(table.columns.keys()) + ([DIVE_DIVERS] if name == 'dives' else [])
+    requested = request.args.get('fields')
+    if not requested:
+        return available
+    fields = [field.strip() for field in requested.split(',') if field.strip()]
+    unknown = [field for field in fields if field not in available]
+    if unknown:
+        raise ApiError(f"Unknown field(s) {', '.join(unknown)}; available: {', '.join(available)}")
+    return ['id'] + [field for field in fields if field != 'id']
+
+
+def _serialize(value):
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    return value
+
+
+def _rows(conn, tables, table, fields, where, limit=None):
+    query = select(*[table.c[field] for field in fields if field != DIVE_DIVERS]).where(*where).order_by(table.c.id)
+    if limit is not None:
+        query = query.limit(limit)
+    rows = [{key: _serialize(value) for key, value in row.items()} for row in conn.execute(query).mappings()]
+    if DIVE_DIVERS in fields and rows:
+        dive_diver = tables['dive_diver']
+        by_dive = {row['id']: row for row in rows}
+        for row in rows:
+            row[DIVE_DIVERS] = []
+        for dive_id, diver_id in conn.execute(
+                select(dive_diver.c.dive_id, dive_diver.c.diver_id)
+                .where(dive_diver.c.dive_id.in_(list(by_dive))).order_by(dive_diver.c.diver_id)):
+            by_dive[dive_id][DIVE_DIVERS].append(diver_id)
+    return rows
+
+
+def _validators(conn, tables, name):
+    """(etag, last_modified) for this request from the data version it reads."""
+    if name == 'dive-sites':
+        version, changed_at = versions.current(conn, tables, versions.SITES_SCOPE, tenants.sites_schema())
+    else:
+        version, changed_at = versions.current(conn, tables, versions.user_scope(current_user.id))
+    etag = hashlib.sha1(f'{current_user.id}|{version}|{request.full_path}'.encode()).hexdigest()[:24]
+    return etag, changed_at
+
+
+def _conditional(body_factory, etag, last_modified):
+    """304 when the client's copy is current, otherwise the JSON from body_factory() with validators."""
+    if not is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+        response = current_app.response_class(status=304)
+    else:
+        response = jsonify(body_factory())
+    response.set_etag(etag)
+    if last_modified is not None:
+        response.last_modified = last_modified
+    # Per-user data: clients may keep it but must revalidate before reuse.
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
+
+
+@bp.route('/<name>', methods=['GET'])
+def list_resource(name):
+    _, table = _resource(name)
+    db = _db()
+    tables, conn = db.metadata.tables, db.session.connection()
+    fields = _fields(name, table)
+    limit = max(1, min(request.args.get('limit', DEFAULT_LIMIT, type=int), MAX_LIMIT))
+    cursor = request.args.get('cursor')
+    if cursor is not None and not cursor.isdigit():
+        raise ApiError('Invalid cursor')
+
+    def body():
+        where = [_scope(tables, name, table, current_user.id)]
+        if cursor is not None:
+            where.append(table.c.id > int(cursor))
+        rows = _rows(conn, tables, table, fields, where, limit + 1)
+        return {'data': rows[:limit], 'next_cursor': str(rows[limit - 1]['id']) if len(rows) > limit else None}
+
+    return _conditional(body, *_validators(conn, tables, name))
+
+
+@bp.route('/<name>/<int:item_id>', methods=['GET'])
+def get_resource(name, item_id):
+    _, table = _resource(name)
+    db = _db()
+    tables, conn = db.metadata.tables, db.session.connection()
+    fields = _fields(name, table)
+
+    def body():
+        rows = _rows(conn, tables, table, fields, [table.c.id == item_id, _scope(tables, name, table, current_user.id)])
+        if not rows:
+            raise ApiError('Not found', 404)
+        return {'data': rows[0]}
+
+    # A deleted item changes the version too, so a 304 is never sent for it.
+    return _conditional(body, *_validators(conn, tables, name))
+
+
+# ============ Nearby dive sites ============
+
+def _visible_sites(table):
+    centre_id = tenants.current()
+    return true() if centre_id is None else or_(table.c.centre_id == centre_id, table.c.centre_id.is_(None))
+
+
+def _origin(conn, table):
+    """(latitude, longitude, origin site id or None) from ?lat=&lon= or ?site=<id>."""
+    site_id = request.args.get('site', type=int)
+    if site_id is not None:
+        row = conn.execute(select(table.c.latitude, table.c.longitude).where(
+            table.c.id == site_id, _visible_sites(table))).first()
+        if row is None:
+            raise ApiError('Not found', 404)
+        if row.latitude is None or row.longitude is None:
+            raise ApiError(f'Dive site {site_id} has no coordinates', 422)
+        return row.latitude, row.longitude, site_id
+    latitude, longitude = request.args.get('lat', type=float), request.args.get('lon', type=float)
+    if latitude is None or longitude is None:
+        raise ApiError('Give lat and lon, or site')
+    try:
+        geo.check_point(latitude, longitude)
+    except ValueError as e:
+        raise ApiError(str(e)) from None
+    return latitude, longitude, None
+
+
+def _positive(name, default=None):
+    value = request.args.get(name, default, type=float)
+    if value is None or not value > 0:
+        raise ApiError(f'{name} must be a positive number')
+    return value
+
+
+def _nearby(find, count):
+    """The first `count` sites from find(conn, latitude, longitude, n) -> [(id, km)], other than the origin
+    site, with their distance_km. find() is asked for one more when the origin is a site, which it also finds."""
+    db = _db()
+    tables, conn = db.metadata.tables, db.session.connection()
+    table = tables['dive_site']
+    fields = _fields('dive-sites', table)
+    latitude, longitude, origin_id = _origin(conn, table)
+
+    def body():
+        found = find(conn, latitude, longitude, count + (origin_id is not None))
+        ranked = [(site_id, distance) for site_id, distance in found if site_id != origin_id][:count]
+        rows = _rows(conn, tables, table, fields, [table.c.id.in_([site_id for site_id, _ in ranked])])
+        by_id = {row['id']: row for row in rows}
+        return {'data': [dict(by_id[site_id], distance_km=round(distance, 3)) for site_id, distance in ranked],
+                'origin': {'lat': latitude, 'lon': longitude, 'site': origin_id}}
+
+    return _conditional(body, *_validators(conn, tables, 'dive-sites'))
+
+
+@bp.route('/dive-sites/nearby', methods=['GET'])
+def nearby_sites():
+    radius_km = _positive('radius_km')
+    limit = max(1, min(request.args.get('limit', DEFAULT_LIMIT, type=int), MAX_LIMIT))
+    return _nearby(lambda conn, latitude, longitude, n: geo.within(
+        conn, latitude, longitude, radius_km, n, tenants.current()), limit)
+
+
+@bp.route('/dive-sites/nearest', methods=['GET'])
+def nearest_sites():
+    k = max(1, min(request.args.get('k', 10, type=int), MAX_LIMIT))
+    max_km = _positive('max_km') if 'max_km' in request.args else None
+    return _nearby(lambda conn, latitude, longitude, n: geo.nearest(
+        conn, latitude, longitude, n, max_km, tenants.current()), k)
+
+
+# ============ Trip eligibility ============
+
+def _eligibility(results):
+    return jsonify({'data': results, 'summary': manifests.summary(results)})
+
+
+@bp.route('/trips/<int:trip_id>/eligibility', methods=['GET'])
+def trip_eligibility(trip_id):
+    db = _db()
+    tables, conn = db.metadata.tables, db.session.connection()
+    trip = tables['trip']
+    if conn.execute(select(trip.c.id).where(trip.c.id == trip_id, trip.c.user_id == current_user.id)).first() is None:
+        raise ApiError('Not found', 404)
+    return _eligibility(manifests.check_trip(conn, tables, trip_id))
+
+
+@bp.route('/trips/eligibility', methods=['POST'])
+def roster_eligibility():
+    body = _json_body()
+    if not isinstance(body, dict) or not isinstance(body.get('divers'), list):
+        raise ApiError('Expected an object with "site_id", "date" and a "divers" list of diver ids')
+    try:
+        site_id = _id(body.get('site_id'))
+        on = date.fromisoformat(str(body.get('date'))[:10])
+        diver_ids = [_id(value) for value in body['divers']]
+    except (TypeError, ValueError):
+        raise ApiError('"site_id" and "divers" must be ids and "date" an ISO date') from None
+    db = _db()
+    tables, conn = db.metadata.tables, db.session.connection()
+    site = tables['dive_site']
+    if conn.execute(select(site.c.id).where(site.c.id == site_id, _visible_sites(site))).first() is None:
+        raise ApiError(f'Unknown dive site {site_id}', 404)
+    if len(diver_ids) > manifests.MAX_ROSTER:
+        raise ApiError(f'A roster is limited to {manifests.MAX_ROSTER} divers', 413)
+    return _eligibility(manifests.check(conn, tables, site_id, on, diver_ids, current_user.id))
+
+
+# ============ Dive planning ============
+
+@bp.route('/trips/<int:trip_id>/plan', methods=['GET'])
+def trip_plan(trip_id):
+    db = _db()
+    tables, conn = db.metadata.tables, db.session.connection()
+    trip = tables['trip']
+    if conn.execute(select(trip.c.id).where(trip.c.id == trip_id, trip.c.user_id == current_user.id)).first() is None:
+        raise ApiError('Not found', 404)
+    try:
+        result = planner.plan_trip(conn, tables, trip_id, request.args.get('depth', type=float),
+                                   request.args.get('minutes', planner.PLAN_MINUTES, type=int),
+                                   request.args.get('o2', 21, type=float) / 100)
+    except ValueError as e:
+        raise ApiError(str(e)) from None
+    divers = result.pop('divers')
+    for diver in divers:
+        if diver['last_surfaced'] is not None:
+            diver['last_surfaced'] = diver['last_surfaced'].isoformat()
+    result['departure'] = result['departure'].isoformat()
+    return jsonify({'data': divers, 'plan': result})
+
+
+# ============ Writing ============
+
+def _convert(resource, record, partial):
+    """Validate one JSON object into (column values, diver ids or None). Raises importer.RowError."""
+    if not isinstance(record, dict):
+        raise importer.RowError('expected an object')
+    specs = dict(resource['fields'], **resource['references'])
+    allowed = set(specs) | ({DIVE_DIVERS} if resource['table'] == 'dive' else set())
+    unknown = sorted(set(record) - allowed - {'id'})
+    if unknown:
+        raise importer.RowError(f"unknown field(s) {', '.join(unknown)}")
+    values = {}
+    for name, (convert, required) in specs.items():
+        if name not in record:
+            if required and not partial:
+                raise importer.RowError(f'missing required field {name!r}')
+            continue
+        raw = record[name]
+        if raw is None or (isinstance(raw, str) and not raw.strip()):
+            if required:
+                raise importer.RowError(f'{name!r} cannot be empty')
+            values[name] = None
+            continue
+        try:
+            values[name] = convert(raw)
+        except (TypeError, ValueError):
+            raise importer.RowError(f'invalid value for {name!r}: {raw!r}') from None
+    diver_ids = None
+    if resource['table'] == 'dive' and (DIVE_DIVERS in record or not partial):
+        # A dive belongs to its owners through its divers, so it always needs at least one.
+        if not isinstance(record.get(DIVE_DIVERS), list) or not record[DIVE_DIVERS]:
+            raise importer.RowError(f'{DIVE_DIVERS!r} must be a non-empty list of diver ids')
+        try:
+            diver_ids = sorted({_id(value) for value in record[DIVE_DIVERS]})
+        except (TypeError, ValueError):
+            raise importer.RowError(f'invalid diver id in {DIVE_DIVERS!r}') from None
+    return values, diver_ids
+
+
+def _check_references(values, diver_ids, own_diver_ids, site_ids):
+    if values.get('diver_id') is not None and values['diver_id'] not in own_diver_ids:
+        raise importer.RowError(f"unknown diver {values['diver_id']}")
+    if values.get('site_id') is not None and values['site_id'] not in site_ids:
+        raise importer.RowError(f"unknown dive site {values['site_id']}")
+    missing = sorted(set(diver_ids or ()) - own_diver_ids)
+    if missing:
+        raise importer.RowError(f"unknown diver(s) {', '.join(map(str, missing))}")
+
+
+def _plan(conn, tables, name, resource, table, body):
+    """Validate a whole batch. Returns (creates, updates, delete ids) or raises ApiError listing every error."""
+    if not isinstance(body, dict) or not set(body) <= {'create', 'update', 'delete'}:
+        raise ApiError('Expected an object with "create", "update" and/or "delete" lists')
+    operations = {op: body.get(op) or [] for op in ('create', 'update', 'delete')}
+    if not all(isinstance(items, list) for items in operations.values()):
+        raise ApiError('"create", "update" and "delete" must be lists')
+    if sum(map(len, operations.values())) > MAX_BATCH:
+        raise ApiError(f'A batch is limited to {MAX_BATCH} operations', 413)
+
+    diver = tables['diver']
+    own_diver_ids = set(conn.execute(select(diver.c.id).where(diver.c.user_id == current_user.id)).scalars())
+    site_ids = set()
+    if name == 'dives':
+        site = tables['dive_site']
+        site_ids = set(conn.execute(select(site.c.id).where(_visible_sites(site))).scalars())
+    target_ids = [item.get('id') if isinstance(item, dict) else None for item in operations['update']]
+    target_ids += operations['delete']
+    visible = set()
+    if target_ids:
+        numeric = [value for value in target_ids if isinstance(value, int) and not isinstance(value, bool)]
+        visible = set(conn.execute(select(table.c.id).where(
+            table.c.id.in_(numeric), _scope(tables, name, table, current_user.id, write=True))).scalars())
+
+    errors, creates, updates = [], [], []
+    for index, record in enumerate(operations['create']):
+        try:
+            values, diver_ids = _convert(resource, record, partial=False)
+            _check_references(values, diver_ids, own_diver_ids, site_ids)
+            creates.append((values, diver_ids))
+        except importer.RowError as e:
+            errors.append({'op': 'create', 'index': index, 'error': str(e)})
+    for index, record in enumerate(operations['update']):
+        try:
+            values, diver_ids = _convert(resource, record, partial=True)
+            if record.get('id') not in visible:
+                raise importer.RowError(f"not found: {record.get('id')!r}")
+            _check_references(values, diver_ids, own_diver_ids, site_ids)
+            updates.append((record['id'], values, diver_ids))
+        except importer.RowError as e:
+            errors.append({'op': 'update', 'index': index, 'error': str(e)})
+    for index, item_id in enumerate(operations['delete']):
+        if item_id not in visible:
+            errors.append({'op': 'delete', 'index': index, 'error': f'not found: {item_id!r}'})
+    if errors:
+        raise ApiError('Batch rejected; nothing was written', 422, errors)
+    return creates, updates, operations['delete']
+
+
+def _delete(conn, tables, name, table, ids):
+    if name == 'dives':
+        stats.remove_dives(conn, tables, ids)
+        profiles.remove(conn, tables, ids)
+        manifests.unlink_dives(conn, tables, ids)
+        conn.execute(delete(tables['dive_diver']).where(tables['dive_diver'].c.dive_id.in_(ids)))
+    elif name == 'divers':
+        deletes.delete_divers(conn, tables, ids)
+        return
+    conn.execute(delete(table).where(table.c.id.in_(ids)))
+
+
+def _apply(conn, tables, name, table, creates, updates, delete_ids):
+    created = []
+    dive_diver, diver = tables['dive_diver'], tables['diver']
+    own_diver_ids = select(diver.c.id).where(diver.c.user_id == current_user.id)
+    if creates:
+        # executemany needs every row to bind the same columns
+        columns = set().union(*(values for values, _ in creates))
+        rows = [dict(dict.fromkeys(columns), **values) for values, _ in creates]
+        if name == 'divers':
+            rows = [dict(row, user_id=current_user.id) for row in rows]
+        elif name == 'dive-sites':
+            rows = [dict(row, centre_id=tenants.current()) for row in rows]
+        created = conn.execute(table.insert().returning(table.c.id, sort_by_parameter_order=True), rows).scalars().all()
+        links = [{'dive_id': item_id, 'diver_id': diver_id}
+                 for item_id, (_, diver_ids) in zip(created, creates) for diver_id in diver_ids or ()]
+        if links:
+            conn.execute(dive_diver.insert(), links)
+    if name == 'dives':
+        stats.add_dives(conn, tables, created)
+
+    updated = [item_id for item_id, _, _ in updates]
+    if name == 'dives':
+        stats.remove_dives(conn, tables, updated)
+    for item_id, values, diver_ids in updates:
+        if values:
+            conn.execute(update(table).where(table.c.id == item_id).values(**values))
+        if diver_ids is not None:
+            # only the caller's divers are replaced; other users' divers on a shared dive stay
+            conn.execute(delete(dive_diver).where(dive_diver.c.dive_id == item_id,
+                                                  dive_diver.c.diver_id.in_(own_diver_ids)))
+            conn.execute(dive_diver.insert(), [{'dive_id': item_id, 'diver_id': diver_id} for diver_id in diver_ids])
+    if name == 'dives':
+        stats.add_dives(conn, tables, updated)
+
+    if delete_ids:
+        _delete(conn, tables, name, table, delete_ids)
+    return {'created': created, 'updated': updated, 'deleted': delete_ids}
+
+
+def _rosters(conn, tables, dive_ids):
+    """dive id -> sorted diver ids on that dive."""
+    dive_diver = tables['dive_diver']
+    rosters = {dive_id: [] for dive_id in dive_ids}
+    for dive_id, diver_id in conn.execute(select(dive_diver.c.dive_id, dive_diver.c.diver_id)
+                                          .where(dive_diver.c.dive_id.in_(list(rosters)))
+                                          .order_by(dive_diver.c.diver_id)):
+        rosters[dive_id].append(diver_id)
+    return rosters
+
+
+def _dive_owners(conn, tables, dive_ids):
+    """Users with a diver on any of the dives."""
+    diver, dive_diver = tables['diver'], tables['dive_diver']
+    return set(conn.execute(select(diver.c.user_id).distinct().join(dive_diver, dive_diver.c.diver_id == diver.c.id)
+                            .where(dive_diver.c.dive_id.in_(dive_ids))).scalars())
+
+
+def _snapshot(conn, tables, name, table, updates, delete_ids):
+    """Current values of the rows a batch is about to change, for the audit log."""
+    before = audit.rows(conn, table, [item_id for item_id, _, _ in updates] + list(delete_ids))
+    if name == 'dives':
+        for dive_id, divers in _rosters(conn, tables, before).items():
+            before[dive_id]['divers'] = divers
+    return before
+
+
+def _record(session, table, creates, updates, before, result, rosters):
+    """Audit a batch; rosters holds the full diver list of each updated dive after the write."""
+    def with_divers(values, diver_ids):
+        return values if diver_ids is None else dict(values, divers=sorted(diver_ids))
+    audit.record_rows(session, 'insert', table.name, {
+        item_id: with_divers(values, diver_ids) for item_id, (values, diver_ids) in zip(result['created'], creates)})
+    audit.record_rows(session, 'update', table.name, {
+        item_id: audit.diff(before[item_id], with_divers(values, None if diver_ids is None else rosters[item_id]))
+        for item_id, values, diver_ids in updates})
+    audit.record_rows(session, 'delete', table.name, {item_id: before[item_id] for item_id in result['deleted']})
+
+
+def _write(name, body):
+    resource, table = _resource(name)
+    if name == 'dive-sites' and current_user.role != 'admin':
+        raise ApiError('Unauthorized', 403)
+    db = _db()
+    tables, conn = db.metadata.tables, db.session.connection()
+    try:
+        creates, updates, delete_ids = _plan(conn, tables, name, resource, table, body)
+        before = _snapshot(conn, tables, name, table, updates, delete_ids)
+        owners = _dive_owners(conn, tables, list(before)) if name == 'dives' else set()
+        result = _apply(conn, tables, name, table, creates, updates, delete_ids)
+        rosters = _rosters(conn, tables, result['updated']) if name == 'dives' else {}
+        _record(db.session, table, creates, updates, before, result, rosters)
+        db.session.commit()
+    except IntegrityError as e:
+        db.session.rollback()
+        raise ApiError(f'Rejected by database: {e.orig}', 409) from None
+    except Exception:
+        db.session.rollback()
+        raise
+    after_write = current_app.extensions['api']['after_write']
+    if after_write is not None:
+        after_write(current_user.id, name, owners - {current_user.id})
+    return result
+
+
+def _json_body():
+    body = request.get_json(silent=True)
+    if body is None:
+        raise ApiError('Expected a JSON body')
+    return body
+
+
+@bp.route('/<name>/batch', methods=['POST'])
+def batch(name):
+    return jsonify({'data': _write(name, _json_body())})
+
+
+@bp.route('/<name>', methods=['POST'])
+def create_resource(name):
+    result = _write(name, {'create': [_json_body()]})
+    response = get_resource(name, result['created'][0])
+    response.status_code = 201
+    return response
+
+
+def _require_visible(name, item_id):
+    """404 unless the current user may change the item."""
+    _, table = _resource(name)
+    db = _db()
+    found = db.session.connection().execute(select(table.c.id).where(
+        table.c.id == item_id, _scope(db.metadata.tables, name, table, current_user.id, write=True))).first()
+    if found is None:
+        raise ApiError('Not found', 404)
+
+
+@bp.route('/<name>/<int:item_id>', methods=['PATCH'])
+def update_resource(name, item_id):
+    _require_visible(name, item_id)
+    body = _json_body()
+    if isinstance(body, dict):
+        body = dict(body, id=item_id)
+    _write(name, {'update': [body]})
+    return get_resource(name, item_id)
+
+
+@bp.route('/<name>/<int:item_id>', methods=['DELETE'])
+def delete_resource(name, item_id):
+    _require_visible(name, item_id)
+    _write(name, {'delete': [item_id]})
+    return '', 204
@@ -1,38 +1,137 @@
-from flask import Flask, render_template, request, jsonify, redirect, url_for, session, flash
+from flask import Flask, Response, g, render_template, request, jsonify, redirect, url_for, session, flash, send_file, stream_with_context
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager, login_user, logout_user, login_required, current_user
+from sqlalchemy import func, select, tuple_
+from sqlalchemy.orm import joinedload, make_transient_to_detached, selectinload
 from werkzeug.security import generate_password_hash, check_password_hash
-from datetime import datetime
+from werkzeug.utils import secure_filename
+from datetime import datetime, timedelta
+from functools import lru_cache
+import json
+import uuid
+from jinja2 import FileSystemBytecodeCache
 import os
 
+import alerts
+import api
+import audit
+import backups
+import deletes
+import exporter
+import geo
+import importer
+import jobs
+import manifests
+import planner
+import profiles
+import search
+import server
+import stats
+import storage
+import tenants
+from cache import PageCache, TTLCache
+from profiling import RequestProfiler
+
 app = Flask(__name__)
 app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'dev-key-change-in-production')
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///diving_admin.db'
+app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL', 'sqlite:///diving_admin.db')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+app.config['STORAGE_PROFILE'] = os.environ.get('STORAGE_PROFILE', 'production')
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = storage.engine_options(
+    app.config['STORAGE_PROFILE'], app.config['SQLALCHEMY_DATABASE_URI'])
+app.config['PROFILER_ENABLED'] = os.environ.get('PROFILER_ENABLED', '1') != '0'
+app.config['SLOW_REQUEST_MS'] = float(os.environ.get('SLOW_REQUEST_MS', 500))
+app.config['N_PLUS_ONE_THRESHOLD'] = int(os.environ.get('N_PLUS_ONE_THRESHOLD', 10))
+app.config['DASHBOARD_CACHE_TTL'] = int(os.environ.get('DASHBOARD_CACHE_TTL', 300))
+# PBKDF2-HMAC-SHA512 at 210k iterations meets current OWASP guidance at well under
+# werkzeug's default cost; pick another with benchmarks/password_hashing.py.
+app.config['PASSWORD_HASH_METHOD'] = os.environ.get('PASSWORD_HASH_METHOD', 'pbkdf2:sha512:210000')
+app.config['AUTH_CACHE_TTL'] = int(os.environ.get('AUTH_CACHE_TTL', 30))
+app.config['PAGE_CACHE_TTL'] = int(os.environ.get('PAGE_CACHE_TTL', 300))
+app.config['PAGE_CACHE_SIZE'] = int(os.environ.get('PAGE_CACHE_SIZE', 512))
+app.config['ALERT_WINDOW_DAYS'] = int(os.environ.get('ALERT_WINDOW_DAYS', alerts.DEFAULT_WINDOW_DAYS))
+app.config['ALERT_GRACE_DAYS'] = int(os.environ.get('ALERT_GRACE_DAYS', alerts.DEFAULT_GRACE_DAYS))
+# Seconds between in-process refreshes of due items; 0 leaves it to alerts_job.py (cron).
+app.config['ALERT_REFRESH_INTERVAL'] = int(os.environ.get('ALERT_REFRESH_INTERVAL', 3600))
+app.config['JOB_WORKERS'] = int(os.environ.get('JOB_WORKERS', 2))
+app.config['JOB_POLL_INTERVAL'] = int(os.environ.get('JOB_POLL_INTERVAL', 5))
+app.config['AUDIT_QUEUE_SIZE'] = int(os.environ.get('AUDIT_QUEUE_SIZE', 10000))
+app.config['AUDIT_BATCH_SIZE'] = int(os.environ.get('AUDIT_BATCH_SIZE', 500))
+app.config['AUDIT_FLUSH_INTERVAL'] = float(os.environ.get('AUDIT_FLUSH_INTERVAL', 1.0))
+# Online backups to BACKUP_DIR (see backups.py); 0 leaves them to backup_db.py (cron).
+app.config['BACKUP_DIR'] = os.environ.get('BACKUP_DIR', os.path.join(app.instance_path, 'backups'))
+app.config['BACKUP_INTERVAL'] = int(os.environ.get('BACKUP_INTERVAL', 3600))
+app.config['BACKUP_KEEP'] = int(os.environ.get('BACKUP_KEEP', 24))
+app.config['BACKUP_KEEP_DAYS'] = int(os.environ.get('BACKUP_KEEP_DAYS', 14))
+app.config['BACKUP_PAGES_PER_STEP'] = int(os.environ.get('BACKUP_PAGES_PER_STEP', backups.PAGES_PER_STEP))
+app.config['BACKUP_STEP_SLEEP'] = float(os.environ.get('BACKUP_STEP_SLEEP', backups.STEP_SLEEP))
+# Exports read a snapshot up to this many seconds old, and the live database read-only when there is none.
+app.config['REPORTING_MAX_AGE'] = int(os.environ.get('REPORTING_MAX_AGE', 3600))
+# One SQLite file per dive centre (see tenants.py); off keeps every centre in the main database.
+app.config['TENANT_DATABASES'] = os.environ.get('TENANT_DATABASES', '0') == '1'
+# Serving (see server.py): waitress in production, the Werkzeug dev server in development.
+app.config.update(server.settings())
+
+# Compiled templates survive restarts, so the first page after a launch skips Jinja's compiler.
+os.makedirs(os.path.join(app.instance_path, 'template_cache'), exist_ok=True)
+app.jinja_env.bytecode_cache = FileSystemBytecodeCache(os.path.join(app.instance_path, 'template_cache'))
 
-db = SQLAlchemy(app)
+db = SQLAlchemy(app, session_options={'class_': tenants.TenantSession})
+with app.app_context():
+    storage.install_pragmas(db.engine, app.config['STORAGE_PROFILE'])
+profiler = RequestProfiler(app)
 login_manager = LoginManager()
 login_manager.init_app(app)
 login_manager.login_view = 'login'
 
+stats_cache = TTLCache(maxsize=4096, ttl=app.config['DASHBOARD_CACHE_TTL'])
+auth_cache = TTLCache(maxsize=4096, ttl=app.config['AUTH_CACHE_TTL'])
+page_cache = PageCache(maxsize=app.config['PAGE_CACHE_SIZE'], ttl=app.config['PAGE_CACHE_TTL'])
+centre_router = tenants.Router(app, db, enabled=app.config['TENANT_DATABASES'])
+job_queue = jobs.JobQueue(app, db, workers=app.config['JOB_WORKERS'], poll_interval=app.config['JOB_POLL_INTERVAL'])
+reporting = backups.Reporting(app, db, app.config['BACKUP_DIR'], max_age=app.config['REPORTING_MAX_AGE'])
+audit_writer = audit.AuditLog(app, db, queue_size=app.config['AUDIT_QUEUE_SIZE'],
+                              batch_size=app.config['AUDIT_BATCH_SIZE'],
+                              flush_interval=app.config['AUDIT_FLUSH_INTERVAL'])
+
+DIVES_PER_PAGE = 50
+MAX_DIVES_PER_PAGE = 200
+AUDIT_PER_PAGE = 50
+
 # ============ Models ============
 
+@lru_cache(maxsize=None)
+def hash_method_prefix(method):
+    """The method prefix werkzeug writes for `method`, e.g. 'scrypt' -> 'scrypt:32768:8:1'."""
+    return generate_password_hash('', method=method).split('$', 1)[0]
+
+class Centre(db.Model):
+    """A dive centre; its users, sites and their data are kept apart from other centres'."""
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(120), unique=True, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
 class User(db.Model):
     id = db.Column(db.Integer, primary_key=True)
+    centre_id = db.Column(db.Integer, db.ForeignKey('centre.id'), index=True)  # None: no centre
     username = db.Column(db.String(80), unique=True, nullable=False)
     email = db.Column(db.String(120), unique=True, nullable=False)
     password_hash = db.Column(db.String(255), nullable=False)
     role = db.Column(db.String(20), default='user')  # admin, instructor, user
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
-    divers = db.relationship('Diver', backref='user', lazy=True)
+    # passive_deletes: the database (or deletes.py on older files) removes children, not the ORM
+    divers = db.relationship('Diver', backref='user', lazy=True, passive_deletes=True)
     
     def set_password(self, password):
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = generate_password_hash(password, method=app.config['PASSWORD_HASH_METHOD'])
     
     def check_password(self, password):
         return check_password_hash(self.password_hash, password)
     
+    def password_needs_rehash(self):
+        return self.password_hash.split('$', 1)[0] != hash_method_prefix(app.config['PASSWORD_HASH_METHOD'])
+    
     @property
     def is_authenticated(self):
         return True
@@ -49,8 +148,12 @@ class User(db.Model):
         return str(self.id)
 
 class Diver(db.Model):
+    __table_args__ = (
+        db.Index('ix_diver_user_id_id', 'user_id', 'id'),
+    )
+    
     id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), nullable=False)
     first_name = db.Column(db.String(80), nullable=False)
     last_name = db.Column(db.String(80), nullable=False)
     certification_level = db.Column(db.String(50))  # Open Water, Advanced, etc.
@@ -62,11 +165,13 @@ class Diver(db.Model):
     medical_conditions = db.Column(db.Text)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
-    dives = db.relationship('Dive', secondary='dive_diver', backref=db.backref('divers', lazy=True))
-    equipment = db.relationship('Equipment', backref='owner', lazy=True)
+    dives = db.relationship('Dive', secondary='dive_diver', backref=db.backref('divers', lazy=True),
+                            passive_deletes=True)
+    equipment = db.relationship('Equipment', backref='owner', lazy=True, passive_deletes=True)
 
 class DiveSite(db.Model):
     id = db.Column(db.Integer, primary_key=True)
+    centre_id = db.Column(db.Integer, db.ForeignKey('centre.id'), index=True)  # None: shared by every centre
     name = db.Column(db.String(120), nullable=False, unique=True)
     location = db.Column(db.String(200), nullable=False)
     depth_min = db.Column(db.Float)
@@ -75,13 +180,19 @@ class DiveSite(db.Model):
     difficulty_level = db.Column(db.String(20))  # Beginner, Intermediate, Advanced
     water_temperature = db.Column(db.Float)
     visibility = db.Column(db.String(50))
+    latitude = db.Column(db.Float)  # decimal degrees; indexed in site_rtree (see geo.py)
+    longitude = db.Column(db.Float)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
     dives = db.relationship('Dive', backref='site', lazy=True)
 
 class Dive(db.Model):
+    __table_args__ = (
+        db.Index('ix_dive_dive_date_id', 'dive_date', 'id'),
+    )
+    
     id = db.Column(db.Integer, primary_key=True)
-    site_id = db.Column(db.Integer, db.ForeignKey('dive_site.id'), nullable=False)
+    site_id = db.Column(db.Integer, db.ForeignKey('dive_site.id'), nullable=False, index=True)
     dive_date = db.Column(db.DateTime, nullable=False)
     duration_minutes = db.Column(db.Integer)
     max_depth = db.Column(db.Float)
@@ -90,45 +201,232 @@ class Dive(db.Model):
     notes = db.Column(db.Text)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
-    dive_diver = db.relationship('Diver', secondary='dive_diver')
+    # Read-only duplicate of Dive.divers; two writable relationships would both delete the link rows
+    dive_diver = db.relationship('Diver', secondary='dive_diver', viewonly=True)
+
+class DiveProfile(db.Model):
+    """Dive computer samples for one dive, packed per channel by profiles.py."""
+    dive_id = db.Column(db.Integer, db.ForeignKey('dive.id', ondelete='CASCADE'), primary_key=True)
+    sample_count = db.Column(db.Integer, nullable=False)
+    duration_seconds = db.Column(db.Integer, nullable=False)
+    tank_litres = db.Column(db.Float)
+    source = db.Column(db.String(20))  # csv, uddf
+    time = db.Column(db.LargeBinary, nullable=False)
+    depth = db.Column(db.LargeBinary, nullable=False)
+    temperature = db.Column(db.LargeBinary)
+    pressure = db.Column(db.LargeBinary)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class Trip(db.Model):
+    """A planned boat dive and its roster (trip_diver); checked before departure by manifests.py."""
+    __table_args__ = (
+        db.Index('ix_trip_user_id_departure', 'user_id', 'departure'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), nullable=False)
+    site_id = db.Column(db.Integer, db.ForeignKey('dive_site.id'), nullable=False)
+    departure = db.Column(db.DateTime, nullable=False)
+    boat = db.Column(db.String(120))
+    notes = db.Column(db.Text)
+    dive_id = db.Column(db.Integer, db.ForeignKey('dive.id', ondelete='SET NULL'))  # set once the dive is logged
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    site = db.relationship('DiveSite')
+    divers = db.relationship('Diver', secondary='trip_diver', lazy=True, passive_deletes=True)
 
 class Equipment(db.Model):
+    __table_args__ = (
+        db.Index('ix_equipment_diver_id_id', 'diver_id', 'id'),
+        db.Index('ix_equipment_diver_id_next_maintenance', 'diver_id', 'next_maintenance'),
+    )
+    
     id = db.Column(db.Integer, primary_key=True)
-    diver_id = db.Column(db.Integer, db.ForeignKey('diver.id'), nullable=False)
+    diver_id = db.Column(db.Integer, db.ForeignKey('diver.id', ondelete='CASCADE'), nullable=False)
     equipment_type = db.Column(db.String(50), nullable=False)  # BCD, Tank, Regulator, etc.
     brand = db.Column(db.String(80))
     model = db.Column(db.String(80))
     serial_number = db.Column(db.String(100))
     purchase_date = db.Column(db.Date)
     last_maintenance = db.Column(db.Date)
-    next_maintenance = db.Column(db.Date)
+    next_maintenance = db.Column(db.Date, index=True)
     condition = db.Column(db.String(20))  # Good, Fair, Needs Repair
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
 class Certification(db.Model):
+    __table_args__ = (
+        db.Index('ix_certification_diver_id_expiration_date', 'diver_id', 'expiration_date'),
+    )
+    
     id = db.Column(db.Integer, primary_key=True)
-    diver_id = db.Column(db.Integer, db.ForeignKey('diver.id'), nullable=False)
+    diver_id = db.Column(db.Integer, db.ForeignKey('diver.id', ondelete='CASCADE'), nullable=False)
     cert_type = db.Column(db.String(100), nullable=False)
     agency = db.Column(db.String(100))
     date_issued = db.Column(db.Date, nullable=False)
-    expiration_date = db.Column(db.Date)
+    expiration_date = db.Column(db.Date, index=True)
     cert_number = db.Column(db.String(100))
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    diver = db.relationship('Diver', backref=db.backref('certifications', lazy=True, passive_deletes=True))
+
+class DueItem(db.Model):
+    """A certification expiring or equipment due for service; maintained by alerts.refresh()."""
+    __table_args__ = (
+        db.Index('ix_due_item_user_id_due_date', 'user_id', 'due_date'),
+        db.Index('ix_due_item_user_id_kind_ref_id', 'user_id', 'kind', 'ref_id'),
+    )
+    
+    # Derived data with no foreign keys, so deletes never have to clear it first
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, nullable=False)
+    diver_id = db.Column(db.Integer, nullable=False)
+    kind = db.Column(db.String(20), nullable=False)  # certification, equipment
+    ref_id = db.Column(db.Integer, nullable=False)
+    label = db.Column(db.String(300))
+    diver_name = db.Column(db.String(170))
+    due_date = db.Column(db.Date, nullable=False)
+    status = db.Column(db.String(20), nullable=False)  # expired, expiring, overdue, due_soon
+    computed_at = db.Column(db.DateTime)
+
+class DataVersion(db.Model):
+    """Change counter per scope ('user:<id>', 'sites'); bumped by the triggers in versions.py."""
+    scope = db.Column(db.String(40), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+    changed_at = db.Column(db.DateTime)
+
+class Job(db.Model):
+    """A queued, running or finished background job; see jobs.py."""
+    __table_args__ = (
+        db.Index('ix_job_status_priority_id', 'status', 'priority', 'id'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(40), nullable=False)
+    status = db.Column(db.String(20), nullable=False, default='queued')  # queued, running, done, failed, cancelled
+    priority = db.Column(db.Integer, nullable=False, default=jobs.DEFAULT_PRIORITY)
+    user_id = db.Column(db.Integer)  # who queued it; no foreign key so the history outlives users
+    params = db.Column(db.Text)  # JSON
+    result = db.Column(db.Text)  # JSON
+    error = db.Column(db.Text)
+    progress = db.Column(db.Integer, nullable=False, default=0)
+    total = db.Column(db.Integer)
+    message = db.Column(db.String(255))
+    cancel_requested = db.Column(db.Boolean, nullable=False, default=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+
+class AuditLog(db.Model):
+    """One data change, appended in batches by audit.py; triggers reject updates and deletes."""
+    __table_args__ = (
+        db.Index('ix_audit_log_created_at_id', 'created_at', 'id'),
+        db.Index('ix_audit_log_actor_id_created_at_id', 'actor_id', 'created_at', 'id'),
+        db.Index('ix_audit_log_centre_id_created_at_id', 'centre_id', 'created_at', 'id'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    created_at = db.Column(db.DateTime, nullable=False)
+    actor_id = db.Column(db.Integer)  # no foreign key: the log outlives users
+    actor = db.Column(db.String(80))
+    centre_id = db.Column(db.Integer)
+    action = db.Column(db.String(10), nullable=False)  # insert, update, delete
+    table_name = db.Column(db.String(40), nullable=False)
+    row_id = db.Column(db.String(40))
+    changes = db.Column(db.Text)  # JSON: {column: value} or, for updates, {column: [old, new]}
+    endpoint = db.Column(db.String(80))
+    remote_addr = db.Column(db.String(45))
+
+# Running dive statistics; maintained by stats.add_dives()/remove_dives(), no foreign keys
+class DiverStats(db.Model):
+    diver_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    dive_count = db.Column(db.Integer, nullable=False, default=0)
+    bottom_time_minutes = db.Column(db.Integer, nullable=False, default=0)
+    deepest_dive = db.Column(db.Float)
+    air_used_total = db.Column(db.Float, nullable=False, default=0)
+    air_dives = db.Column(db.Integer, nullable=False, default=0)
+
+class SiteStats(db.Model):
+    site_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    dive_count = db.Column(db.Integer, nullable=False, default=0)
+    bottom_time_minutes = db.Column(db.Integer, nullable=False, default=0)
+    deepest_dive = db.Column(db.Float)
+    air_used_total = db.Column(db.Float, nullable=False, default=0)
+    air_dives = db.Column(db.Integer, nullable=False, default=0)
+
+class DiverMonthStats(db.Model):
+    diver_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    month = db.Column(db.String(7), primary_key=True)  # YYYY-MM
+    dive_count = db.Column(db.Integer, nullable=False, default=0)
+    bottom_time_minutes = db.Column(db.Integer, nullable=False, default=0)
+
+class SiteMonthStats(db.Model):
+    __table_args__ = (
+        db.Index('ix_site_month_stats_month_site_id', 'month', 'site_id'),
+    )
+    
+    site_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    month = db.Column(db.String(7), primary_key=True)  # YYYY-MM
+    dive_count = db.Column(db.Integer, nullable=False, default=0)
+    bottom_time_minutes = db.Column(db.Integer, nullable=False, default=0)
 
 # Association table for many-to-many relationship
 dive_diver = db.Table('dive_diver',
-    db.Column('dive_id', db.Integer, db.ForeignKey('dive.id'), primary_key=True),
-    db.Column('diver_id', db.Integer, db.ForeignKey('diver.id'), primary_key=True)
+    db.Column('dive_id', db.Integer, db.ForeignKey('dive.id', ondelete='CASCADE'), primary_key=True),
+    db.Column('diver_id', db.Integer, db.ForeignKey('diver.id', ondelete='CASCADE'), primary_key=True),
+    db.Index('ix_dive_diver_diver_id_dive_id', 'diver_id', 'dive_id')
+)
+
+trip_diver = db.Table('trip_diver',
+    db.Column('trip_id', db.Integer, db.ForeignKey('trip.id', ondelete='CASCADE'), primary_key=True),
+    db.Column('diver_id', db.Integer, db.ForeignKey('diver.id', ondelete='CASCADE'), primary_key=True),
+    db.Index('ix_trip_diver_diver_id', 'diver_id')
 )
 
+# Every ORM query on these sees only the active centre's rows (see tenants.py)
+tenants.scope(User)
+tenants.scope(DiveSite, shared=True)
+
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
+    """Load the session user, from a short-lived identity cache when possible.
+    
+    Cached column values are attached to the current session with
+    merge(load=False), so a cache hit costs no query and relationships
+    still lazy-load as usual.
+    """
+    user_id = int(user_id)
+    values = auth_cache.get(user_id)
+    if values is None:
+        user = db.session.get(User, user_id)
+        if user is not None:
+            auth_cache.set(user_id, {column.key: getattr(user, column.key)
+                                     for column in User.__table__.columns if column.key != 'password_hash'})
+        return user
+    
+    user = User(**values)
+    make_transient_to_detached(user)
+    return db.session.merge(user, load=False)
 
 @login_manager.unauthorized_handler
 def unauthorized():
     return redirect(url_for('login'))
 
+@app.before_request
+def activate_centre():
+    """Scope the request to the user's centre, or to the centre a deployment admin switched to."""
+    if current_user.is_authenticated:
+        g.centre_id = current_user.centre_id
+        if g.centre_id is None and current_user.role == 'admin':
+            g.centre_id = session.get('centre_id')
+
+def visible_site(site_id):
+    """The dive site with this id if the active centre can see it (its own or a shared one), else None."""
+    return DiveSite.query.filter_by(id=site_id).first() if site_id else None
+
+def is_deployment_admin(user):
+    """Admins without a centre manage every centre."""
+    return user.role == 'admin' and user.centre_id is None
+
 # ============ Routes ============
 
 @app.route('/')
@@ -151,6 +449,7 @@ def register():
         user.set_password(password)
         db.session.add(user)
         db.session.commit()
+        invalidate_stats()
         
         return redirect(url_for('login'))
     return render_template('register.html')
@@ -163,6 +462,9 @@ def login():
         user = User.query.filter_by(username=username).first()
         
         if user and user.check_password(password):
+            if user.password_needs_rehash():
+                user.set_password(password)
+                db.session.commit()
             login_user(user)
             return redirect(url_for('dashboard'))
         flash('Invalid username or password', 'error')
@@ -175,19 +477,58 @@ def logout():
     logout_user()
     return redirect(url_for('login'))
 
+def dashboard_stats(user):
+    """Counts for the dashboard, computed in a single SELECT and cached per user."""
+    stats = stats_cache.get(user.id)
+    if stats is not None:
+        return stats
+    
+    own_diver_ids = select(Diver.id).where(Diver.user_id == user.id)
+    columns = [
+        select(func.count()).select_from(Diver)
+            .where(Diver.user_id == user.id).scalar_subquery().label('diver_count'),
+        select(func.count(dive_diver.c.dive_id.distinct()))
+            .where(dive_diver.c.diver_id.in_(own_diver_ids)).scalar_subquery().label('dive_count'),
+        select(func.count()).select_from(Equipment)
+            .where(Equipment.diver_id.in_(own_diver_ids)).scalar_subquery().label('equipment_count'),
+    ]
+    if user.role == 'admin':
+        columns.append(select(func.count()).select_from(User).scalar_subquery().label('user_count'))
+    
+    stats = db.session.execute(select(*columns)).one()._asdict()
+    stats.setdefault('user_count', None)
+    stats['alerts'] = alerts.summary(db.session.connection(), db.metadata.tables, user.id)
+    stats_cache.set(user.id, stats)
+    return stats
+
+def invalidate_stats(user_id=None):
+    """Drop cached dashboard stats and pages for one user, or for everyone when user_id is None."""
+    if user_id is None:
+        stats_cache.clear()
+        page_cache.clear()
+    else:
+        stats_cache.delete(user_id)
+        page_cache.bump(f'user:{user_id}')
+
+def dive_owner_ids(dive_ids):
+    """Users with a diver on any of the dives, whose cached pages show them."""
+    return {user_id for user_id, in db.session.query(Diver.user_id).distinct().join(
+        dive_diver, dive_diver.c.diver_id == Diver.id).filter(dive_diver.c.dive_id.in_(dive_ids))}
+
+def diver_dive_ids(diver_id):
+    return db.session.query(dive_diver.c.dive_id).filter(dive_diver.c.diver_id == diver_id)
+
+def refresh_alerts(user_id):
+    """Recompute one user's due items after a write and drop their cached dashboard."""
+    alerts.refresh(db.session.connection(), db.metadata.tables, user_id,
+                   window_days=app.config['ALERT_WINDOW_DAYS'], grace_days=app.config['ALERT_GRACE_DAYS'])
+    db.session.commit()
+    invalidate_stats(user_id)
+
 @app.route('/dashboard')
 @login_required
 def dashboard():
-    diver_count = Diver.query.filter_by(user_id=current_user.id).count()
-    dive_count = db.session.query(Dive).join(dive_diver).join(Diver).filter(Diver.user_id == current_user.id).count()
-    equipment_count = db.session.query(Equipment).join(Diver).filter(Diver.user_id == current_user.id).count()
-    user_count = User.query.count() if current_user.role == 'admin' else None
-    
-    return render_template('dashboard.html', 
-                         diver_count=diver_count,
-                         dive_count=dive_count,
-                         equipment_count=equipment_count,
-                         user_count=user_count)
+    return render_template('dashboard.html', alert_styles=alerts.STATUSES, **dashboard_stats(current_user))
 
 # ============ Diver Routes ============
 
@@ -207,6 +548,7 @@ def divers():
         )
         db.session.add(diver)
         db.session.commit()
+        invalidate_stats(current_user.id)
         return redirect(url_for('divers'))
     
     user_divers = Diver.query.filter_by(user_id=current_user.id).all()
@@ -214,13 +556,15 @@ def divers():
 
 @app.route('/diver/<int:diver_id>')
 @login_required
+@page_cache.page('user:{user}')
 def diver_detail(diver_id):
     diver = Diver.query.get_or_404(diver_id)
     if diver.user_id != current_user.id:
         return jsonify({'error': 'Unauthorized'}), 403
     
     equipment = Equipment.query.filter_by(diver_id=diver_id).all()
-    return render_template('diver_detail.html', diver=diver, equipment=equipment)
+    diver_stats = stats.summary(db.session.connection(), db.metadata.tables, 'diver', diver_id)
+    return render_template('diver_detail.html', diver=diver, equipment=equipment, stats=diver_stats)
 
 @app.route('/diver/<int:diver_id>/edit', methods=['POST'])
 @login_required
@@ -237,6 +581,10 @@ def edit_diver(diver_id):
     diver.emergency_contact = request.form.get('emergency_contact', diver.emergency_contact)
     
     db.session.commit()
+    refresh_alerts(current_user.id)
+    # Shared dives list the diver by name
+    for user_id in dive_owner_ids(diver_dive_ids(diver_id)):
+        invalidate_stats(user_id)
     return redirect(url_for('diver_detail', diver_id=diver_id))
 
 @app.route('/diver/<int:diver_id>/delete', methods=['POST'])
@@ -246,8 +594,13 @@ def delete_diver(diver_id):
     if diver.user_id != current_user.id:
         return jsonify({'error': 'Unauthorized'}), 403
     
-    db.session.delete(diver)
+    owners = dive_owner_ids(diver_dive_ids(diver.id))
+    audit.record_deletes(db.session, Diver.__table__, [diver.id])
+    deletes.delete_divers(db.session.connection(), db.metadata.tables, [diver.id])
     db.session.commit()
+    refresh_alerts(current_user.id)
+    for user_id in owners:
+        invalidate_stats(user_id)
     return redirect(url_for('divers'))
 
 # ============ Equipment Routes ============
@@ -269,13 +622,21 @@ def equipment():
             serial_number=request.form.get('serial_number'),
             condition=request.form.get('condition', 'Good')
         )
+        for field in ('last_maintenance', 'next_maintenance'):
+            value = request.form.get(field)
+            if value:
+                setattr(eq, field, datetime.strptime(value, '%Y-%m-%d').date())
         db.session.add(eq)
         db.session.commit()
+        refresh_alerts(current_user.id)
         return redirect(url_for('equipment'))
     
-    user_equipment = db.session.query(Equipment).join(Diver).filter(Diver.user_id == current_user.id).all()
+    user_equipment = db.session.query(Equipment).join(Diver).filter(
+        Diver.user_id == current_user.id).options(joinedload(Equipment.owner)).all()
     user_divers = Diver.query.filter_by(user_id=current_user.id).all()
-    return render_template('equipment.html', equipment=user_equipment, divers=user_divers)
+    statuses = alerts.statuses(db.session.connection(), db.metadata.tables, current_user.id, 'equipment')
+    return render_template('equipment.html', equipment=user_equipment, divers=user_divers,
+                           statuses=statuses, status_styles=alerts.STATUSES)
 
 @app.route('/equipment/<int:eq_id>/delete', methods=['POST'])
 @login_required
@@ -287,14 +648,26 @@ def delete_equipment(eq_id):
     
     db.session.delete(eq)
     db.session.commit()
+    refresh_alerts(current_user.id)
     return redirect(url_for('equipment'))
 
 # ============ Dive Sites Routes ============
 
 @app.route('/dive-sites', methods=['GET', 'POST'])
 @login_required
+@page_cache.page('user:{user}', 'sites', 'site_stats')
 def dive_sites():
     if request.method == 'POST' and current_user.role == 'admin':
+        latitude = request.form.get('latitude', type=float)
+        longitude = request.form.get('longitude', type=float)
+        try:
+            if (latitude is None) != (longitude is None):
+                raise ValueError('Enter both latitude and longitude, or neither')
+            if latitude is not None:
+                geo.check_point(latitude, longitude)
+        except ValueError as e:
+            flash(str(e), 'error')
+            return redirect(url_for('dive_sites'))
         site = DiveSite(
             name=request.form.get('name'),
             location=request.form.get('location'),
@@ -302,23 +675,74 @@ def dive_sites():
             depth_max=request.form.get('depth_max', type=float),
             description=request.form.get('description'),
             difficulty_level=request.form.get('difficulty_level'),
-            water_temperature=request.form.get('water_temperature', type=float)
+            water_temperature=request.form.get('water_temperature', type=float),
+            latitude=latitude,
+            longitude=longitude
         )
         db.session.add(site)
         db.session.commit()
+        page_cache.bump('sites')
         return redirect(url_for('dive_sites'))
     
-    sites = DiveSite.query.all()
-    return render_template('dive_sites.html', sites=sites)
+    # The site list is the same for everyone in a centre; only the page around it is per user.
+    site_cards = page_cache.fragment(f'site_cards:{tenants.current()}', ('sites', 'site_stats'), lambda: render_template(
+        'site_cards.html', sites=DiveSite.query.all(),
+        site_stats=stats.site_summaries(db.session.connection(), db.metadata.tables)))
+    return render_template('dive_sites.html', site_cards=site_cards)
 
 # ============ Dives Routes ============
 
+def encode_dive_cursor(dive):
+    return f"{dive.dive_date.isoformat()}_{dive.id}"
+
+def decode_dive_cursor(cursor):
+    """Parse a `<dive_date>_<id>` cursor; a malformed cursor restarts from the newest dive."""
+    if not cursor:
+        return None
+    try:
+        dive_date, dive_id = cursor.rsplit('_', 1)
+        return datetime.fromisoformat(dive_date), int(dive_id)
+    except ValueError:
+        return None
+
+def dive_page(user_id, cursor=None, per_page=DIVES_PER_PAGE):
+    """Return one page of a user's dives, newest first, keyed on (dive_date, id).
+
+    Each page costs two queries regardless of log size: the page itself with
+    its site joined in, and one batched SELECT ... IN for its divers.
+    """
+    own_dive_ids = db.session.query(dive_diver.c.dive_id).join(
+        Diver, Diver.id == dive_diver.c.diver_id).filter(Diver.user_id == user_id)
+    query = Dive.query.filter(Dive.id.in_(own_dive_ids)).options(
+        joinedload(Dive.site), selectinload(Dive.divers))
+    if cursor is not None:
+        query = query.filter(tuple_(Dive.dive_date, Dive.id) < tuple_(*cursor))
+    rows = query.order_by(Dive.dive_date.desc(), Dive.id.desc()).limit(per_page + 1).all()
+    
+    next_cursor = encode_dive_cursor(rows[per_page - 1]) if len(rows) > per_page else None
+    return rows[:per_page], next_cursor
+
+def log_dive(diver_ids, **values):
+    """Add a dive with whichever of diver_ids are the current user's divers, and count it in the statistics."""
+    dive = Dive(**values)
+    if diver_ids:
+        dive.divers = Diver.query.filter(Diver.id.in_(diver_ids), Diver.user_id == current_user.id).all()
+    db.session.add(dive)
+    db.session.flush()
+    stats.add_dives(db.session.connection(), db.metadata.tables, [dive.id])
+    return dive
+
 @app.route('/dives', methods=['GET', 'POST'])
 @login_required
 def dives():
     if request.method == 'POST':
-        dive = Dive(
-            site_id=request.form.get('site_id', type=int),
+        site = visible_site(request.form.get('site_id', type=int))
+        if site is None:
+            flash('Choose a dive site', 'error')
+            return redirect(url_for('dives'))
+        log_dive(
+            request.form.getlist('diver_ids', type=int),
+            site_id=site.id,
             dive_date=datetime.fromisoformat(request.form.get('dive_date')), # pyright: ignore[reportArgumentType]
             duration_minutes=request.form.get('duration_minutes', type=int),
             max_depth=request.form.get('max_depth', type=float),
@@ -326,31 +750,231 @@ def dives():
             conditions=request.form.get('conditions'),
             notes=request.form.get('notes')
         )
-        db.session.add(dive)
-        db.session.flush()
-        
-        diver_ids = request.form.getlist('diver_ids')
-        for diver_id in diver_ids:
-            diver = Diver.query.get(diver_id)
-            if diver.user_id == current_user.id:
-                dive.divers.append(diver)
-        
         db.session.commit()
+        invalidate_stats(current_user.id)
+        page_cache.bump('site_stats')
         return redirect(url_for('dives'))
     
     user_divers = Diver.query.filter_by(user_id=current_user.id).all()
     sites = DiveSite.query.all()
-    user_dives = db.session.query(Dive).join(dive_diver).join(Diver).filter(Diver.user_id == current_user.id).all()
     
-    return render_template('dives.html', dives=user_dives, divers=user_divers, sites=sites)
+    per_page = request.args.get('per_page', DIVES_PER_PAGE, type=int)
+    cursor = decode_dive_cursor(request.args.get('cursor'))
+    user_dives, next_cursor = dive_page(current_user.id, cursor, max(1, min(per_page, MAX_DIVES_PER_PAGE)))
+    
+    return render_template('dives.html', dives=user_dives, divers=user_divers, sites=sites,
+                           next_cursor=next_cursor, is_first_page=cursor is None)
 
 @app.route('/dive/<int:dive_id>')
 @login_required
+@page_cache.page('user:{user}', 'sites')
 def dive_detail(dive_id):
     dive = Dive.query.get_or_404(dive_id)
     if not any(d.user_id == current_user.id for d in dive.divers):
         return jsonify({'error': 'Unauthorized'}), 403
-    return render_template('dive_detail.html', dive=dive)
+    profile = db.session.get(DiveProfile, dive_id)
+    profile_metrics = profile_chart = None
+    if profile is not None:
+        channels = profiles.decode_profile(profile)
+        profile_metrics = profiles.metrics(channels, profile.tank_litres)
+        profile_chart = profiles.chart(channels)
+    return render_template('dive_detail.html', dive=dive, profile=profile, metrics=profile_metrics,
+                           chart=profile_chart, ascent_limit=profiles.ASCENT_RATE_LIMIT)
+
+@app.route('/dive/<int:dive_id>/profile', methods=['GET', 'POST'])
+@login_required
+def dive_profile(dive_id):
+    """Upload a dive computer export (POST), or get the profile downsampled as JSON (GET ?points=N)."""
+    dive = Dive.query.get_or_404(dive_id)
+    if not any(d.user_id == current_user.id for d in dive.divers):
+        return jsonify({'error': 'Unauthorized'}), 403
+    
+    if request.method == 'GET':
+        profile = db.session.get(DiveProfile, dive_id)
+        if profile is None:
+            return jsonify({'error': 'This dive has no profile'}), 404
+        channels = profiles.decode_profile(profile)
+        points = min(max(request.args.get('points', profiles.CHART_POINTS, type=int), 10), profile.sample_count)
+        return jsonify(dive_id=dive_id, samples=profile.sample_count,
+                       metrics=profiles.metrics(channels, profile.tank_litres),
+                       profile=profiles.sampled(channels, points))
+    
+    upload = request.files.get('file')
+    if not upload or not upload.filename:
+        flash('Choose a profile file to upload', 'error')
+        return redirect(url_for('dive_detail', dive_id=dive_id))
+    try:
+        fmt = request.form.get('format') or profiles.detect_format(upload.filename)
+        channels = profiles.parse(upload.stream, fmt)
+    except profiles.ProfileError as e:
+        flash(str(e), 'error')
+        return redirect(url_for('dive_detail', dive_id=dive_id))
+    
+    owners = dive_owner_ids([dive_id])
+    conn = db.session.connection()
+    profiles.remove(conn, db.metadata.tables, [dive_id])
+    conn.execute(db.metadata.tables['dive_profile'].insert(), dict(
+        profiles.encode_profile(channels), dive_id=dive_id, source=fmt, created_at=datetime.utcnow(),
+        tank_litres=request.form.get('tank_litres', type=float)))
+    # The profile fills in whatever the logbook entry left blank
+    summary = profiles.metrics(channels)
+    audit.record(db.session, 'insert', 'dive_profile', [dive_id], {'source': fmt, 'sample_count': summary['samples']})
+    filled = {'max_depth': summary['max_depth'], 'duration_minutes': round(summary['duration_minutes']),
+              'air_used': summary['gas_used_bar']}
+    filled = {name: value for name, value in filled.items() if getattr(dive, name) is None and value is not None}
+    if filled:
+        stats.remove_dives(conn, db.metadata.tables, [dive_id])
+        for name, value in filled.items():
+            setattr(dive, name, value)
+        db.session.flush()
+        stats.add_dives(conn, db.metadata.tables, [dive_id])
+    db.session.commit()
+    for user_id in owners:
+        invalidate_stats(user_id)
+    if filled:
+        page_cache.bump('site_stats')
+    flash(f"Profile with {summary['samples']} samples saved", 'success')
+    return redirect(url_for('dive_detail', dive_id=dive_id))
+
+@app.route('/dive/<int:dive_id>/profile/delete', methods=['POST'])
+@login_required
+def delete_dive_profile(dive_id):
+    dive = Dive.query.get_or_404(dive_id)
+    if not any(d.user_id == current_user.id for d in dive.divers):
+        return jsonify({'error': 'Unauthorized'}), 403
+    
+    owners = dive_owner_ids([dive_id])
+    profiles.remove(db.session.connection(), db.metadata.tables, [dive_id])
+    audit.record(db.session, 'delete', 'dive_profile', [dive_id])
+    db.session.commit()
+    for user_id in owners:
+        invalidate_stats(user_id)
+    return redirect(url_for('dive_detail', dive_id=dive_id))
+
+@app.route('/dive/<int:dive_id>/delete', methods=['POST'])
+@login_required
+def delete_dive(dive_id):
+    dive = Dive.query.get_or_404(dive_id)
+    if not any(d.user_id == current_user.id for d in dive.divers):
+        return jsonify({'error': 'Unauthorized'}), 403
+    
+    owners = dive_owner_ids([dive.id])
+    stats.remove_dives(db.session.connection(), db.metadata.tables, [dive.id])
+    profiles.remove(db.session.connection(), db.metadata.tables, [dive.id])
+    manifests.unlink_dives(db.session.connection(), db.metadata.tables, [dive.id])
+    db.session.delete(dive)
+    db.session.commit()
+    for user_id in owners:
+        invalidate_stats(user_id)
+    page_cache.bump('site_stats')
+    return redirect(url_for('dives'))
+
+# ============ Trip Manifests ============
+
+def parse_datetime(value):
+    try:
+        return datetime.fromisoformat(value or '')
+    except ValueError:
+        return None
+
+def save_roster(trip, diver_ids):
+    """Set a trip's roster to those of diver_ids that are the current user's divers."""
+    conn, tables = db.session.connection(), db.metadata.tables
+    own = set(deletes.user_diver_ids(conn, tables, current_user.id))
+    roster = sorted({diver_id for diver_id in diver_ids if diver_id in own})
+    before = sorted(conn.execute(select(trip_diver.c.diver_id).where(trip_diver.c.trip_id == trip.id)).scalars())
+    manifests.set_roster(conn, tables, trip.id, roster)
+    if roster != before:
+        audit.record(db.session, 'update', 'trip', [trip.id], {'divers': [before, roster]})
+
+@app.route('/trips', methods=['GET', 'POST'])
+@login_required
+def trips():
+    if request.method == 'POST':
+        departure = parse_datetime(request.form.get('departure'))
+        site = visible_site(request.form.get('site_id', type=int))
+        if departure is None or site is None:
+            flash('Choose a dive site and a departure date and time', 'error')
+            return redirect(url_for('trips'))
+        trip = Trip(user_id=current_user.id, site_id=site.id, departure=departure,
+                    boat=request.form.get('boat'), notes=request.form.get('notes'))
+        db.session.add(trip)
+        db.session.flush()
+        save_roster(trip, request.form.getlist('diver_ids', type=int))
+        db.session.commit()
+        return redirect(url_for('trip_detail', trip_id=trip.id))
+    
+    user_trips = Trip.query.filter_by(user_id=current_user.id).options(joinedload(Trip.site)) \
+        .order_by(Trip.departure.desc(), Trip.id.desc()).all()
+    roster_sizes = dict(db.session.query(trip_diver.c.trip_id, func.count()).join(Trip, Trip.id == trip_diver.c.trip_id)
+                        .filter(Trip.user_id == current_user.id).group_by(trip_diver.c.trip_id).all())
+    return render_template('trips.html', trips=user_trips, roster_sizes=roster_sizes,
+                           divers=Diver.query.filter_by(user_id=current_user.id).all(), sites=DiveSite.query.all())
+
+@app.route('/trip/<int:trip_id>', methods=['GET', 'POST'])
+@login_required
+def trip_detail(trip_id):
+    trip = Trip.query.get_or_404(trip_id)
+    if trip.user_id != current_user.id:
+        return jsonify({'error': 'Unauthorized'}), 403
+    
+    conn, tables = db.session.connection(), db.metadata.tables
+    if request.method == 'POST':
+        save_roster(trip, request.form.getlist('diver_ids', type=int))
+        db.session.commit()
+        return redirect(url_for('trip_detail', trip_id=trip.id))
+    
+    results = manifests.check_trip(conn, tables, trip.id)
+    return render_template('trip_detail.html', trip=trip, results=results, summary=manifests.summary(results),
+                           roster={result['diver_id'] for result in results},
+                           divers=Diver.query.filter_by(user_id=current_user.id).all())
+
+@app.route('/trip/<int:trip_id>/plan')
+@login_required
+def trip_plan(trip_id):
+    """No-decompression limits and gas for everyone on the roster, for a depth, time and mix (GET params)."""
+    trip = Trip.query.get_or_404(trip_id)
+    if trip.user_id != current_user.id:
+        return jsonify({'error': 'Unauthorized'}), 403
+    
+    o2 = request.args.get('o2', 21, type=float) / 100
+    try:
+        dive_plan = planner.plan_trip(db.session.connection(), db.metadata.tables, trip.id,
+                                      request.args.get('depth', type=float),
+                                      request.args.get('minutes', planner.PLAN_MINUTES, type=int), o2)
+    except ValueError as e:
+        flash(str(e), 'error')
+        dive_plan = planner.plan_trip(db.session.connection(), db.metadata.tables, trip.id)
+    return render_template('trip_plan.html', trip=trip, plan=dive_plan)
+
+@app.route('/trip/<int:trip_id>/log', methods=['POST'])
+@login_required
+def log_trip(trip_id):
+    trip = Trip.query.get_or_404(trip_id)
+    if trip.user_id != current_user.id:
+        return jsonify({'error': 'Unauthorized'}), 403
+    if trip.dive_id is not None:
+        return redirect(url_for('dive_detail', dive_id=trip.dive_id))
+    
+    dive = log_dive([diver.id for diver in trip.divers], site_id=trip.site_id, dive_date=trip.departure,
+                    notes=trip.notes)
+    trip.dive_id = dive.id
+    db.session.commit()
+    invalidate_stats(current_user.id)
+    page_cache.bump('site_stats')
+    return redirect(url_for('dive_detail', dive_id=dive.id))
+
+@app.route('/trip/<int:trip_id>/delete', methods=['POST'])
+@login_required
+def delete_trip(trip_id):
+    trip = Trip.query.get_or_404(trip_id)
+    if trip.user_id != current_user.id:
+        return jsonify({'error': 'Unauthorized'}), 403
+    
+    audit.record_deletes(db.session, Trip.__table__, [trip.id])
+    manifests.delete_trips(db.session.connection(), db.metadata.tables, [trip.id])
+    db.session.commit()
+    return redirect(url_for('trips'))
 
 # ============ Certification Routes ============
 
@@ -377,15 +1001,19 @@ def certifications():
         
         db.session.add(cert)
         db.session.commit()
+        refresh_alerts(current_user.id)
         return redirect(url_for('certifications'))
     
     user_divers = Diver.query.filter_by(user_id=current_user.id).all()
-    user_certifications = db.session.query(Certification).join(Diver).filter(Diver.user_id == current_user.id).all()
+    user_certifications = db.session.query(Certification).join(Diver).filter(
+        Diver.user_id == current_user.id).options(joinedload(Certification.diver)).all()
+    statuses = alerts.statuses(db.session.connection(), db.metadata.tables, current_user.id, 'certification')
     
     return render_template('certifications.html', 
                          divers=user_divers, 
                          certifications=user_certifications,
-                         now=datetime.utcnow().date())
+                         statuses=statuses,
+                         status_styles=alerts.STATUSES)
 
 @app.route('/certification/<int:cert_id>/delete', methods=['POST'])
 @login_required
@@ -397,8 +1025,19 @@ def delete_certification(cert_id):
     
     db.session.delete(cert)
     db.session.commit()
+    refresh_alerts(current_user.id)
     return redirect(url_for('certifications'))
 
+@app.route('/alerts')
+@login_required
+def alerts_digest():
+    """Everything expired, expiring or due for service, most urgent first."""
+    items = alerts.digest(db.session.connection(), db.metadata.tables, current_user.id)
+    if request.args.get('format') == 'json':
+        return jsonify(items=[{key: value.isoformat() if hasattr(value, 'isoformat') else value
+                               for key, value in item.items()} for item in items])
+    return render_template('alerts.html', items=items, status_styles=alerts.STATUSES)
+
 # ============ User Management Routes (Admin Only) ============
 
 @app.route('/users')
@@ -406,8 +1045,25 @@ def delete_certification(cert_id):
 def users():
     if current_user.role != 'admin':
         return jsonify({'error': 'Unauthorized'}), 403
-    all_users = User.query.all()
-    return render_template('users.html', users=all_users)
+    # A read-only connection of its own, so a long user list never holds up the writers
+    query = select(User.__table__).order_by(User.id)
+    if tenants.current() is not None:
+        query = query.where(User.centre_id == tenants.current())
+    with reporting.connect(max_age=0) as conn:
+        all_users = conn.execute(query).all()
+    centres = {centre.id: centre.name for centre in Centre.query.all()} if is_deployment_admin(current_user) else {}
+    return render_template('users.html', users=all_users, centres=centres)
+
+@app.route('/metrics')
+@login_required
+def metrics():
+    if current_user.role != 'admin':
+        return jsonify({'error': 'Unauthorized'}), 403
+    return jsonify(profiler.snapshot())
+
+def user_has_divers(user):
+    with tenants.use(user.centre_id):
+        return db.session.execute(select(Diver.id).where(Diver.user_id == user.id).limit(1)).first() is not None
 
 @app.route('/user/<int:user_id>/edit', methods=['GET', 'POST'])
 @login_required
@@ -422,9 +1078,19 @@ def edit_user(user_id):
         password = request.form.get('password')
         if password:
             user.set_password(password)
+        if is_deployment_admin(current_user) and 'centre_id' in request.form:
+            centre_id = request.form.get('centre_id', type=int)
+            if centre_id != user.centre_id and app.config['TENANT_DATABASES'] and user_has_divers(user):
+                # Their divers live in the old centre's database file and would be left behind
+                flash('Users with divers cannot change centre while each centre has its own database', 'error')
+                return redirect(url_for('edit_user', user_id=user.id))
+            user.centre_id = centre_id
         db.session.commit()
+        invalidate_stats(user.id)
+        auth_cache.delete(user.id)
         return redirect(url_for('users'))
-    return render_template('edit_user.html', user=user)
+    centres = Centre.query.order_by(Centre.name).all() if is_deployment_admin(current_user) else None
+    return render_template('edit_user.html', user=user, centres=centres)
 
 @app.route('/user/<int:user_id>/delete', methods=['POST'])
 @login_required
@@ -434,11 +1100,407 @@ def delete_user(user_id):
     user = User.query.get_or_404(user_id)
     if user.id == current_user.id:
         return jsonify({'error': 'Cannot delete yourself'}), 400
-    db.session.delete(user)
+    username = user.username
+    with tenants.use(user.centre_id):
+        conn = db.session.connection()
+        if request.form.get('action') == 'archive':
+            archive_items(conn, 'divers', deletes.user_diver_ids(conn, db.metadata.tables, user.id), username)
+        audit.record_deletes(db.session, Diver.__table__, deletes.user_diver_ids(conn, db.metadata.tables, user.id))
+        audit.record_deletes(db.session, User.__table__, [user.id])
+        counts = deletes.delete_user(conn, db.metadata.tables, user.id)
     db.session.commit()
+    invalidate_stats()
+    auth_cache.delete(user_id)
+    flash(f"Deleted {username} with {counts['divers']} divers, {counts['equipment']} equipment "
+          f"and {counts['certifications']} certifications.", 'success')
     return redirect(url_for('users'))
 
+# ============ Dive Centres (Deployment Admins Only) ============
+
+@app.route('/admin/centres', methods=['GET', 'POST'])
+@login_required
+def admin_centres():
+    if not is_deployment_admin(current_user):
+        return jsonify({'error': 'Unauthorized'}), 403
+    if request.method == 'POST':
+        name = (request.form.get('name') or '').strip()
+        if not name or Centre.query.filter_by(name=name).first():
+            flash('Enter a name no other centre uses', 'error')
+            return redirect(url_for('admin_centres'))
+        centre = Centre(name=name)
+        db.session.add(centre)
+        db.session.commit()
+        if app.config['TENANT_DATABASES']:
+            centre_router.engine(centre.id)
+        flash(f'Centre {name} created', 'success')
+        return redirect(url_for('admin_centres'))
+    
+    user_counts = dict(db.session.execute(
+        select(User.centre_id, func.count()).group_by(User.centre_id), execution_options={'all_centres': True}).all())
+    return render_template('centres.html', centres=Centre.query.order_by(Centre.name).all(),
+                           user_counts=user_counts, active=tenants.current(),
+                           separate_files=app.config['TENANT_DATABASES'])
+
+@app.route('/admin/centres/switch', methods=['POST'])
+@login_required
+def switch_centre():
+    """Work inside one centre (or, with no centre_id, the whole deployment) for the rest of the session."""
+    if not is_deployment_admin(current_user):
+        return jsonify({'error': 'Unauthorized'}), 403
+    centre_id = request.form.get('centre_id', type=int)
+    if centre_id is None:
+        session.pop('centre_id', None)
+    elif db.session.get(Centre, centre_id) is None:
+        return jsonify({'error': 'Unknown centre'}), 404
+    else:
+        session['centre_id'] = centre_id
+    invalidate_stats(current_user.id)
+    return redirect(url_for('admin_centres'))
+
+# ============ Bulk Delete / Archive ============
+
+ARCHIVES = os.path.join(app.instance_path, 'archives')
+
+def archive_items(conn, kind, ids, username):
+    """Snapshot rows about to be deleted to instance/archives as JSON Lines. Returns the file path."""
+    os.makedirs(ARCHIVES, exist_ok=True)
+    path = os.path.join(ARCHIVES, f"{secure_filename(username)}-{kind}-{datetime.utcnow():%Y%m%d-%H%M%S}.jsonl")
+    with open(path, 'a', encoding='utf-8') as f:
+        deletes.archive(conn, db.metadata.tables, kind, ids, f)
+    return path
+
+@app.route('/bulk/<kind>', methods=['POST'])
+@login_required
+def bulk_delete(kind):
+    """Delete (or archive, then delete) the selected divers, equipment or certifications in one transaction."""
+    if kind not in deletes.KINDS:
+        return jsonify({'error': f"Unknown kind; expected one of {', '.join(deletes.KINDS)}"}), 404
+    ids = set(request.form.getlist('ids', type=int))
+    conn = db.session.connection()
+    if deletes.owned_ids(conn, db.metadata.tables, kind, ids, current_user.id) != ids:
+        return jsonify({'error': 'Unauthorized'}), 403
+    if ids:
+        if request.form.get('action') == 'archive':
+            archive_items(conn, kind, ids, current_user.username)
+        audit.record_deletes(db.session, db.metadata.tables[deletes.KINDS[kind]], ids)
+        counts = deletes.delete_items(conn, db.metadata.tables, kind, ids)
+        db.session.commit()
+        refresh_alerts(current_user.id)
+        flash('Deleted ' + ', '.join(f'{count} {name}' for name, count in counts.items() if count), 'success')
+    return redirect(url_for(kind))
+
+# ============ Search Routes ============
+
+SEARCH_LINKS = {
+    'dive': lambda ref_id: url_for('dive_detail', dive_id=ref_id),
+    'site': lambda ref_id: url_for('dive_sites'),
+    'diver': lambda ref_id: url_for('diver_detail', diver_id=ref_id),
+    'equipment': lambda ref_id: url_for('equipment'),
+    'certification': lambda ref_id: url_for('certifications'),
+}
+
+@app.route('/search')
+@login_required
+def search_view():
+    query = request.args.get('q', '').strip()
+    kind = request.args.get('kind') or None
+    if kind is not None and kind not in search.KIND_CODES:
+        return jsonify({'error': f'Unknown search kind {kind!r}'}), 400
+    
+    results = search.search(db.session.connection(), query, current_user.id, kind, centre_id=tenants.current(),
+                            sites_schema=tenants.sites_schema()) if query else []
+    for result in results:
+        result['url'] = SEARCH_LINKS[result['kind']](result['id'])
+    
+    if request.args.get('format') == 'json':
+        return jsonify(query=query, results=[dict(r, excerpt=str(r['excerpt'])) for r in results])
+    return render_template('search.html', query=query, kind=kind, kinds=search.KIND_CODES, results=results)
+
+# ============ Export Routes ============
+
+@app.route('/export/<kind>.<fmt>')
+@login_required
+def export(kind, fmt):
+    if kind not in exporter.KINDS or fmt not in exporter.FORMATS:
+        return jsonify({'error': 'Unknown export'}), 404
+    mimetype, extension = exporter.FORMATS[fmt]
+    centre_id, user_id = tenants.current(), current_user.id
+    
+    def chunks():
+        with reporting.connect(centre_id) as conn:
+            yield from exporter.generate(conn, db.metadata.tables, kind, fmt, user_id)
+    filename = f"{current_user.username}-{kind}-{datetime.utcnow():%Y%m%d}.{extension}"
+    return Response(stream_with_context(chunks()), mimetype=mimetype,
+                    headers={'Content-Disposition': f'attachment; filename="{filename}"'})
+
+# ============ Bulk Import (Admin Only) ============
+
+JOB_FILES = os.path.join(app.instance_path, 'jobs')
+
+@app.route('/admin/import', methods=['GET', 'POST'])
+@login_required
+def admin_import():
+    if current_user.role != 'admin':
+        return jsonify({'error': 'Unauthorized'}), 403
+    if request.method == 'POST':
+        upload = request.files.get('file')
+        kind = request.form.get('kind')
+        if not upload or not upload.filename:
+            flash('Choose a file to import', 'error')
+            return redirect(url_for('admin_import'))
+        if kind not in importer.KINDS:
+            return jsonify({'error': f'Unknown import kind {kind!r}'}), 400
+        
+        owner = User.query.filter_by(username=request.form.get('username') or current_user.username).first()
+        if owner is None:
+            flash('Unknown user', 'error')
+            return redirect(url_for('admin_import'))
+        
+        # The upload is kept on disk for the job and removed when it finishes.
+        os.makedirs(JOB_FILES, exist_ok=True)
+        path = os.path.join(JOB_FILES, f'{uuid.uuid4().hex}-{secure_filename(upload.filename)}')
+        upload.save(path)
+        job_id = job_queue.enqueue('import', {
+            'kind': kind, 'user_id': owner.id, 'path': path, 'filename': upload.filename,
+            'format': request.form.get('format') or importer.detect_format(upload.filename),
+        }, user_id=current_user.id)
+        flash(f'Import of {upload.filename} queued as job #{job_id}', 'success')
+        return redirect(url_for('admin_jobs'))
+    return render_template('import.html', kinds=importer.KINDS)
+
+# ============ Background Jobs (Admin Only) ============
+
+def centre_of(user_id):
+    user = db.session.get(User, user_id)
+    return user.centre_id if user is not None else None
+
+def centre_user_ids():
+    """Ids of the active centre's users, or None when no centre is active."""
+    if tenants.current() is None:
+        return None
+    return set(db.session.execute(select(User.id)).scalars())
+
+def run_import(ctx):
+    params = ctx.params
+    size = os.path.getsize(params['path'])
+    with tenants.use(centre_of(params['user_id'])):
+        try:
+            # A job cancelled straight after it was claimed stops before writing anything
+            ctx.progress(0, size, 'Starting', force=True)
+            with open(params['path'], 'rb') as raw:
+                def on_chunk(report):
+                    ctx.progress(raw.tell(), size, f'{report.rows} rows read, {report.imported} imported, {report.failed} failed')
+                report = importer.import_stream(db, params['kind'], importer.open_text(raw), params['user_id'],
+                                                params['format'], on_chunk=on_chunk)
+            ctx.progress(size, size, f'{report.rows} rows read, {report.imported} imported, {report.failed} failed', force=True)
+            return report.to_dict()
+        finally:
+            os.remove(params['path'])
+            # Whatever was written before a cancel stays, so caches and alerts must catch up either way.
+            refresh_alerts(params['user_id'])
+            if params['kind'] == 'dives':
+                page_cache.bump('site_stats')
+
+def discard_upload(params):
+    """Delete the uploaded file of an import job that will never run to the end."""
+    if os.path.exists(params['path']):
+        os.remove(params['path'])
+
+def run_export(ctx):
+    params = ctx.params
+    mimetype, extension = exporter.FORMATS[params['format']]
+    os.makedirs(JOB_FILES, exist_ok=True)
+    path = os.path.join(JOB_FILES, f'job-{ctx.id}.{extension}')
+    size = 0
+    with reporting.connect(centre_of(params['user_id'])) as conn, open(path, 'w', encoding='utf-8', newline='') as f:
+        as_of = conn.info['as_of']
+        for chunk in exporter.generate(conn, db.metadata.tables, params['kind'], params['format'], params['user_id']):
+            f.write(chunk)
+            size += len(chunk)
+            ctx.progress(size, message=f'{size // 1024} KiB written')
+    owner = db.session.get(User, params['user_id'])
+    filename = f"{owner.username if owner else params['user_id']}-{params['kind']}-{datetime.utcnow():%Y%m%d}.{extension}"
+    return {'path': path, 'filename': filename, 'mimetype': mimetype, 'bytes': size,
+            'as_of': as_of.isoformat() if as_of else None}
+
+def run_rebuild_stats(ctx):
+    databases = tenants.engines(db)
+    for done, (_, engine) in enumerate(databases):
+        ctx.progress(done, len(databases), 'rebuilding', force=True)
+        with engine.begin() as conn:
+            stats.rebuild(conn, db.metadata.tables)
+    invalidate_stats()
+    return {'rebuilt': True}
+
+def run_backup(ctx):
+    def on_progress(done, databases, remaining, total):
+        ctx.progress(total - remaining, total, f'database {done + 1} of {databases}')
+    written = backups.run(db, app.config['BACKUP_DIR'], app.config['BACKUP_PAGES_PER_STEP'],
+                          app.config['BACKUP_STEP_SLEEP'], on_progress=on_progress)
+    pruned = backups.prune(app.config['BACKUP_DIR'], app.config['BACKUP_KEEP'], app.config['BACKUP_KEEP_DAYS'])
+    return {'files': [os.path.basename(path) for path in written], 'pruned': len(pruned)}
+
+def run_reset_passwords(ctx):
+    if ctx.secret is None:
+        raise RuntimeError('The new password is only kept in memory; queue the reset again')
+    users = User.query.filter(User.id.in_(ctx.params['user_ids'])).order_by(User.id).all()
+    for done, user in enumerate(users, start=1):
+        user.set_password(ctx.secret)
+        db.session.commit()
+        auth_cache.delete(user.id)
+        ctx.progress(done, len(users), f'reset {user.username}')
+    return {'reset': [user.username for user in users]}
+
+# Lower priority numbers run first; imports run one at a time since SQLite has a single writer.
+job_queue.register('reset_passwords', run_reset_passwords, priority=2)
+job_queue.register('backup', run_backup, priority=3, concurrency=1, restartable=True)
+job_queue.register('export', run_export, priority=4, concurrency=2, restartable=True)
+job_queue.register('rebuild_stats', run_rebuild_stats, priority=5, concurrency=1, restartable=True)
+job_queue.register('import', run_import, priority=6, concurrency=1, discard=discard_upload)
+
+@app.route('/admin/jobs', methods=['GET', 'POST'])
+@login_required
+def admin_jobs():
+    if current_user.role != 'admin':
+        return jsonify({'error': 'Unauthorized'}), 403
+    if request.method == 'POST':
+        kind = request.form.get('kind')
+        if kind == 'rebuild_stats':
+            job_id = job_queue.enqueue('rebuild_stats', user_id=current_user.id)
+        elif kind == 'backup':
+            if not is_deployment_admin(current_user):
+                return jsonify({'error': 'Unauthorized'}), 403
+            job_id = job_queue.enqueue('backup', user_id=current_user.id)
+        elif kind == 'reset_passwords':
+            usernames = [name.strip() for name in request.form.get('usernames', '').split(',') if name.strip()]
+            found = User.query.filter(User.username.in_(usernames)).all()
+            password = request.form.get('password')
+            if not found or not password:
+                flash('Enter existing usernames and a new password', 'error')
+                return redirect(url_for('admin_jobs'))
+            job_id = job_queue.enqueue('reset_passwords', {'user_ids': [user.id for user in found]},
+                                       user_id=current_user.id, secret=password)
+        elif kind == 'export':
+            owner = User.query.filter_by(username=request.form.get('username') or current_user.username).first()
+            if owner is None or request.form.get('export') not in exporter.KINDS or \
+                    request.form.get('format') not in exporter.FORMATS:
+                flash('Choose an existing user, export and format', 'error')
+                return redirect(url_for('admin_jobs'))
+            job_id = job_queue.enqueue('export', {'kind': request.form['export'], 'format': request.form['format'],
+                                                  'user_id': owner.id}, user_id=current_user.id)
+        else:
+            return jsonify({'error': f'Unknown job kind {kind!r}'}), 400
+        flash(f'Job #{job_id} queued', 'success')
+        return redirect(url_for('admin_jobs'))
+    
+    # Centre admins see the jobs their centre's users queued
+    recent = job_queue.recent(user_ids=centre_user_ids())
+    if request.args.get('format') == 'json':
+        return jsonify(jobs=recent)
+    return render_template('jobs.html', jobs=recent, export_kinds=exporter.KINDS, export_formats=exporter.FORMATS,
+                           active=any(not job['finished'] for job in recent))
+
+def job_visible(job):
+    user_ids = centre_user_ids()
+    return user_ids is None or job['user_id'] in user_ids
+
+@app.route('/admin/jobs/<int:job_id>')
+@login_required
+def job_status(job_id):
+    if current_user.role != 'admin':
+        return jsonify({'error': 'Unauthorized'}), 403
+    job = job_queue.get(job_id)
+    if job is None or not job_visible(job):
+        return jsonify({'error': 'Not found'}), 404
+    return jsonify(job)
+
+@app.route('/admin/jobs/<int:job_id>/cancel', methods=['POST'])
+@login_required
+def cancel_job(job_id):
+    if current_user.role != 'admin':
+        return jsonify({'error': 'Unauthorized'}), 403
+    job = job_queue.get(job_id)
+    if job is None or not job_visible(job):
+        return jsonify({'error': 'Not found'}), 404
+    cancelled = job_queue.cancel(job_id)
+    if request.args.get('format') == 'json':
+        return jsonify(job_queue.get(job_id)), 200 if cancelled else 409
+    flash(f'Job #{job_id} cancelled' if cancelled else f'Job #{job_id} has already finished',
+          'success' if cancelled else 'error')
+    return redirect(url_for('admin_jobs'))
+
+@app.route('/admin/jobs/<int:job_id>/download')
+@login_required
+def download_job(job_id):
+    if current_user.role != 'admin':
+        return jsonify({'error': 'Unauthorized'}), 403
+    job = job_queue.get(job_id)
+    if job is None or not job_visible(job) or job['kind'] != 'export' or job['status'] != 'done' or not os.path.exists(job['result']['path']):
+        return jsonify({'error': 'Not found'}), 404
+    return send_file(job['result']['path'], mimetype=job['result']['mimetype'], as_attachment=True,
+                     download_name=job['result']['filename'])
+
+# ============ Audit Log ============
+
+def audit_page(filters, cursor=None, per_page=AUDIT_PER_PAGE):
+    """One page of audit entries, newest first, keyed on (created_at, id) like dive_page()."""
+    query = AuditLog.query
+    for column in ('actor', 'table_name', 'action', 'centre_id'):
+        if filters.get(column) is not None:
+            query = query.filter(getattr(AuditLog, column) == filters[column])
+    if filters.get('since'):
+        query = query.filter(AuditLog.created_at >= filters['since'])
+    if filters.get('until'):
+        query = query.filter(AuditLog.created_at < filters['until'] + timedelta(days=1))
+    if cursor is not None:
+        query = query.filter(tuple_(AuditLog.created_at, AuditLog.id) < tuple_(*cursor))
+    rows = query.order_by(AuditLog.created_at.desc(), AuditLog.id.desc()).limit(per_page + 1).all()
+    last = rows[per_page - 1] if len(rows) > per_page else None
+    return rows[:per_page], f"{last.created_at.isoformat()}_{last.id}" if last else None
+
+@app.route('/admin/audit')
+@login_required
+def admin_audit():
+    if current_user.role != 'admin':
+        return jsonify({'error': 'Unauthorized'}), 403
+    filters = {
+        'actor': request.args.get('actor') or None,
+        'table_name': request.args.get('table') or None,
+        'action': request.args.get('action') or None,
+        'since': parse_datetime(request.args.get('since')),
+        'until': parse_datetime(request.args.get('until')),
+        # Centre admins (and deployment admins working inside a centre) see that centre's changes
+        'centre_id': tenants.current(),
+    }
+    cursor = decode_dive_cursor(request.args.get('cursor'))  # same <timestamp>_<id> form
+    entries, next_cursor = audit_page(filters, cursor)
+    if request.args.get('format') == 'json':
+        return jsonify(entries=[{
+            'id': entry.id, 'created_at': entry.created_at.isoformat(), 'actor': entry.actor,
+            'centre_id': entry.centre_id, 'action': entry.action, 'table': entry.table_name, 'row_id': entry.row_id,
+            'changes': json.loads(entry.changes or '{}'), 'endpoint': entry.endpoint,
+        } for entry in entries], next_cursor=next_cursor, writer=audit_writer.stats())
+    return render_template('audit.html', entries=entries, next_cursor=next_cursor, is_first_page=cursor is None,
+                           tables=sorted(db.metadata.tables.keys() - audit.IGNORED_TABLES),
+                           changes={entry.id: json.loads(entry.changes or '{}') for entry in entries})
+
+# ============ JSON API ============
+
+def api_written(user_id, resource, other_user_ids):
+    if resource == 'dive-sites':
+        page_cache.bump('sites')
+        return
+    if resource == 'dives':
+        page_cache.bump('site_stats')
+    refresh_alerts(user_id)
+    for other_user_id in other_user_ids:
+        invalidate_stats(other_user_id)
+
+api.init_app(app, db, after_write=api_written)
+
 if __name__ == '__main__':
-    with app.app_context():
-        db.create_all()
-    app.run(debug=True, port=5001)
+    # `python app.py` is for development unless SERVER_MODE says otherwise.
+    mode = None if 'SERVER_MODE' in os.environ else 'development'
+    server.start_background_jobs(app, db, on_refresh=invalidate_stats, job_queue=job_queue,
+                                 reloader=server.uses_reloader(app, mode, debug=True))
+    server.serve(app, mode=mode, debug=True)
@@ -0,0 +1,287 @@
+"""
+Append-only audit log of data changes.
+
+Session events capture every insert, update and delete the ORM flushes:
+after_flush records the changed columns with their old and new values (the
+session still holds both at that point), and the entries wait on the session
+until it commits, so a rolled-back change is never logged. Writes that bypass
+the ORM (set-based deletes, API batches, roster changes) call record() with
+the same effect. Each entry carries the acting user, their centre and the
+endpoint that made the change.
+
+Committed entries go onto a bounded in-memory queue instead of into the
+request's transaction. A background thread writes them to `audit_log` in
+batches of up to `batch_size` rows, at most every `flush_interval` seconds,
+so a busy write path pays for a list append rather than an extra INSERT.
+A request never waits for the writer: entries that find the queue full are
+dropped, counted and logged. stop(), registered with atexit, writes whatever
+is still queued.
+
+SQLite triggers reject UPDATE and DELETE on audit_log, so entries can only be
+appended. Passwords are never logged; REDACTED columns appear as changed
+without their values.
+"""
+
+import atexit
+import json
+import logging
+import queue
+import threading
+import time
+from datetime import date, datetime
+
+from flask import g, has_request_context, request
+from sqlalchemy import event, inspect, select, text
+
+import tenants
+
+# Derived or operational tables whose rows are rebuilt by the app itself.
+IGNORED_TABLES = {
+    'audit_log', 'data_version', 'due_item', 'job',
+    'diver_stats', 'site_stats', 'diver_month_stats', 'site_month_stats',
+}
+REDACTED = {'password_hash'}
+REDACTED_VALUE = '[redacted]'
+# Keeps the IN (...) lists of rows() well below SQLite's bound-parameter limit.
+CHUNK_SIZE = 5000
+_PENDING = 'audit_pending'
+
+logger = logging.getLogger(__name__)
+
+
+def _value(column, value):
+    if column in REDACTED:
+        return REDACTED_VALUE
+    if isinstance(value, list):
+        # [old, new] of an update
+        return [_value(column, item) for item in value]
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    if isinstance(value, bytes):
+        return f'<{len(value)} bytes>'
+    return value
+
+
+def _context():
+    """Who and what is making the change: the signed-in user, their centre and the endpoint."""
+    entry = {'actor_id': None, 'actor': None, 'centre_id': tenants.current(), 'endpoint': None, 'remote_addr': None}
+    if has_request_context():
+        # flask_login's cached user; never triggers a load in the middle of a flush
+        user = g.get('_login_user')
+        if user is not None and user.is_authenticated:
+            entry.update(actor_id=user.id, actor=user.username)
+        entry.update(endpoint=request.endpoint, remote_addr=request.remote_addr)
+    return entry
+
+
+def _pending(session):
+    return session.info.setdefault(_PENDING, [])
+
+
+def _entry(context, now, action, table, row_id, changes):
+    body = json.dumps({column: _value(column, value) for column, value in changes.items()}, default=str)
+    return dict(context, created_at=now, action=action, table_name=table, row_id=str(row_id), changes=body)
+
+
+def record(session, action, table, row_ids, changes=None):
+    """Log a change made outside the ORM through `session`; it is written once the session commits."""
+    context, now = _context(), datetime.utcnow()
+    _pending(session).extend(_entry(context, now, action, table, row_id, changes or {}) for row_id in row_ids)
+
+
+def record_rows(session, action, table, changes):
+    """Like record(), with each row's own changes: {row id: {column: value or [old, new]}}."""
+    context, now = _context(), datetime.utcnow()
+    _pending(session).extend(_entry(context, now, action, table, row_id, values)
+                             for row_id, values in changes.items())
+
+
+def rows(conn, table, ids):
+    """{id: {column: value}} for the rows of `table` with these ids, e.g. before they are changed or deleted."""
+    ids = list(ids)
+    found = {}
+    for start in range(0, len(ids), CHUNK_SIZE):
+        for row in conn.execute(select(table).where(table.c.id.in_(ids[start:start + CHUNK_SIZE]))).mappings():
+            found[row['id']] = dict(row)
+    return found
+
+
+def record_deletes(session, table, ids):
+    """Log the deletion of rows outside the ORM with their current values; call before deleting them."""
+    record_rows(session, 'delete', table.name, rows(session.connection(), table, ids))
+
+
+def diff(old, values):
+    """{column: [old, new]} for the columns `values` changes."""
+    return {column: [old.get(column), value] for column, value in values.items() if old.get(column) != value}
+
+
+def _diff(state, action):
+    changes = {}
+    for attr in state.mapper.column_attrs:
+        key = attr.key
+        if action == 'update':
+            history = state.attrs[key].history
+            if history.has_changes():
+                old = history.deleted[0] if history.deleted else None
+                new = history.added[0] if history.added else None
+                changes[key] = [old, new]
+        elif key in state.dict:
+            changes[key] = state.dict[key]
+    return changes
+
+
+def _capture(session, flush_context):
+    context = _context()
+    now = datetime.utcnow()
+    entries = _pending(session)
+    for action, objects in (('insert', session.new), ('update', session.dirty), ('delete', session.deleted)):
+        for obj in objects:
+            state = inspect(obj)
+            table = state.mapper.persist_selectable.name
+            if table in IGNORED_TABLES:
+                continue
+            changes = _diff(state, action)
+            if action == 'update' and not changes:
+                continue
+            row_id = ','.join(str(value) for value in state.mapper.primary_key_from_instance(obj))
+            entries.append(_entry(context, now, action, table, row_id, changes))
+
+
+def _discard(session):
+    session.info.pop(_PENDING, None)
+
+
+# ============ Append-only table ============
+
+def trigger_ddl():
+    return [
+        f"CREATE TRIGGER IF NOT EXISTS audit_log_no_{event_name} BEFORE {event_name.upper()} ON audit_log "
+        "BEGIN SELECT RAISE(ABORT, 'audit_log is append-only'); END"
+        for event_name in ('update', 'delete')
+    ]
+
+
+def install(conn):
+    """Make audit_log append-only if this database holds it. Returns True if any trigger was created."""
+    if conn.execute(text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'audit_log'")).first() is None:
+        return False
+    existing = set(conn.execute(text(
+        "SELECT name FROM sqlite_master WHERE type = 'trigger' AND name LIKE 'audit\\_log\\_%' ESCAPE '\\'")).scalars())
+    for statement in trigger_ddl():
+        conn.execute(text(statement))
+    return len(existing) < len(trigger_ddl())
+
+
+# ============ Writer ============
+
+class AuditLog:
+    """Collects committed entries from db.session and writes them to audit_log from a background thread."""
+
+    def __init__(self, app, db, queue_size=10000, batch_size=500, flush_interval=1.0):
+        self.app = app
+        self.db = db
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.written = 0
+        self.dropped = 0
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._thread = None
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        event.listen(db.session, 'after_flush', _capture)
+        event.listen(db.session, 'after_commit', self._committed)
+        event.listen(db.session, 'after_rollback', _discard)
+        atexit.register(self.stop)
+        app.extensions['audit'] = self
+
+    @property
+    def table(self):
+        return self.db.metadata.tables['audit_log']
+
+    @property
+    def engine(self):
+        # The writer runs outside any app context; audit_log always lives in the main database.
+        with self.app.app_context():
+            return self.db.engine
+
+    def _committed(self, session):
+        entries = session.info.pop(_PENDING, None)
+        if entries:
+            self.submit(entries)
+
+    def submit(self, entries):
+        if self._stopping.is_set():
+            self._write(entries)
+            return
+        self._start()
+        for queued, entry in enumerate(entries):
+            try:
+                self._queue.put_nowait(entry)
+            except queue.Full:
+                dropped = len(entries) - queued
+                self.dropped += dropped
+                logger.error('Audit queue full; dropped %d entries starting with %s of %s %s', dropped,
+                             entry['action'], entry['table_name'], entry['row_id'])
+                return
+
+    def _start(self):
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name='audit-writer', daemon=True)
+                    self._thread.start()
+
+    def _next_batch(self):
+        try:
+            batch = [self._queue.get(timeout=self.flush_interval)]
+        except queue.Empty:
+            return []
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size and not self._stopping.is_set():
+            try:
+                batch.append(self._queue.get(timeout=max(0.0, deadline - time.monotonic())))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while not (self._stopping.is_set() and self._queue.empty()):
+            batch = self._next_batch()
+            if batch:
+                self._write(batch)
+                for _ in batch:
+                    self._queue.task_done()
+
+    def _write(self, batch):
+        try:
+            with self.engine.begin() as conn:
+                conn.execute(self.table.insert(), batch)
+            self.written += len(batch)
+        except Exception:
+            self.dropped += len(batch)
+            logger.exception('Could not write %d audit entries', len(batch))
+
+    def flush(self):
+        """Block until everything queued so far is written."""
+        if self._thread is not None:
+            self._queue.join()
+
+    def stop(self, timeout=10):
+        """Write whatever is still queued and stop the writer; later entries are written synchronously."""
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        remaining = []
+        while True:
+            try:
+                remaining.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        if remaining:
+            self._write(remaining)
+            for _ in remaining:
+                self._queue.task_done()
+
+    def stats(self):
+        return {'queued': self._queue.qsize(), 'written': self.written, 'dropped': self.dropped}
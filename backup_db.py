@@ -0,0 +1,53 @@
+#!/usr/bin/env python
+"""
+Take an online backup of the database while the app keeps running.
+
+Every database (the main file and, with TENANT_DATABASES, each centre's file)
+is copied with SQLite's backup API into BACKUP_DIR under one timestamp, then
+old snapshots are pruned (BACKUP_KEEP, BACKUP_KEEP_DAYS). The server does the
+same every BACKUP_INTERVAL seconds; run this from cron when that is 0.
+
+To restore, stop the app and copy a snapshot over the database file
+(instance/diving_admin.db, or instance/centres/centre-<id>.db), removing
+any -wal and -shm files next to it.
+
+Usage:
+    python backup_db.py
+    python backup_db.py --dir /mnt/backups --pages 64 --sleep 0.05
+    python backup_db.py --list
+"""
+
+import argparse
+import os
+import sys
+
+from app import app, db
+import backups
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Back up the database without stopping the app')
+    parser.add_argument('--dir', default=app.config['BACKUP_DIR'], help='where snapshots are kept')
+    parser.add_argument('--pages', type=int, default=app.config['BACKUP_PAGES_PER_STEP'],
+                        help='pages copied per step')
+    parser.add_argument('--sleep', type=float, default=app.config['BACKUP_STEP_SLEEP'],
+                        help='seconds to pause between steps')
+    parser.add_argument('--no-prune', action='store_true', help='keep every snapshot')
+    parser.add_argument('--list', action='store_true', help='list the snapshots and exit')
+    args = parser.parse_args()
+
+    if not args.list:
+        with app.app_context():
+            for path in backups.run(db, args.dir, args.pages, args.sleep):
+                print(f"✓ {path} ({os.path.getsize(path) // 1024} KiB)")
+        if not args.no_prune:
+            pruned = backups.prune(args.dir, app.config['BACKUP_KEEP'], app.config['BACKUP_KEEP_DAYS'])
+            print(f"✓ Removed {len(pruned)} old snapshot files")
+
+    for taken_at, files in sorted(backups.snapshots(args.dir).items(), reverse=True):
+        print(f"  {taken_at:%Y-%m-%d %H:%M:%S}  {', '.join(sorted(files))}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,231 @@
+"""
+Online backups and the read-only reporting database.
+
+copy() takes a consistent copy of a live SQLite database with SQLite's
+backup API, `pages` pages per step with a short pause between steps, so the
+server's own queries get the database in between. In WAL mode the copy holds
+one read transaction from start to finish: it sees the database as it was
+when it began, and writes made meanwhile neither wait for it nor restart it.
+With a rollback journal that transaction would hold writers off for the whole
+copy, so each step reads on its own and a write in between restarts the copy.
+The copy is written next to its final name and renamed into place once
+complete, so a snapshot on disk is never torn.
+
+run() snapshots the main database and, with TENANT_DATABASES, every centre's
+file under one timestamp, `<name>-<YYYYmmdd-HHMMSS>.db`, then prune() keeps
+the newest `keep` snapshots plus the newest of each of the last `keep_days`
+days.
+
+Reporting hands out read-only connections for reports and exports: to the
+newest snapshot if it is recent enough, otherwise to the live file. Either
+way they come from their own engines with `query_only` set, never take the
+write lock and never use a connection from the main pool.
+"""
+
+import os
+import re
+import sqlite3
+import threading
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.pool import NullPool
+
+import tenants
+
+PAGES_PER_STEP = 256
+STEP_SLEEP = 0.01
+STAMP_FORMAT = '%Y%m%d-%H%M%S'
+_SNAPSHOT = re.compile(r'^(?P<name>.+)-(?P<stamp>\d{8}-\d{6})\.db$')
+
+
+def database_path(engine):
+    path = engine.url.database
+    if not path or path == ':memory:':
+        raise RuntimeError('Backups need the database in a file')
+    return path
+
+
+def _name(path):
+    return os.path.splitext(os.path.basename(path))[0]
+
+
+def copy(source_path, target_path, pages=PAGES_PER_STEP, sleep=STEP_SLEEP, progress=None):
+    """Copy a live database to target_path; progress(remaining, total) is called after each step."""
+    partial = target_path + '.part'
+    if os.path.exists(partial):
+        os.remove(partial)
+    source = sqlite3.connect(source_path, isolation_level=None)
+    target = sqlite3.connect(partial)
+    complete = False
+    try:
+        source.execute('PRAGMA query_only=ON')
+        if source.execute('PRAGMA journal_mode').fetchone()[0] == 'wal':
+            source.execute('BEGIN')
+            source.execute('SELECT count(*) FROM sqlite_master').fetchone()
+
+        def step(status, remaining, total):
+            if progress is not None:
+                progress(remaining, total)
+            if remaining and sleep:
+                time.sleep(sleep)
+
+        source.backup(target, pages=pages, progress=step)
+        # A snapshot is one self-contained file, whatever mode the source runs in.
+        target.execute('PRAGMA journal_mode=DELETE')
+        complete = True
+    finally:
+        target.close()
+        source.close()
+        if not complete:
+            os.remove(partial)
+    os.replace(partial, target_path)
+    return target_path
+
+
+def snapshots(directory):
+    """{taken at: {database name: path}}, for every snapshot in directory."""
+    found = {}
+    if os.path.isdir(directory):
+        for filename in os.listdir(directory):
+            match = _SNAPSHOT.match(filename)
+            if match:
+                taken_at = datetime.strptime(match['stamp'], STAMP_FORMAT)
+                found.setdefault(taken_at, {})[match['name']] = os.path.join(directory, filename)
+    return found
+
+
+def prune(directory, keep, keep_days, now=None):
+    """Delete snapshots other than the newest `keep` and the newest of each of the last `keep_days` days.
+
+    Returns the deleted paths.
+    """
+    now = now or datetime.utcnow()
+    found = snapshots(directory)
+    newest_first = sorted(found, reverse=True)
+    kept = set(newest_first[:keep])
+    daily = {}
+    for taken_at in newest_first:
+        if taken_at >= now - timedelta(days=keep_days):
+            daily.setdefault(taken_at.date(), taken_at)
+    kept.update(daily.values())
+    deleted = []
+    for taken_at in newest_first:
+        if taken_at not in kept:
+            for path in found[taken_at].values():
+                os.remove(path)
+                deleted.append(path)
+    return deleted
+
+
+def run(db, directory, pages=PAGES_PER_STEP, sleep=STEP_SLEEP, on_progress=None):
+    """Snapshot every database (see tenants.engines) under one timestamp. Returns the snapshot paths.
+
+    on_progress(databases done, databases, remaining pages, total pages) is called after each step.
+    """
+    os.makedirs(directory, exist_ok=True)
+    stamp = f'{datetime.utcnow():{STAMP_FORMAT}}'
+    sources = [database_path(engine) for _, engine in tenants.engines(db)]
+    written = []
+    for done, source in enumerate(sources):
+        progress = (lambda remaining, total, done=done: on_progress(done, len(sources), remaining, total)) \
+            if on_progress is not None else None
+        written.append(copy(source, os.path.join(directory, f'{_name(source)}-{stamp}.db'), pages, sleep, progress))
+    return written
+
+
+def start_scheduler(app, interval, backup, delay=0):
+    """Call backup() after `delay` seconds and then every `interval` seconds on a daemon thread.
+
+    Returns a threading.Event; set it to stop the scheduler.
+    """
+    stop = threading.Event()
+
+    def run_scheduled():
+        if stop.wait(delay):
+            return
+        while True:
+            try:
+                backup()
+            except Exception:
+                app.logger.exception('Could not start a backup')
+            if stop.wait(interval):
+                return
+
+    threading.Thread(target=run_scheduled, name='backup-scheduler', daemon=True).start()
+    return stop
+
+
+# ============ Read-only reporting connections ============
+
+class Reporting:
+    """Read-only connections for reports and exports, preferring a recent snapshot over the live database."""
+
+    def __init__(self, app, db, directory, max_age):
+        self.app = app
+        self.db = db
+        self.directory = directory
+        self.max_age = max_age
+        self._engines = {}
+        self._lock = threading.Lock()
+        app.extensions['reporting'] = self
+
+    def _live_paths(self, centre_id):
+        with self.app.app_context():
+            main = self.db.engine.url.database
+        router = self.app.extensions.get('tenants')
+        if centre_id is None or router is None or not router.enabled:
+            return main, None
+        return router.path(centre_id), main
+
+    def source(self, centre_id=None, max_age=None):
+        """(path, directory path or None, snapshot time or None) that reports for centre_id read."""
+        max_age = self.max_age if max_age is None else max_age
+        path, directory = self._live_paths(centre_id)
+        if max_age > 0:
+            oldest = datetime.utcnow() - timedelta(seconds=max_age)
+            for taken_at, files in sorted(snapshots(self.directory).items(), reverse=True):
+                if taken_at < oldest:
+                    break
+                # A centre's snapshot reads the directory as it was at the same moment.
+                if _name(path) in files and (directory is None or _name(directory) in files):
+                    return files[_name(path)], directory and files[_name(directory)], taken_at
+        return path, directory, None
+
+    def _engine(self, path, directory):
+        key = (path, directory)
+        engine = self._engines.get(key)
+        if engine is None:
+            with self._lock:
+                engine = self._engines.get(key)
+                if engine is None:
+                    # Snapshots come and go with retention; opening SQLite is cheap, so nothing is pooled.
+                    engine = create_engine(f'sqlite:///{path}', poolclass=NullPool,
+                                           connect_args={'check_same_thread': False})
+
+                    @event.listens_for(engine, 'connect')
+                    def read_only(dbapi_connection, connection_record):
+                        dbapi_connection.execute('PRAGMA busy_timeout=5000')
+                        if directory is not None:
+                            dbapi_connection.execute(f'ATTACH DATABASE ? AS {tenants.DIRECTORY_SCHEMA}', (directory,))
+                        dbapi_connection.execute('PRAGMA query_only=ON')
+
+                    self._engines = {k: v for k, v in self._engines.items() if os.path.exists(k[0])}
+                    self._engines[key] = engine
+        return engine
+
+    def connect(self, centre_id=None, max_age=None):
+        """A read-only Connection for centre_id's data (the main database when None).
+
+        max_age (seconds, default REPORTING_MAX_AGE) is how old a snapshot may be; 0 reads the live database.
+        The connection's `info['as_of']` is the snapshot time, or None for live data.
+        """
+        path, directory, taken_at = self.source(centre_id, max_age)
+        if not path or path == ':memory:':
+            # Nothing to snapshot or reopen; read through the app's own engine.
+            with self.app.app_context():
+                return self.db.engine.connect()
+        conn = self._engine(path, directory).connect()
+        conn.info['as_of'] = taken_at
+        return conn
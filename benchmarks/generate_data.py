@@ -0,0 +1,204 @@
+#!/usr/bin/env python
+"""
+Deterministic synthetic data generator for load testing.
+
+Fills an empty database (pick it with DATABASE_URL) with users, divers, dive
+sites, dives with realistic dive_diver fan-out, equipment and certifications.
+The same --seed and scale always produce the same rows (maintenance and
+expiry dates are placed relative to the day it runs). Every generated user has
+the password 'bench123'.
+
+Usage:
+    DATABASE_URL=sqlite:////tmp/bench.db python benchmarks/generate_data.py --scale small
+    DATABASE_URL=sqlite:////tmp/bench.db python benchmarks/generate_data.py --users 1000 --divers 50000 --dives 2000000
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import date, datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import text
+
+import geo
+import search
+import stats
+import versions
+from app import app, db
+from migrate import upgrade_schema
+from werkzeug.security import generate_password_hash
+
+SCALES = {
+    'tiny': {'users': 5, 'divers': 100, 'sites': 50, 'dives': 2000},
+    'small': {'users': 50, 'divers': 2500, 'sites': 200, 'dives': 50000},
+    'medium': {'users': 200, 'divers': 10000, 'sites': 1000, 'dives': 400000},
+    'large': {'users': 1000, 'divers': 50000, 'sites': 5000, 'dives': 2000000},
+}
+CHUNK = 10000
+PASSWORD = 'bench123'
+
+FIRST_NAMES = ['Ana', 'Ben', 'Chloe', 'Dev', 'Elena', 'Finn', 'Grace', 'Hiro', 'Isla', 'Jonas',
+               'Kai', 'Lena', 'Marco', 'Nadia', 'Omar', 'Priya', 'Quinn', 'Rosa', 'Sam', 'Tariq']
+LAST_NAMES = ['Adams', 'Berg', 'Costa', 'Dubois', 'Evans', 'Fischer', 'Garcia', 'Haddad', 'Ito', 'Jensen',
+              'Khan', 'Lopez', 'Moreau', 'Nguyen', 'Olsen', 'Park', 'Rossi', 'Silva', 'Tanaka', 'Weber']
+LEVELS = ['Open Water', 'Advanced Open Water', 'Rescue Diver', 'Divemaster', 'Instructor']
+REGIONS = ['Australia', 'Belize', 'Egypt', 'Indonesia', 'Mexico', 'Philippines', 'Thailand', 'Maldives', 'Malta', 'Palau']
+# Rough centre of each region's dive sites; generated sites scatter around it.
+REGION_COORDINATES = {
+    'Australia': (-16.5, 145.9), 'Belize': (17.3, -87.8), 'Egypt': (27.2, 34.0), 'Indonesia': (-8.3, 119.6),
+    'Mexico': (20.4, -86.9), 'Philippines': (9.6, 123.8), 'Thailand': (8.0, 98.3), 'Maldives': (3.2, 73.2),
+    'Malta': (36.0, 14.3), 'Palau': (7.3, 134.5),
+}
+DIFFICULTY = ['Beginner', 'Intermediate', 'Advanced']
+CONDITIONS = ['Calm', 'Choppy', 'Strong current', 'Surge', 'Mild current', 'Flat, sunny']
+NOTE_WORDS = ['reef', 'wall', 'drift', 'wreck', 'turtle', 'shark', 'manta', 'nudibranch', 'cave', 'swim-through',
+              'thermocline', 'current', 'visibility', 'school', 'barracuda', 'octopus', 'coral', 'safety stop']
+EQUIPMENT = ['BCD', 'Tank', 'Regulator', 'Wetsuit', 'Fins', 'Mask', 'Computer', 'Light', 'Weight']
+BRANDS = ['Apeks', 'Aqualung', 'Mares', 'Scubapro', 'Shearwater', 'Suunto', 'Cressi', 'Atomic']
+CERT_TYPES = ['Open Water Diver', 'Advanced Open Water', 'Rescue Diver', 'Specialty - Nitrox',
+              'Specialty - Deep Diving', 'Specialty - Night Diving', 'Divemaster']
+AGENCIES = ['PADI', 'SSI', 'NAUI', 'TDI', 'CMAS']
+
+
+def insert(conn, table, rows):
+    if rows:
+        conn.execute(db.metadata.tables[table].insert(), rows)
+
+
+def generate(users, divers, sites, dives, seed=42, log=print):
+    rng = random.Random(seed)
+    password_hash = generate_password_hash(PASSWORD, method=app.config['PASSWORD_HASH_METHOD'])
+    today = date.today()
+    epoch = datetime(2015, 1, 1)
+    divers_per_user = max(1, divers // users)
+
+    with db.engine.begin() as conn:
+        # Index the bulk load once at the end instead of row by row.
+        search.drop_triggers(conn)
+        geo.drop_triggers(conn)
+        versions.drop_triggers(conn)
+
+        insert(conn, 'user', [{
+            'id': user_id, 'username': f'bench{user_id}', 'email': f'bench{user_id}@bench.local',
+            'password_hash': password_hash, 'role': 'admin' if user_id == 1 else 'instructor',
+        } for user_id in range(1, users + 1)])
+
+        site_rows = []
+        for site_id in range(1, sites + 1):
+            depth_min = rng.randint(2, 20)
+            name, region = f'{rng.choice(REGIONS)} Site {site_id}', rng.choice(REGIONS)
+            latitude, longitude = REGION_COORDINATES[region]
+            site_rows.append({
+                'id': site_id, 'name': name, 'location': region,
+                'latitude': round(latitude + rng.uniform(-1.5, 1.5), 5),
+                'longitude': round(longitude + rng.uniform(-1.5, 1.5), 5),
+                'depth_min': depth_min, 'depth_max': depth_min + rng.randint(5, 40),
+                'difficulty_level': rng.choice(DIFFICULTY), 'water_temperature': rng.randint(4, 30),
+                'visibility': f'{rng.randint(5, 40)}m', 'description': ' '.join(rng.choices(NOTE_WORDS, k=12)),
+            })
+        insert(conn, 'dive_site', site_rows)
+        log(f'✓ {users} users, {sites} sites')
+
+        equipment_id = certification_id = 0
+        for start in range(1, divers + 1, CHUNK):
+            diver_rows, equipment_rows, certification_rows = [], [], []
+            for diver_id in range(start, min(start + CHUNK, divers + 1)):
+                diver_rows.append({
+                    'id': diver_id, 'user_id': min((diver_id - 1) // divers_per_user + 1, users),
+                    'first_name': rng.choice(FIRST_NAMES), 'last_name': rng.choice(LAST_NAMES),
+                    'certification_level': rng.choice(LEVELS), 'certification_number': f'C{diver_id:08d}',
+                    'experience_dives': 0,
+                })
+                for _ in range(rng.randint(0, 8)):
+                    equipment_id += 1
+                    equipment_rows.append({
+                        'id': equipment_id, 'diver_id': diver_id, 'equipment_type': rng.choice(EQUIPMENT),
+                        'brand': rng.choice(BRANDS), 'model': f'M{rng.randint(1, 99)}',
+                        'serial_number': f'SN-{rng.randint(100000, 999999)}',
+                        'next_maintenance': today + timedelta(days=rng.randint(-120, 400)),
+                        'condition': rng.choice(['Good', 'Good', 'Fair', 'Needs Repair']),
+                    })
+                for _ in range(rng.randint(1, 4)):
+                    certification_id += 1
+                    issued = today - timedelta(days=rng.randint(30, 3650))
+                    certification_rows.append({
+                        'id': certification_id, 'diver_id': diver_id, 'cert_type': rng.choice(CERT_TYPES),
+                        'agency': rng.choice(AGENCIES), 'date_issued': issued, 'cert_number': f'N{certification_id:09d}',
+                        'expiration_date': issued + timedelta(days=rng.choice([365, 730, 1095])) if rng.random() < 0.5 else None,
+                    })
+            insert(conn, 'diver', diver_rows)
+            insert(conn, 'equipment', equipment_rows)
+            insert(conn, 'certification', certification_rows)
+        log(f'✓ {divers} divers, {equipment_id} equipment, {certification_id} certifications')
+
+    span_minutes = int((datetime.now() - epoch).total_seconds() // 60)
+    links = 0
+    for start in range(1, dives + 1, CHUNK):
+        dive_rows, link_rows = [], []
+        for dive_id in range(start, min(start + CHUNK, dives + 1)):
+            dive_rows.append({
+                'id': dive_id, 'site_id': rng.randint(1, sites),
+                'dive_date': epoch + timedelta(minutes=rng.randint(0, span_minutes)),
+                'duration_minutes': rng.randint(25, 75), 'max_depth': round(rng.uniform(5, 40), 1),
+                'air_used': rng.randint(80, 200), 'conditions': rng.choice(CONDITIONS),
+                'notes': ' '.join(rng.choices(NOTE_WORDS, k=rng.randint(0, 15))),
+            })
+            # A buddy group from one user's divers: mostly pairs, sometimes a larger group.
+            user_id = rng.randint(1, users)
+            first = (user_id - 1) * divers_per_user + 1
+            last = min(first + divers_per_user - 1, divers)
+            group = rng.choices([1, 2, 3, 4, 6], weights=[10, 50, 20, 12, 8])[0]
+            for diver_id in rng.sample(range(first, last + 1), min(group, last - first + 1)):
+                link_rows.append({'dive_id': dive_id, 'diver_id': diver_id})
+        with db.engine.begin() as conn:
+            insert(conn, 'dive', dive_rows)
+            insert(conn, 'dive_diver', link_rows)
+        links += len(link_rows)
+        if start // CHUNK % 20 == 0:
+            log(f'  {min(start + CHUNK - 1, dives)} / {dives} dives')
+    log(f'✓ {dives} dives, {links} dive_diver rows')
+
+    with db.engine.begin() as conn:
+        search.install(conn)
+        geo.install(conn)
+        versions.install(conn)
+        search.rebuild(conn)
+        geo.rebuild(conn)
+        stats.rebuild(conn, db.metadata.tables)
+        conn.execute(text('ANALYZE'))
+    log('✓ search and spatial indexes and dive statistics rebuilt, statistics analyzed')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate deterministic synthetic data')
+    parser.add_argument('--scale', choices=list(SCALES), default='small')
+    parser.add_argument('--users', type=int)
+    parser.add_argument('--divers', type=int)
+    parser.add_argument('--sites', type=int)
+    parser.add_argument('--dives', type=int)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    sizes = dict(SCALES[args.scale])
+    for key in sizes:
+        if getattr(args, key) is not None:
+            sizes[key] = getattr(args, key)
+
+    with app.app_context():
+        upgrade_schema(db)
+        with db.engine.connect() as conn:
+            if conn.execute(text('SELECT count(*) FROM user')).scalar():
+                print(f"Database {db.engine.url} already has users; point DATABASE_URL at an empty database")
+                return 1
+        started = time.perf_counter()
+        generate(seed=args.seed, **sizes)
+        print(f"Generated {sizes} in {time.perf_counter() - started:.1f}s into {db.engine.url}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
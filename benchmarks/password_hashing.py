@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+"""
+Benchmark password hash methods to choose PASSWORD_HASH_METHOD.
+
+Times one verification (what login() pays) for each candidate and reports the
+logins per second a single core can sustain. The strongest candidate that fits
+the per-login budget is recommended.
+
+Usage: python benchmarks/password_hashing.py [--budget-ms 100] [--rounds 5]
+"""
+
+import argparse
+import statistics
+import time
+
+from werkzeug.security import check_password_hash, generate_password_hash
+
+# In order of preference; the first one that fits the budget is recommended.
+CANDIDATES = [
+    'scrypt:32768:8:1',
+    'pbkdf2:sha256:600000',
+    'pbkdf2:sha512:210000',
+    'scrypt:16384:8:1',
+    'pbkdf2:sha256:260000',
+    'pbkdf2:sha512:100000',
+    'pbkdf2:sha256:100000',
+]
+
+
+def time_verify(method, rounds):
+    hashed = generate_password_hash('correct horse battery staple', method=method)
+    samples = []
+    for _ in range(rounds):
+        started = time.perf_counter()
+        check_password_hash(hashed, 'correct horse battery staple')
+        samples.append((time.perf_counter() - started) * 1000)
+    return statistics.median(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark password hash methods')
+    parser.add_argument('--budget-ms', type=float, default=100, help='acceptable CPU time per login')
+    parser.add_argument('--rounds', type=int, default=5)
+    parser.add_argument('methods', nargs='*', default=CANDIDATES)
+    args = parser.parse_args()
+
+    recommended = None
+    print(f"{'method':<24}{'ms/login':>10}{'logins/s/core':>16}")
+    for method in args.methods:
+        ms = time_verify(method, args.rounds)
+        print(f'{method:<24}{ms:>10.1f}{1000 / ms:>16.1f}')
+        if recommended is None and ms <= args.budget_ms:
+            recommended = method
+    if recommended:
+        print(f'\nPreferred method within {args.budget_ms:g} ms: PASSWORD_HASH_METHOD={recommended}')
+    else:
+        print(f'\nNo candidate fits in {args.budget_ms:g} ms')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,201 @@
+#!/usr/bin/env python
+"""
+Route benchmark harness.
+
+Drives every route through the Flask test client as a sample of users from
+the database picked with DATABASE_URL (see generate_data.py). It records
+p50/p95/p99 latency and query counts per route plus the peak RSS of the
+process, and writes them to a JSON baseline. Comparison mode flags
+regressions between two baselines and exits with status 1 when it finds any.
+
+Usage:
+    DATABASE_URL=sqlite:////tmp/bench.db python benchmarks/run_benchmarks.py --out baseline.json
+    python benchmarks/run_benchmarks.py --compare baseline.json candidate.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import re
+import resource
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+QUERIES_RE = re.compile(r'desc="(\d+) queries"')
+
+# Default regression threshold used by --compare (fractional increase).
+DEFAULT_TOLERANCE = 0.25
+
+
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is KiB on Linux and bytes on macOS.
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def percentile(samples, pct):
+    if len(samples) < 2:
+        return samples[0] if samples else 0.0
+    return statistics.quantiles(samples, n=100, method='inclusive')[pct - 1]
+
+
+def user_routes(app, db, user):
+    """(name, method, url, data) for every route, filled in with this user's records."""
+    from app import Diver, dive_diver
+
+    with app.app_context():
+        diver = Diver.query.filter_by(user_id=user.id).first()
+        dive_id = None
+        if diver is not None:
+            dive_id = db.session.query(dive_diver.c.dive_id).filter(
+                dive_diver.c.diver_id == diver.id).limit(1).scalar()
+
+    routes = [
+        ('dashboard', 'GET', '/dashboard', None),
+        ('divers', 'GET', '/divers', None),
+        ('equipment', 'GET', '/equipment', None),
+        ('certifications', 'GET', '/certifications', None),
+        ('dives', 'GET', '/dives', None),
+        ('dives_page_2', 'GET', None, None),
+        ('dive_sites', 'GET', '/dive-sites', None),
+        ('sites_nearby', 'GET', '/api/v1/dive-sites/nearby?lat=17.3&lon=-87.8&radius_km=50', None),
+        ('sites_nearest', 'GET', '/api/v1/dive-sites/nearest?lat=8.0&lon=98.3&k=10', None),
+        ('search', 'GET', '/search?q=drift+current', None),
+        ('export_dives_csv', 'GET', '/export/dives.csv', None),
+        ('login', 'POST', '/login', {'username': user.username, 'password': 'bench123'}),
+    ]
+    if diver is not None:
+        routes.append(('diver_detail', 'GET', f'/diver/{diver.id}', None))
+    if dive_id is not None:
+        routes.append(('dive_detail', 'GET', f'/dive/{dive_id}', None))
+    if user.role == 'admin':
+        routes += [('users', 'GET', '/users', None), ('metrics', 'GET', '/metrics', None)]
+    return routes
+
+
+def run(users, repeat, seed):
+    from app import app, db, User
+
+    rng = random.Random(seed)
+    with app.app_context():
+        all_ids = [row[0] for row in db.session.query(User.id).order_by(User.id)]
+        if not all_ids:
+            raise SystemExit('No users in the database; run benchmarks/generate_data.py first')
+        sample = sorted(rng.sample(all_ids, min(users, len(all_ids))))
+        sample_users = User.query.filter(User.id.in_(sample)).all()
+        db.session.expunge_all()
+
+    latencies, queries = {}, {}
+    for user in sample_users:
+        client = app.test_client()
+        with client.session_transaction() as session:
+            session['_user_id'] = str(user.id)
+            session['_fresh'] = True
+        for name, method, url, data in user_routes(app, db, user):
+            for _ in range(repeat):
+                if name == 'dives_page_2':
+                    first_page = client.get('/dives').get_data(as_text=True)
+                    match = re.search(r'cursor=([^"&]+)', first_page)
+                    if not match:
+                        break
+                    url = f'/dives?cursor={match.group(1)}'
+                started = time.perf_counter()
+                response = client.open(url, method=method, data=data)
+                response.get_data()
+                elapsed = (time.perf_counter() - started) * 1000
+                if response.status_code >= 400:
+                    print(f'⚠ {name} {url} returned {response.status_code}')
+                latencies.setdefault(name, []).append(elapsed)
+                match = QUERIES_RE.search(response.headers.get('Server-Timing', ''))
+                if match:
+                    queries.setdefault(name, []).append(int(match.group(1)))
+
+    with app.app_context():
+        database = str(db.engine.url)
+    return {
+        'meta': {
+            'database': database,
+            'users': len(sample_users),
+            'repeat': repeat,
+            'seed': seed,
+            'python': platform.python_version(),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        },
+        'routes': {
+            name: {
+                'requests': len(samples),
+                'p50_ms': round(percentile(samples, 50), 2),
+                'p95_ms': round(percentile(samples, 95), 2),
+                'p99_ms': round(percentile(samples, 99), 2),
+                'queries_mean': round(statistics.mean(queries[name]), 2) if queries.get(name) else None,
+                'queries_max': max(queries[name]) if queries.get(name) else None,
+            }
+            for name, samples in sorted(latencies.items())
+        },
+        'peak_rss_mb': round(peak_rss_mb(), 1),
+    }
+
+
+def compare(baseline, candidate, tolerance=DEFAULT_TOLERANCE):
+    """Return a list of human-readable regressions from baseline to candidate.
+
+    p99 is reported but not compared: with a few hundred samples it is too noisy.
+    """
+    regressions = []
+    for name, old in baseline['routes'].items():
+        new = candidate['routes'].get(name)
+        if new is None:
+            continue
+        for metric in ('p50_ms', 'p95_ms'):
+            # Ignore millisecond-level noise on very fast routes.
+            if new[metric] > old[metric] * (1 + tolerance) and new[metric] - old[metric] > 2:
+                regressions.append(f'{name}: {metric} {old[metric]} -> {new[metric]}')
+        if old['queries_max'] is not None and new['queries_max'] is not None and new['queries_max'] > old['queries_max']:
+            regressions.append(f"{name}: queries_max {old['queries_max']} -> {new['queries_max']}")
+    if candidate['peak_rss_mb'] > baseline['peak_rss_mb'] * (1 + tolerance):
+        regressions.append(f"peak_rss_mb {baseline['peak_rss_mb']} -> {candidate['peak_rss_mb']}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark every route and compare baselines')
+    parser.add_argument('--users', type=int, default=5, help='number of sample users')
+    parser.add_argument('--repeat', type=int, default=20, help='requests per route per user')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--out', help='write the results to this JSON file')
+    parser.add_argument('--compare', nargs=2, metavar=('BASELINE', 'CANDIDATE'))
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE,
+                        help='allowed fractional increase before --compare flags a regression')
+    args = parser.parse_args()
+
+    if args.compare:
+        with open(args.compare[0]) as f:
+            baseline = json.load(f)
+        with open(args.compare[1]) as f:
+            candidate = json.load(f)
+        regressions = compare(baseline, candidate, args.tolerance)
+        for regression in regressions:
+            print(f'✗ {regression}')
+        if not regressions:
+            print('✓ No regressions')
+        return 1 if regressions else 0
+
+    results = run(args.users, args.repeat, args.seed)
+    print(f"{'route':<20}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'queries':>10}")
+    for name, row in results['routes'].items():
+        print(f"{name:<20}{row['p50_ms']:>10}{row['p95_ms']:>10}{row['p99_ms']:>10}{str(row['queries_max']):>10}")
+    print(f"peak RSS: {results['peak_rss_mb']} MB")
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f'Results written to {args.out}')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
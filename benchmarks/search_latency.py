@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+"""
+Search latency check.
+
+Runs search.search() as a sample of users from the database picked with
+DATABASE_URL (see generate_data.py) for a fixed set of queries, with and
+without a kind filter, and reports p50/p95 per query. Exits with status 1
+when any p95 is over the budget.
+
+Ownership is filtered inside the FTS5 match, so the cost left is bm25's pass
+over every document containing each term; the generated notes draw on a few
+words, which makes them the slowest case.
+
+Usage:
+    DATABASE_URL=sqlite:////tmp/bench.db python benchmarks/search_latency.py
+    DATABASE_URL=sqlite:////tmp/bench.db python benchmarks/search_latency.py --budget-ms 50 --users 20
+"""
+
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Words generate_data.py puts in notes, conditions, site descriptions, equipment and certifications.
+QUERIES = ['drift', 'strong current', 'reef shark', 'wreck turtle', 'manta', 'belize', 'regulator', 'apeks', 'padi', 'zzz']
+KINDS = [None, 'dive', 'site', 'equipment']
+DEFAULT_BUDGET_MS = 100.0
+
+
+def percentile(samples, pct):
+    if len(samples) < 2:
+        return samples[0] if samples else 0.0
+    return statistics.quantiles(samples, n=100, method='inclusive')[pct - 1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure search latency against a budget')
+    parser.add_argument('--users', type=int, default=10, help='users sampled from the database')
+    parser.add_argument('--repeat', type=int, default=3, help='runs per user and query')
+    parser.add_argument('--budget-ms', type=float, default=DEFAULT_BUDGET_MS, help='p95 limit per query')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    import search
+    from app import app, db, User
+
+    with app.app_context():
+        user_ids = [user_id for user_id, in db.session.query(User.id).order_by(User.id)]
+        users = random.Random(args.seed).sample(user_ids, min(args.users, len(user_ids)))
+        conn = db.session.connection()
+        print(f"{len(users)} users, {args.repeat} runs each, budget p95 {args.budget_ms:.1f} ms")
+        print(f"{'query':<24} {'kind':<10} {'results':>8} {'p50 ms':>8} {'p95 ms':>8}")
+        over = []
+        for query in QUERIES:
+            for kind in KINDS:
+                samples, results = [], 0
+                for user_id in users:
+                    for _ in range(args.repeat):
+                        started = time.perf_counter()
+                        results = len(search.search(conn, query, user_id, kind))
+                        samples.append((time.perf_counter() - started) * 1000)
+                p95 = percentile(samples, 95)
+                print(f"{query:<24} {kind or 'all':<10} {results:>8} {statistics.median(samples):>8.2f} {p95:>8.2f}")
+                if p95 > args.budget_ms:
+                    over.append((query, kind, p95))
+    for query, kind, p95 in over:
+        print(f"✗ {query!r} ({kind or 'all'}): p95 {p95:.2f} ms is over {args.budget_ms:.1f} ms")
+    if not over:
+        print(f"✓ every query within {args.budget_ms:.1f} ms at p95")
+    return 1 if over else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
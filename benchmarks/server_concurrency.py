@@ -0,0 +1,197 @@
+#!/usr/bin/env python
+"""
+Concurrency benchmark for the serving modes.
+
+Starts server.py in each mode against the database picked with DATABASE_URL
+(see generate_data.py), logs a pool of client threads in as users from that
+database, and has them request pages over persistent HTTP connections for a
+fixed time. It reports throughput, latency percentiles and failed requests
+per mode, then sends SIGTERM while requests are in flight and reports how
+long the server took to stop and whether those requests still completed.
+
+Usage:
+    DATABASE_URL=sqlite:////tmp/bench.db python benchmarks/server_concurrency.py [--seconds 10] [--clients 32]
+"""
+
+import argparse
+import http.client
+import os
+import signal
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from urllib.parse import urlencode
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from server import MODES, wait_until_ready
+
+PATHS = ['/dashboard', '/divers', '/dives', '/dive-sites', '/equipment']
+SHUTDOWN_REQUESTS = 8
+
+
+def percentile(samples, pct):
+    if len(samples) < 2:
+        return samples[0] if samples else 0.0
+    return statistics.quantiles(samples, n=100, method='inclusive')[pct - 1]
+
+
+def bench_usernames(count):
+    from app import app, User
+    with app.app_context():
+        return [user.username for user in User.query.filter(User.username.like('bench%')).order_by(User.id).limit(count)]
+
+
+def login(port, username, password):
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+    conn.request('POST', '/login', urlencode({'username': username, 'password': password}),
+                 {'Content-Type': 'application/x-www-form-urlencoded'})
+    response = conn.getresponse()
+    response.read()
+    cookie = response.getheader('Set-Cookie', '').split(';', 1)[0]
+    if response.status != 302 or not cookie:
+        raise SystemExit(f'Could not log in as {username}: HTTP {response.status}')
+    return conn, cookie
+
+
+def login_all(port, usernames, password):
+    """Log every client in before the clock starts; password hashing would otherwise dominate."""
+    sessions = [None] * len(usernames)
+
+    def run(i):
+        sessions[i] = login(port, usernames[i], password)
+
+    workers = [threading.Thread(target=run, args=(i,)) for i in range(len(usernames))]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    if None in sessions:
+        raise SystemExit('Could not log every client in')
+    return sessions
+
+
+def client(conn, cookie, stop, results, lock):
+    latencies, errors, i = [], 0, 0
+    while not stop.is_set():
+        path = PATHS[i % len(PATHS)]
+        i += 1
+        start = time.perf_counter()
+        try:
+            conn.request('GET', path, headers={'Cookie': cookie})
+            response = conn.getresponse()
+            response.read()
+            if response.status != 200:
+                errors += 1
+                continue
+        except (OSError, http.client.HTTPException):
+            errors += 1
+            conn.close()
+            continue
+        latencies.append((time.perf_counter() - start) * 1000)
+    with lock:
+        results['latencies'] += latencies
+        results['errors'] += errors
+
+
+def start_server(mode, port, threads):
+    env = dict(os.environ, ALERT_REFRESH_INTERVAL='0')
+    process = subprocess.Popen([sys.executable, os.path.join(ROOT, 'server.py'), '--mode', mode,
+                                '--port', str(port), '--threads', str(threads)],
+                               env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    if not wait_until_ready('127.0.0.1', port, timeout=60):
+        process.kill()
+        raise SystemExit(f'{mode} server did not start on port {port}')
+    return process
+
+
+def shutdown_under_load(process, sessions):
+    """SIGTERM while a dive export per session is in flight: (seconds to exit, requests completed)."""
+    completed = []
+
+    def export(conn, cookie):
+        try:
+            conn.request('GET', '/export/dives.csv', headers={'Cookie': cookie})
+            response = conn.getresponse()
+            response.read()
+            completed.append(response.status == 200)
+        except (OSError, http.client.HTTPException):
+            completed.append(False)
+
+    workers = [threading.Thread(target=export, args=session) for session in sessions]
+    for worker in workers:
+        worker.start()
+    time.sleep(0.05)
+    start = time.perf_counter()
+    process.send_signal(signal.SIGTERM)
+    try:
+        process.wait(timeout=60)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+    elapsed = time.perf_counter() - start
+    for worker in workers:
+        worker.join()
+    return elapsed, sum(completed)
+
+
+def run_mode(mode, port, usernames, password, seconds, threads):
+    process = start_server(mode, port, threads)
+    try:
+        stop = threading.Event()
+        results = {'latencies': [], 'errors': 0}
+        lock = threading.Lock()
+        sessions = login_all(port, usernames, password)
+        workers = [threading.Thread(target=client, args=session + (stop, results, lock)) for session in sessions]
+        for worker in workers:
+            worker.start()
+        time.sleep(seconds)
+        stop.set()
+        for worker in workers:
+            worker.join()
+        stopped_in, completed = shutdown_under_load(process, login_all(port, usernames[:SHUTDOWN_REQUESTS], password))
+    finally:
+        if process.poll() is None:
+            process.kill()
+    latencies = results['latencies']
+    return {
+        'mode': mode,
+        'requests_per_s': len(latencies) / seconds,
+        'p50_ms': percentile(latencies, 50),
+        'p95_ms': percentile(latencies, 95),
+        'p99_ms': percentile(latencies, 99),
+        'errors': results['errors'],
+        'shutdown_s': stopped_in,
+        'completed_on_shutdown': completed,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--clients', type=int, default=32)
+    parser.add_argument('--threads', type=int, default=8, help='waitress worker threads')
+    parser.add_argument('--port', type=int, default=5091)
+    parser.add_argument('--password', default='bench123')
+    parser.add_argument('--modes', nargs='+', choices=MODES, default=['development', 'production'])
+    args = parser.parse_args()
+
+    usernames = bench_usernames(args.clients)
+    if not usernames:
+        raise SystemExit('No bench users found; run benchmarks/generate_data.py first')
+    usernames = (usernames * args.clients)[:args.clients]
+
+    print(f"{'mode':<12} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'errors':>7} "
+          f"{'stop s':>7} {'drained':>8}")
+    for offset, mode in enumerate(args.modes):
+        result = run_mode(mode, args.port + offset, usernames, args.password, args.seconds, args.threads)
+        print(f"{result['mode']:<12} {result['requests_per_s']:>8.1f} {result['p50_ms']:>8.1f} "
+              f"{result['p95_ms']:>8.1f} {result['p99_ms']:>8.1f} {result['errors']:>7} "
+              f"{result['shutdown_s']:>7.2f} {result['completed_on_shutdown']:>6}/{SHUTDOWN_REQUESTS}")
+
+
+if __name__ == '__main__':
+    main()
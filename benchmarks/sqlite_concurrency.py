@@ -0,0 +1,153 @@
+#!/usr/bin/env python
+"""
+Concurrency benchmark for the SQLite storage profiles.
+
+Runs the same mixed workload against a fresh database file under each
+profile: writer threads log dives (a dive row plus its dive_diver rows, one
+transaction each) while reader threads run the dashboard aggregate. It
+reports throughput, latency percentiles and "database is locked" failures.
+
+Usage: python benchmarks/sqlite_concurrency.py [--seconds 10] [--writers 4] [--readers 8]
+"""
+
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DATABASE_URL', 'sqlite://')
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import OperationalError
+
+import storage
+from app import db
+
+SEED_USERS = 20
+SEED_DIVERS_PER_USER = 10
+
+DASHBOARD_SQL = text("""
+    SELECT
+        (SELECT count(*) FROM diver WHERE user_id = :user_id),
+        (SELECT count(DISTINCT dive_id) FROM dive_diver
+            WHERE diver_id IN (SELECT id FROM diver WHERE user_id = :user_id)),
+        (SELECT count(*) FROM equipment
+            WHERE diver_id IN (SELECT id FROM diver WHERE user_id = :user_id))
+""")
+
+
+def build_engine(profile, path):
+    uri = f'sqlite:///{path}'
+    engine = create_engine(uri, **storage.engine_options(profile, uri))
+    storage.install_pragmas(engine, profile)
+    return engine
+
+
+def seed(engine):
+    db.metadata.create_all(engine)
+    with engine.begin() as conn:
+        conn.execute(text("INSERT INTO dive_site (id, name, location) VALUES (1, 'Bench Reef', 'Nowhere')"))
+        for user_id in range(1, SEED_USERS + 1):
+            conn.execute(text("INSERT INTO user (id, username, email, password_hash) VALUES (:id, :name, :email, 'x')"),
+                         {'id': user_id, 'name': f'user{user_id}', 'email': f'user{user_id}@bench.local'})
+            conn.execute(text("INSERT INTO diver (user_id, first_name, last_name) VALUES (:user_id, 'Bench', 'Diver')"),
+                         [{'user_id': user_id}] * SEED_DIVERS_PER_USER)
+
+
+def percentile(samples, pct):
+    if not samples:
+        return 0.0
+    return statistics.quantiles(samples, n=100)[pct - 1] if len(samples) > 1 else samples[0]
+
+
+def run_profile(profile, seconds, writers, readers):
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = build_engine(profile, os.path.join(tmp, 'bench.db'))
+        seed(engine)
+        stop = threading.Event()
+        results = {'write': [], 'read': [], 'errors': 0}
+        lock = threading.Lock()
+
+        def writer(worker_id):
+            rng = random.Random(worker_id)
+            latencies, errors = [], 0
+            while not stop.is_set():
+                user_id = rng.randint(1, SEED_USERS)
+                started = time.perf_counter()
+                try:
+                    with engine.begin() as conn:
+                        dive_id = conn.execute(
+                            text("INSERT INTO dive (site_id, dive_date, max_depth) VALUES (1, :date, :depth)"),
+                            {'date': datetime(2024, 1, 1) + timedelta(minutes=rng.randint(0, 500000)),
+                             'depth': rng.uniform(5, 40)}).lastrowid
+                        diver_ids = conn.execute(text("SELECT id FROM diver WHERE user_id = :u LIMIT 3"),
+                                                 {'u': user_id}).scalars().all()
+                        conn.execute(text("INSERT INTO dive_diver (dive_id, diver_id) VALUES (:dive, :diver)"),
+                                     [{'dive': dive_id, 'diver': d} for d in diver_ids])
+                    latencies.append(time.perf_counter() - started)
+                except OperationalError:
+                    errors += 1
+            with lock:
+                results['write'] += latencies
+                results['errors'] += errors
+
+        def reader(worker_id):
+            rng = random.Random(1000 + worker_id)
+            latencies, errors = [], 0
+            while not stop.is_set():
+                started = time.perf_counter()
+                try:
+                    with engine.connect() as conn:
+                        conn.execute(DASHBOARD_SQL, {'user_id': rng.randint(1, SEED_USERS)}).one()
+                    latencies.append(time.perf_counter() - started)
+                except OperationalError:
+                    errors += 1
+            with lock:
+                results['read'] += latencies
+                results['errors'] += errors
+
+        threads = [threading.Thread(target=writer, args=(i,)) for i in range(writers)]
+        threads += [threading.Thread(target=reader, args=(i,)) for i in range(readers)]
+        for thread in threads:
+            thread.start()
+        time.sleep(seconds)
+        stop.set()
+        for thread in threads:
+            thread.join()
+        engine.dispose()
+
+    return {
+        'writes_per_s': len(results['write']) / seconds,
+        'reads_per_s': len(results['read']) / seconds,
+        'write_p50_ms': percentile(results['write'], 50) * 1000,
+        'write_p95_ms': percentile(results['write'], 95) * 1000,
+        'read_p50_ms': percentile(results['read'], 50) * 1000,
+        'read_p95_ms': percentile(results['read'], 95) * 1000,
+        'locked_errors': results['errors'],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare SQLite storage profiles under concurrent load')
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--writers', type=int, default=4)
+    parser.add_argument('--readers', type=int, default=8)
+    parser.add_argument('--profiles', nargs='+', default=['default', 'production'], choices=list(storage.PROFILES))
+    args = parser.parse_args()
+
+    rows = {profile: run_profile(profile, args.seconds, args.writers, args.readers) for profile in args.profiles}
+
+    metrics = list(next(iter(rows.values())))
+    print(f"{'metric':<16}" + ''.join(f'{profile:>14}' for profile in rows))
+    for metric in metrics:
+        print(f'{metric:<16}' + ''.join(f'{rows[profile][metric]:>14.1f}' for profile in rows))
+
+
+if __name__ == '__main__':
+    main()
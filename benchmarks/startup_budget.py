@@ -0,0 +1,146 @@
+#!/usr/bin/env python
+"""
+Startup budget check.
+
+Starts server.py (production mode) against the database picked with
+DATABASE_URL as a fresh process several times and measures the wall time
+from spawning it to the first rendered login page, plus the phases the
+server reports through startup.py. The median is compared with the budget
+recorded in startup_budget.json; the script exits with status 1 when it is
+over budget by more than the tolerance.
+
+--imports adds one run under `python -X importtime` and breaks the import
+time down by phase and top-level package.
+
+Usage:
+    python benchmarks/startup_budget.py                 # check against the budget
+    python benchmarks/startup_budget.py --imports       # plus the import breakdown
+    python benchmarks/startup_budget.py --record        # store the measured median as the budget
+"""
+
+import argparse
+import http.client
+import json
+import os
+import re
+import signal
+import statistics
+import subprocess
+import sys
+import time
+from collections import defaultdict
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BUDGET_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'startup_budget.json')
+DEFAULT_TOLERANCE = 0.25
+
+PHASE_RE = re.compile(r'^startup: (.+) ([\d.]+) ms$')
+IMPORT_RE = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \| (\s*)(\S+)$')
+
+
+def first_page(port, deadline):
+    """Poll GET /login until it renders; connection refusals count as not started yet."""
+    while time.monotonic() < deadline:
+        conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+        try:
+            conn.request('GET', '/login')
+            response = conn.getresponse()
+            response.read()
+            if response.status == 200:
+                return True
+        except (OSError, http.client.HTTPException):
+            time.sleep(0.005)
+        finally:
+            conn.close()
+    return False
+
+
+def run_once(port, importtime=False):
+    """(milliseconds to the first login page, [(phase, ms)], stderr lines)."""
+    env = dict(os.environ, STARTUP_REPORT='1')
+    command = [sys.executable] + (['-X', 'importtime'] if importtime else []) + \
+        [os.path.join(ROOT, 'server.py'), '--mode', 'production', '--port', str(port)]
+    start = time.perf_counter()
+    process = subprocess.Popen(command, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    try:
+        if not first_page(port, time.monotonic() + 60):
+            raise SystemExit('Server did not render /login within 60 s')
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        process.send_signal(signal.SIGTERM)
+        _, stderr = process.communicate(timeout=30)
+    finally:
+        if process.poll() is None:
+            process.kill()
+            process.wait()
+    lines = stderr.splitlines()
+    phases = [(m.group(1), float(m.group(2))) for m in map(PHASE_RE.match, lines) if m]
+    return elapsed_ms, phases, lines
+
+
+def import_breakdown(lines, top=8):
+    """{phase: [(package, self ms)]}: import self time per top-level package, attributed to the phase it ran in."""
+    pending = defaultdict(float)
+    breakdown = {}
+    for line in lines:
+        match = IMPORT_RE.match(line)
+        if match:
+            pending[match.group(4).split('.')[0]] += int(match.group(1)) / 1000
+            continue
+        match = PHASE_RE.match(line)
+        if match and pending:
+            breakdown[match.group(1)] = sorted(pending.items(), key=lambda item: -item[1])[:top]
+            pending = defaultdict(float)
+    if pending:
+        breakdown['interpreter shutdown'] = sorted(pending.items(), key=lambda item: -item[1])[:top]
+    return breakdown
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--port', type=int, default=5093)
+    parser.add_argument('--imports', action='store_true', help='add an -X importtime run and break it down by phase')
+    parser.add_argument('--record', action='store_true', help=f'write the median to {os.path.basename(BUDGET_FILE)}')
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE)
+    args = parser.parse_args()
+
+    totals, by_phase = [], defaultdict(list)
+    for _ in range(args.runs):
+        elapsed_ms, phases, _ = run_once(args.port)
+        totals.append(elapsed_ms)
+        for phase, ms in phases:
+            by_phase[phase].append(ms)
+    median = statistics.median(totals)
+
+    print(f"{'phase':<20} {'median ms':>10}")
+    for phase, samples in by_phase.items():
+        print(f"{phase:<20} {statistics.median(samples):>10.1f}")
+    print(f"{'first login page':<20} {median:>10.1f}   (min {min(totals):.1f}, max {max(totals):.1f}, {args.runs} runs)")
+
+    if args.imports:
+        _, _, lines = run_once(args.port, importtime=True)
+        for phase, packages in import_breakdown(lines).items():
+            print(f"\nimports during {phase}:")
+            for package, ms in packages:
+                print(f"  {package:<28} {ms:>8.1f} ms")
+
+    if args.record:
+        with open(BUDGET_FILE, 'w') as f:
+            json.dump({'first_page_ms': round(median, 1),
+                       'phases_ms': {phase: round(statistics.median(samples), 1) for phase, samples in by_phase.items()}},
+                      f, indent=2)
+            f.write('\n')
+        print(f"\nRecorded budget in {BUDGET_FILE}")
+        return
+
+    with open(BUDGET_FILE) as f:
+        budget = json.load(f)['first_page_ms']
+    limit = budget * (1 + args.tolerance)
+    if median > limit:
+        print(f"\nOVER BUDGET: {median:.1f} ms > {budget:.1f} ms + {args.tolerance:.0%}")
+        sys.exit(1)
+    print(f"\nWithin budget: {median:.1f} ms <= {budget:.1f} ms + {args.tolerance:.0%}")
+
+
+if __name__ == '__main__':
+    main()
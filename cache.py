@@ -0,0 +1,137 @@
+"""
+Small in-process caches shared by the Flask routes.
+"""
+
+import hashlib
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from functools import wraps
+
+from flask import current_app, make_response, request, session
+from flask_login import current_user
+from markupsafe import Markup
+
+
+class TTLCache:
+    """Thread-safe LRU cache whose entries also expire after `ttl` seconds."""
+
+    def __init__(self, maxsize=1024, ttl=300):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return default
+            expires, value = item
+            if expires < time.monotonic():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class PageCache:
+    """Rendered fragments and whole GET responses, keyed on data versions.
+
+    Every entry's key includes the current version of the data scopes it was
+    rendered from ('sites', 'user:<id>', ...). Writes call bump() for the
+    scopes they change, so stale entries are never looked up again and age
+    out of the LRU. Whole responses are also keyed on the user and URL, carry
+    an ETag derived from that key and answer If-None-Match with a 304. A hit
+    runs no query and renders no template.
+
+    Versions live in this process; writes from other processes (CLI scripts)
+    show up once entries expire after `ttl` seconds.
+    """
+
+    def __init__(self, maxsize=512, ttl=300, max_bytes=512 * 1024):
+        self.entries = TTLCache(maxsize, ttl)
+        self.max_bytes = max_bytes
+        self._versions = {}
+        self._lock = threading.Lock()
+        # ETags from an earlier process must never match, since versions restart at zero.
+        self._epoch = uuid.uuid4().hex[:8]
+
+    def bump(self, *scopes):
+        with self._lock:
+            for scope in scopes:
+                self._versions[scope] = self._versions.get(scope, 0) + 1
+
+    def clear(self):
+        with self._lock:
+            self._versions.clear()
+            self._epoch = uuid.uuid4().hex[:8]
+        self.entries.clear()
+
+    def versions(self, scopes):
+        with self._lock:
+            return (self._epoch,) + tuple(self._versions.get(scope, 0) for scope in scopes)
+
+    def fragment(self, name, scopes, render):
+        """Markup from render(), shared by every user until one of `scopes` changes."""
+        key = ('fragment', name) + self.versions(scopes)
+        html = self.entries.get(key)
+        if html is None:
+            html = Markup(render())
+            self.entries.set(key, html)
+        return html
+
+    def page(self, *scopes):
+        """Cache a view's GET responses per user. '{user}' in a scope becomes the current user's id."""
+        def decorator(view):
+            @wraps(view)
+            def wrapped(*args, **kwargs):
+                # A pending flash message is rendered once and must not be cached or skipped.
+                if request.method != 'GET' or session.get('_flashes'):
+                    return view(*args, **kwargs)
+                user_id = current_user.get_id()
+                key = ('page', user_id, request.full_path) + self.versions(
+                    [scope.format(user=user_id) for scope in scopes])
+                etag = hashlib.sha1(repr(key).encode()).hexdigest()[:24]
+
+                if request.if_none_match.contains(etag):
+                    response = current_app.response_class(status=304)
+                else:
+                    cached = self.entries.get(key)
+                    if cached is not None:
+                        body, content_type = cached
+                        response = current_app.response_class(body, content_type=content_type)
+                        response.headers['X-Cache'] = 'HIT'
+                    else:
+                        response = make_response(view(*args, **kwargs))
+                        if response.status_code != 200 or response.is_streamed:
+                            return response
+                        body = response.get_data()
+                        if len(body) <= self.max_bytes:
+                            self.entries.set(key, (body, response.content_type))
+                        response.headers['X-Cache'] = 'MISS'
+                response.set_etag(etag)
+                response.cache_control.private = True
+                response.cache_control.no_cache = True
+                return response
+            return wrapped
+        return decorator
@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+"""
+EXPLAIN-based index check for the read routes.
+
+Drives every GET route through the Flask test client as an existing user,
+captures the SQL each one issues and runs EXPLAIN QUERY PLAN on it. Any plan
+step that scans a table without an index is reported, and the script exits
+with status 1 so it can gate a release.
+
+Routes only read, so this is safe to run against a live database. Run
+`python migrate.py` first on an older database.
+
+Usage: python check_indexes.py [--user USERNAME]
+"""
+
+import argparse
+import re
+import sys
+
+from sqlalchemy import event
+
+from app import app, db, User, Diver, dive_diver
+
+# Tables these pages list in full on purpose; scanning them is expected.
+FULL_LISTING_TABLES = {'centre', 'user', 'dive_site', 'site_stats'}
+
+SCAN_RE = re.compile(r'^SCAN (\w+)(?: AS \w+)?$')
+
+
+def route_urls(user):
+    urls = ['/dashboard', '/divers', '/equipment', '/certifications', '/dives', '/dive-sites', '/trips']
+    if user.role == 'admin':
+        urls += ['/users', f'/user/{user.id}/edit']
+    diver = Diver.query.filter_by(user_id=user.id).first()
+    if diver is not None:
+        urls.append(f'/diver/{diver.id}')
+        dive_id = db.session.query(dive_diver.c.dive_id).filter(dive_diver.c.diver_id == diver.id).limit(1).scalar()
+        if dive_id is not None:
+            urls.append(f'/dive/{dive_id}')
+    return urls
+
+
+def capture_statements(user, urls):
+    captured = {}
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith('SELECT') and not executemany:
+            captured.setdefault(current_url[0], []).append((statement, parameters))
+
+    current_url = [None]
+    event.listen(db.engine, 'before_cursor_execute', record)
+    try:
+        client = app.test_client()
+        with client.session_transaction() as session:
+            session['_user_id'] = str(user.id)
+            session['_fresh'] = True
+        for url in urls:
+            current_url[0] = url
+            response = client.get(url)
+            if response.status_code != 200:
+                print(f"⚠ {url} returned {response.status_code}")
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', record)
+    return captured
+
+
+def unindexed_scans(conn, statement, parameters):
+    plan = conn.exec_driver_sql(f'EXPLAIN QUERY PLAN {statement}', parameters).fetchall()
+    scans = []
+    for row in plan:
+        match = SCAN_RE.match(row[-1])
+        if match and match.group(1) in db.metadata.tables and match.group(1) not in FULL_LISTING_TABLES:
+            scans.append(row[-1])
+    return scans
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--user', help='username to run the routes as (default: first admin)')
+    args = parser.parse_args()
+
+    with app.app_context():
+        if args.user:
+            user = User.query.filter_by(username=args.user).first()
+        else:
+            user = User.query.filter_by(role='admin').first() or User.query.first()
+        if user is None:
+            print("No users found; run setup.py first")
+            return 1
+
+        captured = capture_statements(user, route_urls(user))
+        failures = 0
+        with db.engine.connect() as conn:
+            for url, statements in captured.items():
+                problems = set()
+                for statement, parameters in statements:
+                    for scan in unindexed_scans(conn, statement, parameters):
+                        problems.add((scan, ' '.join(statement.split())[:160]))
+                if problems:
+                    failures += len(problems)
+                    print(f"✗ {url}")
+                    for scan, statement in sorted(problems):
+                        print(f"    {scan}: {statement}")
+                else:
+                    print(f"✓ {url} ({len(statements)} queries, all indexed)")
+        db.session.rollback()
+
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,123 @@
+"""
+Set-based deletes for users, divers, equipment and certifications.
+
+Deleting a diver through the ORM loads every piece of equipment,
+certification and dive link into the session first. These functions delete
+whole sets instead: one statement per table, children before parents, inside
+the caller's transaction. They do not rely on ON DELETE CASCADE, which
+databases created before the models declared it do not have (SQLite cannot
+add it to an existing table), and they keep the dive statistics in step.
+As before, a deleted diver's dives stay and keep counting for their sites;
+only the links go.
+
+archive() writes the rows about to be deleted, with their children, to a
+JSON Lines stream first.
+"""
+
+import json
+from datetime import date, datetime
+
+from sqlalchemy import delete, select
+
+import manifests
+import stats
+
+KINDS = {
+    'divers': 'diver',
+    'equipment': 'equipment',
+    'certifications': 'certification',
+}
+
+# Keeps every IN (...) list well below SQLite's bound-parameter limit.
+CHUNK_SIZE = 5000
+
+
+def _chunks(ids):
+    ids = list(ids)
+    for start in range(0, len(ids), CHUNK_SIZE):
+        yield ids[start:start + CHUNK_SIZE]
+
+
+def owned_ids(conn, tables, kind, ids, user_id):
+    """The subset of `ids` of `kind` that belongs to user_id's divers."""
+    diver = tables['diver']
+    table = tables[KINDS[kind]]
+    owner = table.c.user_id if kind == 'divers' else \
+        select(diver.c.user_id).where(diver.c.id == table.c.diver_id).scalar_subquery()
+    owned = set()
+    for chunk in _chunks(set(ids)):
+        owned.update(conn.execute(select(table.c.id).where(table.c.id.in_(chunk), owner == user_id)).scalars())
+    return owned
+
+
+def delete_divers(conn, tables, diver_ids):
+    """Delete divers with their equipment, certifications, dive links and trip places. Returns counts."""
+    diver, dive_diver = tables['diver'], tables['dive_diver']
+    counts = dict.fromkeys(('divers', 'equipment', 'certifications'), 0)
+    for chunk in _chunks(diver_ids):
+        stats.remove_divers(conn, tables, chunk)
+        for kind in ('equipment', 'certifications'):
+            table = tables[KINDS[kind]]
+            counts[kind] += conn.execute(delete(table).where(table.c.diver_id.in_(chunk))).rowcount
+        conn.execute(delete(dive_diver).where(dive_diver.c.diver_id.in_(chunk)))
+        conn.execute(delete(tables['trip_diver']).where(tables['trip_diver'].c.diver_id.in_(chunk)))
+        counts['divers'] += conn.execute(delete(diver).where(diver.c.id.in_(chunk))).rowcount
+    return counts
+
+
+def delete_items(conn, tables, kind, ids):
+    """Delete divers, equipment or certifications by id. Returns counts per kind."""
+    if kind == 'divers':
+        return delete_divers(conn, tables, ids)
+    table = tables[KINDS[kind]]
+    return {kind: sum(conn.execute(delete(table).where(table.c.id.in_(chunk))).rowcount for chunk in _chunks(ids))}
+
+
+def user_diver_ids(conn, tables, user_id):
+    diver = tables['diver']
+    return conn.execute(select(diver.c.id).where(diver.c.user_id == user_id)).scalars().all()
+
+
+def delete_user(conn, tables, user_id):
+    """Delete a user with all their divers (see delete_divers), trips and due items. Returns counts."""
+    counts = delete_divers(conn, tables, user_diver_ids(conn, tables, user_id))
+    trip = tables['trip']
+    counts['trips'] = manifests.delete_trips(
+        conn, tables, conn.execute(select(trip.c.id).where(trip.c.user_id == user_id)).scalars().all())
+    conn.execute(delete(tables['due_item']).where(tables['due_item'].c.user_id == user_id))
+    counts['users'] = conn.execute(delete(tables['user']).where(tables['user'].c.id == user_id)).rowcount
+    return counts
+
+
+# ============ Archive ============
+
+def _default(value):
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    raise TypeError(f'{type(value).__name__} is not JSON serialisable')
+
+
+def _write(stream, record_kind, rows):
+    count = 0
+    for row in rows:
+        stream.write(json.dumps(dict(row, record=record_kind), default=_default))
+        stream.write('\n')
+        count += 1
+    return count
+
+
+def archive(conn, tables, kind, ids, stream):
+    """Write the rows of `kind` with these ids to stream as JSON Lines; a diver brings its equipment,
+    certifications, dive links and trip places. Each line carries a `record` field naming its table.
+    Returns the line count."""
+    table = tables[KINDS[kind]]
+    count = 0
+    for chunk in _chunks(ids):
+        count += _write(stream, KINDS[kind], conn.execute(select(table).where(table.c.id.in_(chunk))).mappings())
+        if kind != 'divers':
+            continue
+        for child in ('equipment', 'certification', 'dive_diver', 'trip_diver'):
+            child_table = tables[child]
+            count += _write(stream, child, conn.execute(
+                select(child_table).where(child_table.c.diver_id.in_(chunk))).mappings())
+    return count
@@ -23,11 +23,12 @@ a = Analysis(
         'click',
         'itsdangerous',
         'email_validator',
+        'waitress',
     ],
     hookspath=[],
     hooksconfig={},
     runtime_hooks=[],
-    excludes=[],
+    excludes=['tkinter'],
     win_no_prefer_redirects=False,
     win_private_assemblies=False,
     cipher=None,
@@ -45,7 +46,7 @@ exe = EXE(
     debug=False,
     bootloader_ignore_signals=False,
     strip=False,
-    upx=True,
+    upx=False,  # UPX-compressed libraries are decompressed on every launch
     console=False,  # Hide console window
     disable_windowed_traceback=False,
     argv_emulation=False,
@@ -60,7 +61,7 @@ coll = COLLECT(
     a.zipfiles,
     a.datas,
     strip=False,
-    upx=True,
+    upx=False,
     upx_exclude=[],
     name='DivingAdmin',
 )
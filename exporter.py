@@ -0,0 +1,126 @@
+"""
+Streaming export of a user's logbook.
+
+Each export is a single Core SELECT that resolves dive sites and divers with
+joins (dive divers are aggregated with GROUP_CONCAT), executed with yield_per
+so rows arrive from the database in batches and are written straight to the
+response. No ORM objects are built and memory does not grow with the export.
+
+Column names match importer.py, so an export can be imported again.
+"""
+
+import csv
+import io
+import json
+from datetime import date, datetime
+
+from sqlalchemy import func, select
+
+FORMATS = {
+    'csv': ('text/csv; charset=utf-8', 'csv'),
+    'jsonl': ('application/x-ndjson', 'jsonl'),
+    # UTF-8 BOM and CRLF so Excel opens it with the right encoding.
+    'excel': ('text/csv; charset=utf-8', 'csv'),
+}
+KINDS = ('dives', 'divers', 'equipment', 'certifications')
+YIELD_PER = 1000
+
+
+def _diver_name(diver):
+    return diver.c.first_name + ' ' + diver.c.last_name
+
+
+def build_query(tables, kind, user_id):
+    diver = tables['diver']
+    own_diver_ids = select(diver.c.id).where(diver.c.user_id == user_id)
+
+    if kind == 'divers':
+        return select(
+            diver.c.first_name, diver.c.last_name, diver.c.certification_level,
+            diver.c.certification_number, diver.c.certification_date, diver.c.experience_dives,
+            diver.c.phone, diver.c.emergency_contact, diver.c.medical_conditions,
+        ).where(diver.c.user_id == user_id).order_by(diver.c.id)
+
+    if kind == 'equipment':
+        equipment = tables['equipment']
+        return select(
+            _diver_name(diver).label('diver'), equipment.c.equipment_type, equipment.c.brand,
+            equipment.c.model, equipment.c.serial_number, equipment.c.purchase_date,
+            equipment.c.last_maintenance, equipment.c.next_maintenance, equipment.c.condition,
+        ).join(diver, diver.c.id == equipment.c.diver_id).where(
+            diver.c.user_id == user_id).order_by(equipment.c.id)
+
+    if kind == 'certifications':
+        certification = tables['certification']
+        return select(
+            _diver_name(diver).label('diver'), certification.c.cert_type, certification.c.agency,
+            certification.c.date_issued, certification.c.expiration_date, certification.c.cert_number,
+        ).join(diver, diver.c.id == certification.c.diver_id).where(
+            diver.c.user_id == user_id).order_by(certification.c.id)
+
+    if kind == 'dives':
+        dive, site, dive_diver = tables['dive'], tables['dive_site'], tables['dive_diver']
+        return select(
+            dive.c.dive_date, site.c.name.label('site'), dive.c.duration_minutes, dive.c.max_depth,
+            dive.c.air_used, dive.c.conditions, dive.c.notes,
+            func.group_concat(_diver_name(diver), '; ').label('divers'),
+        ).join(site, site.c.id == dive.c.site_id).join(
+            dive_diver, dive_diver.c.dive_id == dive.c.id).join(
+            diver, diver.c.id == dive_diver.c.diver_id).where(
+            dive.c.id.in_(select(dive_diver.c.dive_id).where(dive_diver.c.diver_id.in_(own_diver_ids)))
+        ).group_by(dive.c.id).order_by(dive.c.dive_date, dive.c.id)
+
+    raise ValueError(f"Unknown export kind {kind!r}; expected one of {', '.join(KINDS)}")
+
+
+def _json_default(value):
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    return str(value)
+
+
+def _excel_safe(value):
+    # Keep spreadsheet apps from evaluating user text as a formula.
+    if isinstance(value, str) and value[:1] in ('=', '+', '-', '@'):
+        return "'" + value
+    return value
+
+
+def iter_rows(conn, tables, kind, user_id):
+    result = conn.execute(build_query(tables, kind, user_id).execution_options(yield_per=YIELD_PER))
+    return result.keys(), (row for partition in result.partitions() for row in partition)
+
+
+def generate(conn, tables, kind, fmt, user_id):
+    """Yield the export as chunks of text, one chunk per batch of rows; conn may also be a Session."""
+    columns, rows = iter_rows(conn, tables, kind, user_id)
+    columns = list(columns)
+    buffer = io.StringIO()
+
+    if fmt == 'jsonl':
+        count = 0
+        for row in rows:
+            buffer.write(json.dumps(dict(zip(columns, row)), default=_json_default))
+            buffer.write('\n')
+            count += 1
+            if count % YIELD_PER == 0:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+        yield buffer.getvalue()
+        return
+
+    excel = fmt == 'excel'
+    writer = csv.writer(buffer, lineterminator='\r\n' if excel else '\n')
+    if excel:
+        buffer.write('\ufeff')
+    writer.writerow(columns)
+    count = 0
+    for row in rows:
+        writer.writerow([_excel_safe(value) for value in row] if excel else row)
+        count += 1
+        if count % YIELD_PER == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
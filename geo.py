@@ -0,0 +1,253 @@
+"""
+Spatial index and distance queries over dive site coordinates.
+
+Sites with a latitude and longitude are indexed in an SQLite R*Tree,
+`site_rtree`, one zero-size box per site keyed by the site id. Triggers on
+dive_site keep it in sync for every write path, as search.py does for the
+full-text index. A radius query turns the circle into the latitude/longitude
+boxes that enclose it (two when it crosses the antimeridian, a full band of
+longitudes when it reaches a pole), lets the R*Tree return the sites inside
+them, and ranks only those candidates by exact haversine distance.
+k-nearest queries search a growing radius until it holds k sites.
+
+A centre's own database file (TENANT_DATABASES) reaches dive_site and its
+index in the attached directory, so install() leaves such a file alone.
+
+Without the R*Tree module the same boxes are checked against the dive_site
+columns directly, which scans the table but gives the same answers.
+
+The gazetteer section matches sites without coordinates to places in a local
+gazetteer file (a CSV with name, latitude and longitude columns, or a GeoNames
+dump) by site name, then location, then each comma-separated part of the
+location.
+"""
+
+import csv
+import math
+import unicodedata
+from itertools import chain
+
+from sqlalchemy import bindparam, or_, select, text, update
+from sqlalchemy.exc import OperationalError
+
+EARTH_RADIUS_KM = 6371.0088
+# Where a k-nearest search starts; it quadruples until it holds k sites.
+NEAREST_START_KM = 25.0
+MAX_DISTANCE_KM = math.pi * EARTH_RADIUS_KM
+UPDATE_CHUNK_SIZE = 1000
+
+CREATE_TABLE = "CREATE VIRTUAL TABLE IF NOT EXISTS site_rtree USING rtree(id, min_lat, max_lat, min_lon, max_lon)"
+
+_INDEX_SITE = ("INSERT OR REPLACE INTO site_rtree (id, min_lat, max_lat, min_lon, max_lon) "
+               "SELECT NEW.id, NEW.latitude, NEW.latitude, NEW.longitude, NEW.longitude "
+               "WHERE NEW.latitude IS NOT NULL AND NEW.longitude IS NOT NULL;")
+
+
+def trigger_ddl():
+    return [
+        f"CREATE TRIGGER IF NOT EXISTS geo_dive_site_insert AFTER INSERT ON dive_site BEGIN {_INDEX_SITE} END",
+        "CREATE TRIGGER IF NOT EXISTS geo_dive_site_update AFTER UPDATE OF latitude, longitude ON dive_site BEGIN "
+        f"DELETE FROM site_rtree WHERE id = OLD.id; {_INDEX_SITE} END",
+        "CREATE TRIGGER IF NOT EXISTS geo_dive_site_delete AFTER DELETE ON dive_site BEGIN "
+        "DELETE FROM site_rtree WHERE id = OLD.id; END",
+    ]
+
+
+def drop_triggers(conn):
+    """Stop syncing the index, e.g. during a bulk load; install() and rebuild() restore it."""
+    names = conn.execute(text(
+        "SELECT name FROM sqlite_master WHERE type = 'trigger' AND name LIKE 'geo\\_%' ESCAPE '\\'")).scalars().all()
+    for name in names:
+        conn.execute(text(f'DROP TRIGGER "{name}"'))
+
+
+def install(conn):
+    """Create the R*Tree and triggers if missing and this database holds dive_site, backfilling a new index.
+    Returns True if created.
+    """
+    if conn.execute(text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'dive_site'")).first() is None:
+        return False
+    exists = conn.execute(text("SELECT 1 FROM sqlite_master WHERE name = 'site_rtree'")).first()
+    if exists is None:
+        try:
+            conn.execute(text(CREATE_TABLE))
+        except OperationalError:
+            # SQLite built without R*Tree; queries fall back to the dive_site columns.
+            return False
+    for statement in trigger_ddl():
+        conn.execute(text(statement))
+    if exists is None:
+        rebuild(conn)
+        return True
+    return False
+
+
+def rebuild(conn):
+    """Re-index every site with coordinates."""
+    conn.execute(text("DELETE FROM site_rtree"))
+    conn.execute(text(
+        "INSERT INTO site_rtree (id, min_lat, max_lat, min_lon, max_lon) "
+        "SELECT id, latitude, latitude, longitude, longitude FROM dive_site "
+        "WHERE latitude IS NOT NULL AND longitude IS NOT NULL"))
+
+
+def _indexed(conn):
+    schemas = [row.name for row in conn.execute(text('PRAGMA database_list'))]
+    return any(conn.execute(text(f'SELECT 1 FROM "{schema}".sqlite_master WHERE name = \'site_rtree\'')).first()
+               for schema in schemas)
+
+
+# ============ Distance queries ============
+
+def check_point(latitude, longitude):
+    if not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+        raise ValueError(f'({latitude}, {longitude}) is not a valid latitude and longitude')
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    a = math.sin((phi2 - phi1) / 2) ** 2 + \
+        math.cos(phi1) * math.cos(phi2) * math.sin(math.radians(lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+def bounding_boxes(latitude, longitude, radius_km):
+    """[(south, north, west, east)] boxes that together enclose every point within radius_km."""
+    angle = radius_km / EARTH_RADIUS_KM
+    south = max(-90.0, latitude - math.degrees(angle))
+    north = min(90.0, latitude + math.degrees(angle))
+    if south == -90 or north == 90 or angle >= math.pi / 2 or \
+            math.sin(angle) >= math.cos(math.radians(latitude)):
+        return [(south, north, -180.0, 180.0)]
+    # The widest longitude a point on the circle reaches, at the circle's tangent meridians.
+    half_width = math.degrees(math.asin(math.sin(angle) / math.cos(math.radians(latitude))))
+    west, east = longitude - half_width, longitude + half_width
+    if west < -180:
+        return [(south, north, west + 360, 180.0), (south, north, -180.0, east)]
+    if east > 180:
+        return [(south, north, west, 180.0), (south, north, -180.0, east - 360)]
+    return [(south, north, west, east)]
+
+
+def _candidates(conn, box, centre_id):
+    south, north, west, east = box
+    if _indexed(conn):
+        sql = ("SELECT dive_site.id, dive_site.latitude, dive_site.longitude FROM site_rtree "
+               "JOIN dive_site ON dive_site.id = site_rtree.id "
+               "WHERE site_rtree.max_lat >= :south AND site_rtree.min_lat <= :north "
+               "AND site_rtree.max_lon >= :west AND site_rtree.min_lon <= :east")
+    else:
+        sql = ("SELECT id, latitude, longitude FROM dive_site "
+               "WHERE latitude BETWEEN :south AND :north AND longitude BETWEEN :west AND :east")
+    params = {'south': south, 'north': north, 'west': west, 'east': east}
+    if centre_id is not None:
+        # Same visibility as the ORM scoping in tenants.py: the centre's own sites and shared ones.
+        sql += " AND (dive_site.centre_id = :centre_id OR dive_site.centre_id IS NULL)"
+        params['centre_id'] = centre_id
+    return conn.execute(text(sql), params).all()
+
+
+def within(conn, latitude, longitude, radius_km, limit=None, centre_id=None):
+    """[(site id, distance in km)] for sites within radius_km, nearest first."""
+    check_point(latitude, longitude)
+    found = {}
+    for box in bounding_boxes(latitude, longitude, radius_km):
+        for site_id, site_lat, site_lon in _candidates(conn, box, centre_id):
+            distance = haversine_km(latitude, longitude, site_lat, site_lon)
+            if distance <= radius_km:
+                found[site_id] = distance
+    ranked = sorted(found.items(), key=lambda item: (item[1], item[0]))
+    return ranked if limit is None else ranked[:limit]
+
+
+def nearest(conn, latitude, longitude, k, max_km=None, centre_id=None):
+    """[(site id, distance in km)] for the k sites nearest the point, optionally no further than max_km."""
+    limit_km = min(max_km or MAX_DISTANCE_KM, MAX_DISTANCE_KM)
+    radius_km = min(NEAREST_START_KM, limit_km)
+    while True:
+        ranked = within(conn, latitude, longitude, radius_km, centre_id=centre_id)
+        # Every site within radius_km is in `ranked`, so once it holds k of them they are the k nearest.
+        if len(ranked) >= k or radius_km >= limit_km:
+            return ranked[:k]
+        radius_km = min(radius_km * 4, limit_km)
+
+
+# ============ Gazetteer backfill ============
+
+# GeoNames dump columns (https://download.geonames.org/export/dump/readme.txt).
+GEONAMES_COLUMNS = 19
+GEONAMES_NAME, GEONAMES_ASCII_NAME, GEONAMES_LATITUDE, GEONAMES_LONGITUDE, GEONAMES_POPULATION = 1, 2, 4, 5, 14
+
+
+def normalize(name):
+    """Case-, accent- and whitespace-insensitive key for place names."""
+    decomposed = unicodedata.normalize('NFKD', name or '')
+    return ' '.join(''.join(ch for ch in decomposed if not unicodedata.combining(ch)).casefold().split())
+
+
+def _geonames(lines):
+    best = {}
+    for line in lines:
+        fields = line.rstrip('\n').split('\t')
+        if len(fields) < GEONAMES_COLUMNS:
+            continue
+        point = (float(fields[GEONAMES_LATITUDE]), float(fields[GEONAMES_LONGITUDE]))
+        population = int(fields[GEONAMES_POPULATION] or 0)
+        for name in (fields[GEONAMES_NAME], fields[GEONAMES_ASCII_NAME]):
+            key = normalize(name)
+            # Several places share a name; the most populous is the likeliest meaning.
+            if key and (key not in best or population > best[key][0]):
+                best[key] = (population, point)
+    return {key: point for key, (_, point) in best.items()}
+
+
+def _csv(lines):
+    reader = csv.DictReader(lines)
+    columns = {normalize(column): column for column in reader.fieldnames or ()}
+    try:
+        name, lat, lon = (next(columns[key] for key in keys if key in columns) for keys in (
+            ('name',), ('latitude', 'lat'), ('longitude', 'lon', 'lng')))
+    except StopIteration:
+        raise ValueError('A gazetteer CSV needs name, latitude and longitude columns') from None
+    places = {}
+    for row in reader:
+        key = normalize(row[name])
+        if key and key not in places and row[lat] and row[lon]:
+            places[key] = (float(row[lat]), float(row[lon]))
+    return places
+
+
+def load_gazetteer(stream):
+    """{normalized place name: (latitude, longitude)} from a CSV or GeoNames tab-separated file."""
+    first = stream.readline()
+    lines = chain([first], stream)
+    return _geonames(lines) if first.count('\t') >= GEONAMES_COLUMNS - 1 else _csv(lines)
+
+
+def match(gazetteer, name, location):
+    """(latitude, longitude) for a site from its name, then its location and the location's parts, or None."""
+    keys = [name, location, *(location or '').split(',')]
+    for key in map(normalize, keys):
+        if key in gazetteer:
+            return gazetteer[key]
+    return None
+
+
+def backfill(conn, tables, gazetteer, overwrite=False):
+    """Set coordinates on sites that have none (every site if `overwrite`). Returns (updated, unmatched names)."""
+    site = tables['dive_site']
+    query = select(site.c.id, site.c.name, site.c.location)
+    if not overwrite:
+        query = query.where(or_(site.c.latitude.is_(None), site.c.longitude.is_(None)))
+    updates, unmatched = [], []
+    for row in conn.execute(query.order_by(site.c.id)):
+        point = match(gazetteer, row.name, row.location)
+        if point is None:
+            unmatched.append(row.name)
+        else:
+            updates.append({'site_id': row.id, 'lat': point[0], 'lon': point[1]})
+    statement = update(site).where(site.c.id == bindparam('site_id')).values(
+        latitude=bindparam('lat'), longitude=bindparam('lon'))
+    for start in range(0, len(updates), UPDATE_CHUNK_SIZE):
+        conn.execute(statement, updates[start:start + UPDATE_CHUNK_SIZE])
+    return len(updates), unmatched
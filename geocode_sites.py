@@ -0,0 +1,54 @@
+#!/usr/bin/env python
+"""
+Fill in dive site coordinates from a local gazetteer file.
+
+The gazetteer is a CSV with name, latitude and longitude columns, or a GeoNames
+dump (e.g. cities15000.txt or a country file). Each site is matched by its
+name, then its location, then each comma-separated part of the location, so a
+site in "Blue Corner, Palau" falls back to the coordinates of Palau. Sites that
+already have coordinates are left alone unless --overwrite is given.
+
+Usage:
+    python geocode_sites.py places.csv
+    python geocode_sites.py cities15000.txt --overwrite --dry-run
+"""
+
+import argparse
+import sys
+
+from app import app, db
+import geo
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Backfill dive site coordinates from a gazetteer')
+    parser.add_argument('path', help='gazetteer CSV (name, latitude, longitude) or GeoNames dump')
+    parser.add_argument('--overwrite', action='store_true', help='also replace coordinates sites already have')
+    parser.add_argument('--dry-run', action='store_true', help='report matches without saving them')
+    args = parser.parse_args()
+
+    with open(args.path, encoding='utf-8-sig', newline='') as stream:
+        try:
+            gazetteer = geo.load_gazetteer(stream)
+        except ValueError as e:
+            print(e)
+            return 1
+    print(f"Loaded {len(gazetteer)} place names")
+
+    # Every site lives in the main database, centre files included (see tenants.py).
+    with app.app_context(), db.engine.connect() as conn:
+        updated, unmatched = geo.backfill(conn, db.metadata.tables, gazetteer, overwrite=args.overwrite)
+        if args.dry_run:
+            conn.rollback()
+        else:
+            conn.commit()
+
+    for name in unmatched:
+        print(f"  no match: {name}")
+    verb = 'Would set' if args.dry_run else 'Set'
+    print(f"✓ {verb} coordinates on {updated} sites ({len(unmatched)} unmatched)")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
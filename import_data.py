@@ -0,0 +1,47 @@
+#!/usr/bin/env python
+"""
+Bulk import divers, dives, equipment or certifications from a file.
+
+Usage:
+    python import_data.py dives logbook.csv --user admin
+    python import_data.py divers partner_shop.jsonl --user peter --chunk-size 5000
+"""
+
+import argparse
+import sys
+
+from app import app, db, User
+import importer
+import tenants
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Bulk import data for a user')
+    parser.add_argument('kind', choices=importer.KINDS)
+    parser.add_argument('path', help='CSV, JSON Lines (.jsonl) or JSON array (.json) file')
+    parser.add_argument('--user', required=True, help='username that will own the imported data')
+    parser.add_argument('--format', choices=importer.FORMATS, help='file format (default: from the extension)')
+    parser.add_argument('--chunk-size', type=int, default=importer.DEFAULT_CHUNK_SIZE)
+    args = parser.parse_args()
+
+    with app.app_context():
+        user = User.query.filter_by(username=args.user).first()
+        if user is None:
+            print(f"User '{args.user}' not found")
+            return 1
+
+        fmt = args.format or importer.detect_format(args.path)
+        # Into the user's centre, and with TENANT_DATABASES its own file, as the web import does
+        with tenants.use(user.centre_id), open(args.path, encoding='utf-8-sig', newline='') as stream:
+            report = importer.import_stream(db, args.kind, stream, user.id, fmt, args.chunk_size)
+
+    for row, message in report.errors:
+        print(f"  row {row}: {message}")
+    if report.failed > len(report.errors):
+        print(f"  ... {report.failed - len(report.errors)} more errors not shown")
+    print(f"✓ Imported {report.imported} of {report.rows} {args.kind} rows ({report.failed} failed)")
+    return 1 if report.failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,440 @@
+"""
+Streaming bulk import of divers, dives, equipment and certifications.
+
+Rows are read lazily from CSV, JSON Lines or JSON array files, validated,
+and written in chunks: each chunk is one transaction with executemany
+INSERTs. Dive sites and divers are resolved through in-memory lookup maps
+built once per import, so memory stays flat however large the file is.
+A chunk rejected by the database is retried row by row so that only the
+offending rows are reported.
+"""
+
+import csv
+import io
+import json
+from datetime import date, datetime
+
+from sqlalchemy import or_, select, true
+from sqlalchemy.exc import IntegrityError
+
+import stats
+
+DEFAULT_CHUNK_SIZE = 1000
+MAX_REPORTED_ERRORS = 1000
+KINDS = ('divers', 'dives', 'equipment', 'certifications')
+FORMATS = ('csv', 'jsonl', 'json')
+# Characters buffered for one object of a JSON array before it is reported as malformed rather than incomplete
+MAX_JSON_OBJECT = 1024 * 1024
+
+
+class RowError(ValueError):
+    pass
+
+
+# ============ Parsing ============
+
+def iter_csv(stream):
+    yield from csv.DictReader(stream)
+
+
+def iter_jsonl(stream):
+    for line in stream:
+        line = line.strip()
+        if line:
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError as e:
+                # Reported against this row; the rest of the file still imports.
+                yield RowError(f'invalid JSON: {e.msg}')
+
+
+def iter_json_array(stream, read_size=64 * 1024):
+    """Yield the objects of a top-level JSON array without loading the whole document."""
+    decoder = json.JSONDecoder()
+    buffer = ''
+    started = False
+    while True:
+        chunk = stream.read(read_size)
+        buffer += chunk
+        pos = 0
+        while True:
+            while pos < len(buffer) and buffer[pos] in ' \t\r\n,':
+                pos += 1
+            if not started and pos < len(buffer):
+                if buffer[pos] != '[':
+                    raise RowError('JSON import must be an array of objects')
+                started = True
+                pos += 1
+                continue
+            if pos < len(buffer) and buffer[pos] == ']':
+                return
+            try:
+                obj, end = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError as e:
+                if len(buffer) - pos > MAX_JSON_OBJECT:
+                    raise RowError(f'invalid JSON: {e.msg}') from None
+                break
+            yield obj
+            pos = end
+        buffer = buffer[pos:]
+        if not chunk:
+            if buffer.strip():
+                raise RowError('Truncated JSON array')
+            return
+
+
+def iter_records(stream, fmt):
+    if fmt == 'csv':
+        return iter_csv(stream)
+    if fmt == 'jsonl':
+        return iter_jsonl(stream)
+    if fmt == 'json':
+        return iter_json_array(stream)
+    raise ValueError(f"Unknown format {fmt!r}; expected one of {', '.join(FORMATS)}")
+
+
+def detect_format(filename):
+    name = (filename or '').lower()
+    if name.endswith(('.jsonl', '.ndjson')):
+        return 'jsonl'
+    if name.endswith('.json'):
+        return 'json'
+    return 'csv'
+
+
+def open_text(binary_stream):
+    return io.TextIOWrapper(binary_stream, encoding='utf-8-sig', newline='')
+
+
+# ============ Field conversion ============
+
+def _text(value):
+    return str(value).strip()
+
+
+def _int(value):
+    return int(str(value).strip())
+
+
+def _float(value):
+    return float(str(value).strip())
+
+
+def _latitude(value):
+    value = _float(value)
+    if not -90 <= value <= 90:
+        raise ValueError(value)
+    return value
+
+
+def _longitude(value):
+    value = _float(value)
+    if not -180 <= value <= 180:
+        raise ValueError(value)
+    return value
+
+
+def _date(value):
+    return date.fromisoformat(str(value).strip()[:10])
+
+
+def _datetime(value):
+    return datetime.fromisoformat(str(value).strip())
+
+
+DIVER_FIELDS = {
+    'first_name': (_text, True),
+    'last_name': (_text, True),
+    'certification_level': (_text, False),
+    'certification_number': (_text, False),
+    'certification_date': (_date, False),
+    'phone': (_text, False),
+    'emergency_contact': (_text, False),
+    'medical_conditions': (_text, False),
+}
+
+DIVE_FIELDS = {
+    'dive_date': (_datetime, True),
+    'duration_minutes': (_int, False),
+    'max_depth': (_float, False),
+    'air_used': (_float, False),
+    'conditions': (_text, False),
+    'notes': (_text, False),
+}
+
+EQUIPMENT_FIELDS = {
+    'equipment_type': (_text, True),
+    'brand': (_text, False),
+    'model': (_text, False),
+    'serial_number': (_text, False),
+    'purchase_date': (_date, False),
+    'last_maintenance': (_date, False),
+    'next_maintenance': (_date, False),
+    'condition': (_text, False),
+}
+
+CERTIFICATION_FIELDS = {
+    'cert_type': (_text, True),
+    'agency': (_text, False),
+    'date_issued': (_date, True),
+    'expiration_date': (_date, False),
+    'cert_number': (_text, False),
+}
+
+SITE_FIELDS = {
+    'name': (_text, True),
+    'location': (_text, True),
+    'depth_min': (_float, False),
+    'depth_max': (_float, False),
+    'description': (_text, False),
+    'difficulty_level': (_text, False),
+    'water_temperature': (_float, False),
+    'visibility': (_text, False),
+    'latitude': (_latitude, False),
+    'longitude': (_longitude, False),
+}
+
+
+def convert_fields(record, fields):
+    values = {}
+    for name, (convert, required) in fields.items():
+        raw = record.get(name)
+        if raw is None or (isinstance(raw, str) and not raw.strip()):
+            if required:
+                raise RowError(f'missing required field {name!r}')
+            continue
+        try:
+            values[name] = convert(raw)
+        except (TypeError, ValueError):
+            raise RowError(f'invalid value for {name!r}: {raw!r}') from None
+    return values
+
+
+# ============ Reference lookups ============
+
+AMBIGUOUS = object()
+
+
+def _add_key(mapping, key, value):
+    if key:
+        mapping[key] = AMBIGUOUS if key in mapping and mapping[key] != value else value
+
+
+class Lookups:
+    """In-memory maps from the references used in import files to database ids."""
+
+    def __init__(self, conn, tables, user_id):
+        self.user_id = user_id
+        self.sites = {}
+        self.site_ids = set()
+        site, user = tables['dive_site'], tables['user']
+        # The sites the user's centre can see, as in tenants.py: its own and shared ones (every site without one).
+        centre_id = conn.execute(select(user.c.centre_id).where(user.c.id == user_id)).scalar()
+        visible = true() if centre_id is None else or_(site.c.centre_id == centre_id, site.c.centre_id.is_(None))
+        for site_id, name in conn.execute(select(site.c.id, site.c.name).where(visible)):
+            self.site_ids.add(site_id)
+            self.sites[name.strip().lower()] = site_id
+
+        self.divers = {}
+        self.diver_ids = set()
+        diver = tables['diver']
+        rows = conn.execute(select(diver.c.id, diver.c.first_name, diver.c.last_name, diver.c.certification_number)
+                            .where(diver.c.user_id == user_id))
+        for row in rows:
+            self.add_diver(row.id, row.first_name, row.last_name, row.certification_number)
+
+    def add_diver(self, diver_id, first_name, last_name, certification_number):
+        self.diver_ids.add(diver_id)
+        _add_key(self.divers, f'{first_name} {last_name}'.strip().lower(), diver_id)
+        if certification_number:
+            _add_key(self.divers, certification_number.strip().lower(), diver_id)
+
+    def site(self, record):
+        if record.get('site_id') not in (None, ''):
+            try:
+                site_id = _int(record['site_id'])
+            except ValueError:
+                raise RowError(f"invalid site_id {record['site_id']!r}") from None
+            if site_id not in self.site_ids:
+                raise RowError(f'unknown dive site id {site_id}')
+            return site_id
+        name = record.get('site')
+        if not name:
+            raise RowError("missing required field 'site'")
+        site_id = self.sites.get(str(name).strip().lower())
+        if site_id is None:
+            raise RowError(f'unknown dive site {name!r}')
+        return site_id
+
+    def diver(self, reference):
+        diver_id = self.divers.get(str(reference).strip().lower())
+        if diver_id is None:
+            raise RowError(f'unknown diver {reference!r}')
+        if diver_id is AMBIGUOUS:
+            raise RowError(f'ambiguous diver reference {reference!r}; use the certification number')
+        return diver_id
+
+    def diver_from_record(self, record):
+        if record.get('diver_id') not in (None, ''):
+            try:
+                diver_id = _int(record['diver_id'])
+            except ValueError:
+                raise RowError(f"invalid diver_id {record['diver_id']!r}") from None
+            if diver_id not in self.diver_ids:
+                raise RowError(f'unknown diver id {diver_id}')
+            return diver_id
+        reference = record.get('diver')
+        if not reference:
+            raise RowError("missing required field 'diver'")
+        return self.diver(reference)
+
+    def divers_from_list(self, value):
+        if value in (None, ''):
+            return []
+        references = value if isinstance(value, list) else str(value).split(';')
+        diver_ids = []
+        for reference in references:
+            if str(reference).strip():
+                diver_id = self.diver(reference)
+                if diver_id not in diver_ids:
+                    diver_ids.append(diver_id)
+        return diver_ids
+
+
+# ============ Import ============
+
+class ImportReport:
+    def __init__(self, kind):
+        self.kind = kind
+        self.rows = 0
+        self.imported = 0
+        self.failed = 0
+        self.errors = []
+
+    def error(self, row_number, message):
+        self.failed += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append((row_number, message))
+
+    def to_dict(self):
+        return {
+            'kind': self.kind,
+            'rows': self.rows,
+            'imported': self.imported,
+            'failed': self.failed,
+            'errors': [{'row': row, 'error': message} for row, message in self.errors],
+            'errors_truncated': self.failed > len(self.errors),
+        }
+
+
+def prepare_row(kind, record, lookups):
+    """Validate one record and return (table row, diver ids for dive_diver)."""
+    if isinstance(record, RowError):
+        raise record
+    if not isinstance(record, dict):
+        raise RowError('row is not an object')
+    if kind == 'divers':
+        row = convert_fields(record, DIVER_FIELDS)
+        row['user_id'] = lookups.user_id
+        return row, None
+    if kind == 'dives':
+        row = convert_fields(record, DIVE_FIELDS)
+        row['site_id'] = lookups.site(record)
+        return row, lookups.divers_from_list(record.get('divers'))
+    if kind == 'equipment':
+        row = convert_fields(record, EQUIPMENT_FIELDS)
+        row.setdefault('condition', 'Good')
+        row['diver_id'] = lookups.diver_from_record(record)
+        return row, None
+    row = convert_fields(record, CERTIFICATION_FIELDS)
+    row['diver_id'] = lookups.diver_from_record(record)
+    return row, None
+
+
+TABLE_FOR_KIND = {
+    'divers': 'diver',
+    'dives': 'dive',
+    'equipment': 'equipment',
+    'certifications': 'certification',
+}
+
+
+def _write_chunk(conn, tables, kind, chunk, lookups):
+    table = tables[TABLE_FOR_KIND[kind]]
+    # executemany needs every row to bind the same columns; blank optional fields are NULL
+    columns = set().union(*(row for _, row, _ in chunk))
+    rows = [dict(dict.fromkeys(columns), **row) for _, row, _ in chunk]
+    if kind == 'divers':
+        ids = conn.execute(table.insert().returning(table.c.id, sort_by_parameter_order=True), rows).scalars().all()
+        for diver_id, row in zip(ids, rows):
+            lookups.add_diver(diver_id, row['first_name'], row['last_name'], row.get('certification_number'))
+    elif kind == 'dives':
+        ids = conn.execute(table.insert().returning(table.c.id, sort_by_parameter_order=True), rows).scalars().all()
+        links = [{'dive_id': dive_id, 'diver_id': diver_id}
+                 for dive_id, (_, _, diver_ids) in zip(ids, chunk) for diver_id in diver_ids]
+        if links:
+            conn.execute(tables['dive_diver'].insert(), links)
+        stats.add_dives(conn, tables, ids)
+    else:
+        conn.execute(table.insert(), rows)
+
+
+def _flush(engine, tables, kind, chunk, lookups, report):
+    if not chunk:
+        return
+    try:
+        with engine.begin() as conn:
+            _write_chunk(conn, tables, kind, chunk, lookups)
+        report.imported += len(chunk)
+        return
+    except IntegrityError:
+        pass
+    # Find the offending rows: retry one row per transaction.
+    for item in chunk:
+        try:
+            with engine.begin() as conn:
+                _write_chunk(conn, tables, kind, [item], lookups)
+            report.imported += 1
+        except IntegrityError as e:
+            report.error(item[0], f'rejected by database: {e.orig}')
+
+
+def import_records(db, kind, records, user_id, chunk_size=DEFAULT_CHUNK_SIZE, on_chunk=None):
+    """Import an iterable of dict records of the given kind for user_id. Returns an ImportReport.
+
+    on_chunk(report), if given, is called after each chunk is written; an exception it raises stops the
+    import with the chunks written so far kept.
+    """
+    if kind not in KINDS:
+        raise ValueError(f"Unknown import kind {kind!r}; expected one of {', '.join(KINDS)}")
+    engine = db.session.get_bind()  # the active centre's database (see tenants.py)
+    tables = db.metadata.tables
+    report = ImportReport(kind)
+    with engine.connect() as conn:
+        lookups = Lookups(conn, tables, user_id)
+
+    chunk = []
+    # Row numbers are 1-based data rows (a CSV header is not counted).
+    try:
+        for row_number, record in enumerate(records, start=1):
+            report.rows += 1
+            try:
+                row, diver_ids = prepare_row(kind, record, lookups)
+            except RowError as e:
+                report.error(row_number, str(e))
+                continue
+            chunk.append((row_number, row, diver_ids or []))
+            if len(chunk) >= chunk_size:
+                _flush(engine, tables, kind, chunk, lookups, report)
+                chunk = []
+                if on_chunk is not None:
+                    on_chunk(report)
+    except (RowError, ValueError, csv.Error) as e:
+        report.error(report.rows + 1, f'could not parse file: {e}')
+    _flush(engine, tables, kind, chunk, lookups, report)
+    return report
+
+
+def import_stream(db, kind, stream, user_id, fmt='csv', chunk_size=DEFAULT_CHUNK_SIZE, on_chunk=None):
+    """Import a text stream in the given format."""
+    return import_records(db, kind, iter_records(stream, fmt), user_id, chunk_size, on_chunk)
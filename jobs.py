@@ -0,0 +1,265 @@
+"""
+Background jobs.
+
+Imports, exports, statistics rebuilds and password resets run on a small
+pool of worker threads instead of in the request thread. Jobs are rows in the
+`job` table, so queued work survives a restart and any process sharing the
+database can enqueue it; the server's workers claim the next job with one
+atomic UPDATE ... RETURNING, lowest priority number first.
+
+Concurrency is bounded twice: by the number of workers and per kind (one
+import at a time, since SQLite has a single writer). Handlers report
+progress through JobContext.progress(), which persists it at most every
+PROGRESS_INTERVAL seconds, raises Cancelled once an admin has asked for the
+job to stop, and sleeps briefly so request threads get the GIL between
+chunks; that keeps dashboard and login latency flat while an import runs.
+
+A job still marked running at startup was interrupted: it is queued again if
+its kind is restartable and marked failed otherwise. A kind registered with
+discard() gets it called with the params of every job that ends without its
+handler having run to the end that way, or by being cancelled while queued,
+so an import's uploaded file never outlives its job. Secrets (a new
+password) are passed to the handler in memory only and never stored.
+"""
+
+import json
+import logging
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+
+from sqlalchemy import func, select, update
+
+DEFAULT_PRIORITY = 5  # lower numbers run first
+FINISHED = ('done', 'failed', 'cancelled')
+PROGRESS_INTERVAL = 0.5
+
+logger = logging.getLogger(__name__)
+
+
+class Cancelled(Exception):
+    """Raised inside a handler when its job has been cancelled."""
+
+
+class JobKind:
+    def __init__(self, handler, priority, concurrency, restartable, discard):
+        self.handler = handler
+        self.priority = priority
+        self.concurrency = concurrency
+        self.restartable = restartable
+        self.discard = discard
+
+
+class JobContext:
+    """What a handler gets: its params, the in-memory secret, and progress()."""
+
+    def __init__(self, queue, job_id, params, secret):
+        self.queue = queue
+        self.id = job_id
+        self.params = params
+        self.secret = secret
+        self._saved_at = 0.0
+
+    def progress(self, done, total=None, message=None, force=False):
+        """Record progress; raises Cancelled if the job has been cancelled."""
+        now = time.monotonic()
+        if force or now - self._saved_at >= PROGRESS_INTERVAL:
+            self._saved_at = now
+            job = self.queue.table
+            values = {'progress': done}
+            if total is not None:
+                values['total'] = total
+            if message is not None:
+                values['message'] = message[:255]
+            with self.queue.engine.begin() as conn:
+                cancel = conn.execute(update(job).where(job.c.id == self.id).values(**values)
+                                      .returning(job.c.cancel_requested)).scalar()
+            if cancel:
+                raise Cancelled()
+        if self.queue.yield_seconds:
+            time.sleep(self.queue.yield_seconds)
+
+
+class JobQueue:
+    def __init__(self, app, db, workers=2, poll_interval=5, yield_seconds=0.002):
+        self.app = app
+        self.db = db
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.yield_seconds = yield_seconds
+        self.kinds = {}
+        self._secrets = {}
+        self._running = Counter()
+        self._wake = threading.Condition()
+        self._stop = threading.Event()
+        self._threads = []
+
+    @property
+    def table(self):
+        return self.db.metadata.tables['job']
+
+    @property
+    def engine(self):
+        # Workers run outside any app context; the engine itself is fixed per app.
+        with self.app.app_context():
+            return self.db.engine
+
+    def register(self, kind, handler, priority=DEFAULT_PRIORITY, concurrency=None, restartable=False, discard=None):
+        """handler(ctx) runs inside an app context and returns a JSON-serialisable result.
+
+        discard(params) cleans up after a job its handler will never finish (see the module docstring).
+        """
+        self.kinds[kind] = JobKind(handler, priority, concurrency, restartable, discard)
+
+    def enqueue(self, kind, params=None, user_id=None, priority=None, secret=None):
+        """Queue a job and wake a worker. Returns the job id."""
+        if kind not in self.kinds:
+            raise ValueError(f"Unknown job kind {kind!r}; expected one of {', '.join(self.kinds)}")
+        job = self.table
+        with self.engine.begin() as conn:
+            job_id = conn.execute(job.insert().returning(job.c.id), {
+                'kind': kind, 'status': 'queued', 'user_id': user_id,
+                'priority': self.kinds[kind].priority if priority is None else priority,
+                'params': json.dumps(params or {}), 'progress': 0, 'cancel_requested': False,
+                'created_at': datetime.utcnow(),
+            }).scalar()
+        if secret is not None:
+            self._secrets[job_id] = secret
+        with self._wake:
+            self._wake.notify()
+        return job_id
+
+    def cancel(self, job_id):
+        """Cancel a queued job at once or ask a running one to stop. Returns False if it had already finished."""
+        job = self.table
+        with self.engine.begin() as conn:
+            dropped = conn.execute(update(job).where(job.c.id == job_id, job.c.status == 'queued').values(
+                status='cancelled', finished_at=datetime.utcnow()).returning(job.c.kind, job.c.params)).first()
+            cancelled = dropped is not None or conn.execute(
+                update(job).where(job.c.id == job_id, job.c.status == 'running').values(cancel_requested=True)).rowcount
+        if dropped is not None:
+            self._discard(dropped.kind, dropped.params)
+        if cancelled:
+            self._secrets.pop(job_id, None)
+        return bool(cancelled)
+
+    def get(self, job_id):
+        with self.engine.connect() as conn:
+            row = conn.execute(select(self.table).where(self.table.c.id == job_id)).mappings().first()
+        return _as_dict(row) if row else None
+
+    def recent(self, limit=50, user_ids=None):
+        """The newest `limit` jobs, newest first; only those queued by `user_ids` if given."""
+        job = self.table
+        query = select(job).order_by(job.c.id.desc()).limit(limit)
+        if user_ids is not None:
+            query = query.where(job.c.user_id.in_(list(user_ids)))
+        with self.engine.connect() as conn:
+            rows = conn.execute(query).mappings().all()
+        return [_as_dict(row) for row in rows]
+
+    def counts(self):
+        job = self.table
+        with self.engine.connect() as conn:
+            return dict(conn.execute(select(job.c.status, func.count()).where(
+                job.c.status.in_(('queued', 'running'))).group_by(job.c.status)).all())
+
+    # ============ Workers ============
+
+    def start(self):
+        """Recover interrupted jobs and start the workers."""
+        job = self.table
+        abandoned = []
+        with self.engine.begin() as conn:
+            interrupted = conn.execute(select(job.c.id, job.c.kind, job.c.params).where(job.c.status == 'running')).all()
+            for job_id, kind, params in interrupted:
+                spec = self.kinds.get(kind)
+                if spec is not None and spec.restartable:
+                    values = {'status': 'queued', 'started_at': None, 'progress': 0}
+                else:
+                    values = {'status': 'failed', 'error': 'interrupted by a restart', 'finished_at': datetime.utcnow()}
+                    abandoned.append((kind, params))
+                conn.execute(update(job).where(job.c.id == job_id).values(**values))
+        for kind, params in abandoned:
+            self._discard(kind, params)
+        for number in range(self.workers):
+            thread = threading.Thread(target=self._work, name=f'job-worker-{number}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def _discard(self, kind, params):
+        spec = self.kinds.get(kind)
+        if spec is None or spec.discard is None:
+            return
+        try:
+            with self.app.app_context():
+                spec.discard(json.loads(params or '{}'))
+        except Exception:
+            logger.exception('Could not clean up after a %s job', kind)
+
+    def stop(self):
+        """Stop claiming jobs; running handlers finish on their own."""
+        self._stop.set()
+        with self._wake:
+            self._wake.notify_all()
+
+    def _claim(self):
+        job = self.table
+        with self._wake:
+            saturated = [kind for kind, spec in self.kinds.items()
+                         if spec.concurrency is not None and self._running[kind] >= spec.concurrency]
+            next_id = select(job.c.id).where(job.c.status == 'queued', job.c.kind.in_(list(self.kinds)),
+                                             job.c.kind.not_in(saturated)) \
+                .order_by(job.c.priority, job.c.id).limit(1).scalar_subquery()
+            with self.engine.begin() as conn:
+                row = conn.execute(update(job).where(job.c.id == next_id, job.c.status == 'queued')
+                                   .values(status='running', started_at=datetime.utcnow())
+                                   .returning(job.c.id, job.c.kind, job.c.params)).first()
+            if row is not None:
+                self._running[row.kind] += 1
+            return row
+
+    def _work(self):
+        while not self._stop.is_set():
+            try:
+                row = self._claim()
+            except Exception:
+                logger.exception('Could not claim a job')
+                row = None
+            if row is None:
+                with self._wake:
+                    self._wake.wait(self.poll_interval)
+                continue
+            try:
+                self._run(row.id, row.kind, json.loads(row.params or '{}'))
+            finally:
+                with self._wake:
+                    self._running[row.kind] -= 1
+                    self._wake.notify_all()
+
+    def _run(self, job_id, kind, params):
+        ctx = JobContext(self, job_id, params, self._secrets.pop(job_id, None))
+        values = {}
+        try:
+            with self.app.app_context():
+                result = self.kinds[kind].handler(ctx)
+            values.update(status='done', result=json.dumps(result, default=str))
+        except Cancelled:
+            values.update(status='cancelled')
+        except Exception as e:
+            logger.exception('Job %d (%s) failed', job_id, kind)
+            values.update(status='failed', error=str(e)[:2000])
+        values['finished_at'] = datetime.utcnow()
+        job = self.table
+        with self.engine.begin() as conn:
+            conn.execute(update(job).where(job.c.id == job_id).values(**values))
+
+
+def _as_dict(row):
+    job = dict(row)
+    job['params'] = json.loads(job['params'] or '{}')
+    job['result'] = json.loads(job['result']) if job['result'] else None
+    job['percent'] = min(100, round(100 * job['progress'] / job['total'])) if job['total'] else None
+    job['finished'] = job['status'] in FINISHED
+    return job
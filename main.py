@@ -7,7 +7,6 @@ Launches the Flask web app and opens it in the default browser.
 import sys
 import os
 import threading
-import time
 import webbrowser
 from pathlib import Path
 
@@ -15,29 +14,30 @@ from pathlib import Path
 current_dir = os.path.dirname(os.path.abspath(__file__))
 sys.path.insert(0, current_dir)
 
-def open_browser():
-    """Open the web app in browser after a short delay"""
-    time.sleep(2)  # Wait for Flask to start
-    webbrowser.open('http://127.0.0.1:5001')
-
 def main():
     """Main entry point for the desktop application"""
     try:
-        # Import the Flask app
-        from app import app, db
+        import server
+        import startup
+
+        # Listen before loading Flask and SQLAlchemy: the browser starts in
+        # parallel and its request waits in the socket backlog until we serve.
+        settings = server.settings()
+        sock = server.listen(settings['SERVER_HOST'], settings['SERVER_PORT'])
+        url = f"http://127.0.0.1:{settings['SERVER_PORT']}"
+        print("Starting Diving Admin...")
+        print(f"Opening browser at {url}")
+        threading.Thread(target=webbrowser.open, args=(url,), daemon=True).start()
+        startup.mark('listen')
 
-        # Create database tables
-        with app.app_context():
-            db.create_all()
+        # Import the Flask app
+        from app import app, db, invalidate_stats, job_queue
+        startup.mark('imports')
 
-        # Start browser in a separate thread
-        browser_thread = threading.Thread(target=open_browser, daemon=True)
-        browser_thread.start()
+        # Create or upgrade database tables and indexes, and keep alerts current
+        server.start_background_jobs(app, db, on_refresh=invalidate_stats, job_queue=job_queue)
 
-        # Run the Flask app
-        print("Starting Diving Admin...")
-        print("Opening browser at http://127.0.0.1:5001")
-        app.run(host='127.0.0.1', port=5001, debug=False)
+        server.serve(app, mode='production', sock=sock)
 
     except Exception as e:
         print(f"Error starting application: {e}")
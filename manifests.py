@@ -0,0 +1,148 @@
+"""
+Boat trip manifests and the eligibility checks run before a boat leaves.
+
+A trip is a planned dive at one site on one day with a roster of divers
+(trip and trip_diver). check() decides for a whole roster at once whether
+each diver may go:
+
+- they hold a certification that is valid on the day of the trip,
+- their certification level is at least what the site's difficulty needs
+  (REQUIRED_LEVEL), and
+- none of their equipment is overdue for maintenance on that day.
+
+It runs the same four queries however many divers are on the roster (site,
+divers, certification summary, overdue equipment) instead of walking each
+diver's relationships, so a 40-person day costs no more than a single diver.
+"""
+
+from datetime import datetime
+
+from sqlalchemy import case, delete, func, select, update
+
+# Highest first: "Advanced Open Water" must not be read as "Open Water".
+LEVEL_KEYWORDS = (
+    ('instructor', 5),
+    ('divemaster', 4),
+    ('rescue', 3),
+    ('advanced', 2),
+    ('open water', 1),
+)
+LEVEL_NAMES = {1: 'Open Water', 2: 'Advanced Open Water', 3: 'Rescue Diver', 4: 'Divemaster', 5: 'Instructor'}
+# Site difficulty -> lowest certification level rank that may dive it; other difficulties need none.
+REQUIRED_LEVEL = {'beginner': 1, 'intermediate': 2, 'advanced': 3}
+# Keeps the roster in one IN (...) list per query.
+MAX_ROSTER = 500
+
+
+def level_rank(level):
+    """Rank of a free-text certification level (see LEVEL_KEYWORDS), or None if unrecognised."""
+    text = (level or '').casefold()
+    return next((rank for keyword, rank in LEVEL_KEYWORDS if keyword in text), None)
+
+
+def _day(value):
+    return value.date() if isinstance(value, datetime) else value
+
+
+def check(conn, tables, site_id, on, diver_ids, user_id):
+    """Eligibility of each of user_id's divers for a dive at site_id on `on` (a date or datetime).
+
+    Returns a list of {'diver_id', 'name', 'eligible', 'reasons'} in roster order; ids that are not
+    user_id's divers are reported as unknown.
+    """
+    diver_ids = list(dict.fromkeys(diver_ids))
+    if len(diver_ids) > MAX_ROSTER:
+        raise ValueError(f'A roster is limited to {MAX_ROSTER} divers')
+    on = _day(on)
+    site, diver = tables['dive_site'], tables['diver']
+    certification, equipment = tables['certification'], tables['equipment']
+
+    difficulty = conn.execute(select(site.c.difficulty_level).where(site.c.id == site_id)).scalar()
+    required = REQUIRED_LEVEL.get((difficulty or '').strip().casefold())
+
+    divers = {row.id: row for row in conn.execute(
+        select(diver.c.id, diver.c.first_name, diver.c.last_name, diver.c.certification_level)
+        .where(diver.c.id.in_(diver_ids), diver.c.user_id == user_id))}
+
+    unexpired = certification.c.expiration_date.is_(None) | (certification.c.expiration_date >= on)
+    certificates = {row.diver_id: row for row in conn.execute(
+        select(certification.c.diver_id, func.count().label('held'),
+               func.sum(case((unexpired, 1), else_=0)).label('valid'),
+               func.max(certification.c.expiration_date).label('latest_expiry'))
+        .where(certification.c.diver_id.in_(list(divers)), certification.c.date_issued <= on)
+        .group_by(certification.c.diver_id))}
+
+    overdue = {}
+    for row in conn.execute(
+            select(equipment.c.diver_id, equipment.c.equipment_type, equipment.c.brand, equipment.c.model,
+                   equipment.c.next_maintenance)
+            .where(equipment.c.diver_id.in_(list(divers)), equipment.c.next_maintenance < on)
+            .order_by(equipment.c.diver_id, equipment.c.next_maintenance, equipment.c.id)):
+        overdue.setdefault(row.diver_id, []).append(row)
+
+    results = []
+    for diver_id in diver_ids:
+        row = divers.get(diver_id)
+        if row is None:
+            results.append({'diver_id': diver_id, 'name': None, 'eligible': False, 'reasons': ['unknown diver']})
+            continue
+        reasons = []
+        held = certificates.get(diver_id)
+        if held is None:
+            reasons.append('no certification on file')
+        elif not held.valid:
+            reasons.append(f'certification expired on {held.latest_expiry}')
+        if required is not None:
+            rank = level_rank(row.certification_level)
+            needs = f'{difficulty} sites need {LEVEL_NAMES[required]} or above'
+            if not row.certification_level:
+                reasons.append(f'{needs}; no certification level recorded')
+            elif rank is None:
+                reasons.append(f'{needs}; certification level {row.certification_level!r} not recognised')
+            elif rank < required:
+                reasons.append(f'{needs}; certified {row.certification_level}')
+        for item in overdue.get(diver_id, ()):
+            name = ' '.join(part for part in (item.equipment_type, item.brand, item.model) if part)
+            reasons.append(f'{name} was due for maintenance on {item.next_maintenance}')
+        results.append({'diver_id': diver_id, 'name': f'{row.first_name} {row.last_name}',
+                        'eligible': not reasons, 'reasons': reasons})
+    return results
+
+
+def check_trip(conn, tables, trip_id):
+    """check() for a saved trip's roster, or None if there is no such trip."""
+    trip, trip_diver = tables['trip'], tables['trip_diver']
+    row = conn.execute(select(trip.c.site_id, trip.c.departure, trip.c.user_id).where(trip.c.id == trip_id)).first()
+    if row is None:
+        return None
+    roster = conn.execute(select(trip_diver.c.diver_id).where(trip_diver.c.trip_id == trip_id)
+                          .order_by(trip_diver.c.diver_id)).scalars().all()
+    return check(conn, tables, row.site_id, row.departure, roster, row.user_id)
+
+
+def summary(results):
+    eligible = sum(result['eligible'] for result in results)
+    return {'divers': len(results), 'eligible': eligible, 'ineligible': len(results) - eligible}
+
+
+def set_roster(conn, tables, trip_id, diver_ids):
+    """Replace a trip's roster."""
+    trip_diver = tables['trip_diver']
+    conn.execute(delete(trip_diver).where(trip_diver.c.trip_id == trip_id))
+    rows = [{'trip_id': trip_id, 'diver_id': diver_id} for diver_id in dict.fromkeys(diver_ids)]
+    if rows:
+        conn.execute(trip_diver.insert(), rows)
+
+
+
+def delete_trips(conn, tables, trip_ids):
+    """Delete trips with their rosters."""
+    trip, trip_diver = tables['trip'], tables['trip_diver']
+    conn.execute(delete(trip_diver).where(trip_diver.c.trip_id.in_(trip_ids)))
+    return conn.execute(delete(trip).where(trip.c.id.in_(trip_ids))).rowcount
+
+
+def unlink_dives(conn, tables, dive_ids):
+    """Forget the logged dive of trips whose dives are being deleted; the trips stay."""
+    trip = tables['trip']
+    conn.execute(update(trip).where(trip.c.dive_id.in_(dive_ids)).values(dive_id=None))
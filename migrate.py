@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+"""
+Idempotent schema upgrade for an existing database.
+
+db.create_all() only creates missing tables; it never touches tables that
+already exist, so indexes and columns added to the models later never reach
+an existing instance/diving_admin.db. This script creates missing tables,
+adds missing columns, creates missing indexes and installs the full-text
+search index, the dive site spatial index and data version triggers. Newly
+created derived tables (the search index, the spatial index, dive statistics)
+are backfilled from the source tables. It is safe to run any number of times.
+
+A fingerprint of the schema it installs is stored in SQLite's user_version
+once an upgrade completes, so later starts that find a matching fingerprint
+skip the inspection entirely. --force inspects and repairs regardless.
+
+Usage: python migrate.py [--force]
+"""
+
+import hashlib
+
+from sqlalchemy import inspect, text
+from sqlalchemy.schema import CreateIndex, CreateTable
+
+import audit
+import geo
+import search
+import stats
+import versions
+
+
+def schema_fingerprint(db, tables=None):
+    """A positive 28-bit hash of every table, index and trigger upgrade_schema() installs."""
+    dialect = db.engine.dialect
+    ddl = []
+    for table in tables or db.metadata.sorted_tables:
+        ddl.append(str(CreateTable(table).compile(dialect=dialect)))
+        ddl += [str(CreateIndex(index).compile(dialect=dialect)) for index in sorted(table.indexes, key=lambda i: i.name)]
+    ddl += [search.CREATE_TABLE, *search.trigger_ddl(), geo.CREATE_TABLE, *geo.trigger_ddl(),
+            *versions.trigger_ddl(), *audit.trigger_ddl()]
+    return int(hashlib.sha1('\n'.join(ddl).encode()).hexdigest()[:7], 16) or 1
+
+
+def upgrade_schema(db, force=False, engine=None, tables=None):
+    """Bring the bound database (or `engine`, limited to `tables`) up to date with the models.
+    Returns a list of changes made.
+
+    Returns straight away when the stored fingerprint matches, unless `force` is set.
+    """
+    changes = []
+    engine = engine or db.engine
+    tables = tables or db.metadata.sorted_tables
+    sqlite = engine.dialect.name == 'sqlite'
+    if sqlite:
+        fingerprint = schema_fingerprint(db, tables)
+        if not force:
+            with engine.connect() as conn:
+                if conn.execute(text('PRAGMA user_version')).scalar() == fingerprint:
+                    return changes
+    existing_tables = set(inspect(engine).get_table_names())
+
+    with engine.begin() as conn:
+        for table in tables:
+            if table.name not in existing_tables:
+                table.create(conn)
+                changes.append(f'created table {table.name}')
+                continue
+
+            inspector = inspect(conn)
+            existing_columns = {c['name'] for c in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing_columns:
+                    continue
+                ddl = f'ALTER TABLE "{table.name}" ADD COLUMN "{column.name}" {column.type.compile(engine.dialect)}'
+                if column.server_default is not None:
+                    ddl += f' DEFAULT {column.server_default.arg}'
+                elif not column.nullable:
+                    raise RuntimeError(f'Cannot add NOT NULL column {table.name}.{column.name} '
+                                       'without a server default')
+                conn.execute(text(ddl))
+                changes.append(f'added column {table.name}.{column.name}')
+
+            existing_indexes = {i['name'] for i in inspector.get_indexes(table.name)}
+            for index in table.indexes:
+                if index.name not in existing_indexes:
+                    conn.execute(CreateIndex(index))
+                    changes.append(f'created index {index.name}')
+
+        if sqlite and search.install(conn):
+            changes.append('created full-text search index')
+
+        if sqlite and geo.install(conn):
+            changes.append('created dive site spatial index')
+
+        if sqlite and versions.install(conn):
+            changes.append('installed data version triggers')
+
+        if sqlite and audit.install(conn):
+            changes.append('made the audit log append-only')
+
+        if any(f'created table {name}' in changes for subject in stats.SUBJECTS.values() for name in subject[:2]):
+            stats.rebuild(conn, db.metadata.tables)
+            changes.append('backfilled dive statistics')
+
+        if changes:
+            conn.execute(text('ANALYZE'))
+        if sqlite:
+            conn.execute(text(f'PRAGMA user_version = {fingerprint}'))
+    return changes
+
+
+if __name__ == '__main__':
+    import argparse
+
+    from app import app, db
+    import tenants
+
+    parser = argparse.ArgumentParser(description='Upgrade the database schema')
+    parser.add_argument('--force', action='store_true', help='inspect the schema even if the stored fingerprint matches')
+    args = parser.parse_args()
+
+    with app.app_context():
+        changes = upgrade_schema(db, force=args.force)
+        # Centre files (TENANT_DATABASES=1) are upgraded when first opened; --force re-inspects them too.
+        for centre_id, engine in tenants.engines(db)[1:]:
+            changes += [f'centre {centre_id}: {change}' for change in upgrade_schema(
+                db, force=args.force, engine=engine, tables=app.extensions['tenants'].tables())]
+    if changes:
+        for change in changes:
+            print(f"✓ {change}")
+    else:
+        print("Schema is already up to date")
@@ -0,0 +1,332 @@
+"""
+Dive planning: no-decompression limits, repetitive-dive credit and gas.
+
+Nitrogen loading follows the Bühlmann ZHL-16C model: sixteen tissue
+compartments with their own half-times load and unload towards the inspired
+nitrogen pressure (the Schreiner equation for depth changes, the Haldane
+equation at constant depth). A dive stays within its no-decompression limit
+while every compartment could surface directly without passing its M-value,
+scaled by the gradient factor GF_HIGH for conservatism. The limit at constant
+depth has a closed form per compartment, so NDLs for every compartment and
+every candidate depth come out of one NumPy expression over a
+(depths x 16) array instead of a minute-by-minute simulation.
+
+Divers start from the nitrogen their earlier dives left behind: each logged
+dive in the REPETITIVE_WINDOW before departure is replayed as a square profile
+at its maximum depth for its whole duration, followed by its surface interval.
+
+Results are cached on bucketed inputs, rounded the conservative way: earlier
+dives deeper (DEPTH_BUCKET) and longer (TIME_BUCKET), surface intervals
+shorter (INTERVAL_BUCKET) and oxygen leaner (whole percent). Divers who dived
+together share a history and hit the same entry, so planning a whole boat
+usually costs a couple of NumPy evaluations.
+
+Gas plans use each diver's surface air consumption estimated from the
+air_used of their recent dives. NumPy is imported on first use.
+"""
+
+import math
+import statistics
+from datetime import timedelta
+from functools import lru_cache
+
+from sqlalchemy import func, select
+
+# ZHL-16C nitrogen coefficients, compartments 1b to 16: half-time (minutes), a (bar), b.
+N2_HALF_TIMES = (5.0, 8.0, 12.5, 18.5, 27.0, 38.3, 54.3, 77.0, 109.0, 146.0, 187.0, 239.0, 305.0, 390.0, 498.0, 635.0)
+N2_A = (1.1696, 1.0, 0.8618, 0.7562, 0.62, 0.5043, 0.441, 0.4, 0.375, 0.35, 0.3295, 0.3065, 0.2835, 0.261, 0.248,
+        0.2327)
+N2_B = (0.5578, 0.6514, 0.7222, 0.7825, 0.8126, 0.8434, 0.8693, 0.891, 0.9092, 0.9222, 0.9319, 0.9403, 0.9477,
+        0.9544, 0.9602, 0.9653)
+
+SURFACE_PRESSURE = 1.01325  # bar
+WATER_VAPOUR = 0.0627  # bar, in the lungs
+METRES_PER_BAR = 10.0  # sea water
+AIR_O2 = 0.21
+GF_HIGH = 0.85
+MAX_PPO2 = 1.4  # bar; deeper than this is beyond the gas's maximum operating depth
+DESCENT_RATE = 18.0  # m/min
+ASCENT_RATE = 9.0  # m/min
+SAFETY_STOP = (5.0, 3.0)  # metres, minutes
+MAX_NDL = 240  # minutes; longer limits are reported as None (no limit)
+RECREATIONAL_LIMIT = 40.0  # metres
+PLAN_MINUTES = 40
+
+REPETITIVE_WINDOW = timedelta(hours=48)
+DEPTH_BUCKET = 3.0  # metres
+TIME_BUCKET = 5  # minutes
+INTERVAL_BUCKET = 15  # minutes
+
+DEFAULT_SAC = 20.0  # litres/min at the surface
+SAC_RANGE = (8.0, 40.0)
+SAC_HISTORY = 10  # recent dives the estimate is taken from
+DEFAULT_TANK_LITRES = 12.0
+DEFAULT_FILL_BAR = 200.0
+RESERVE_BAR = 50.0
+PSI_PER_BAR = 14.5038
+
+
+def _numpy():
+    import numpy
+    return numpy
+
+
+@lru_cache(maxsize=None)
+def _coefficients():
+    np = _numpy()
+    return np.log(2) / np.array(N2_HALF_TIMES), np.array(N2_A), np.array(N2_B)
+
+
+def ambient(depth):
+    return SURFACE_PRESSURE + depth / METRES_PER_BAR
+
+
+def max_operating_depth(o2):
+    return (MAX_PPO2 / o2 - SURFACE_PRESSURE) * METRES_PER_BAR
+
+
+def _inspired(depth, n2):
+    return n2 * (ambient(depth) - WATER_VAPOUR)
+
+
+def _surface_tissues():
+    np = _numpy()
+    return np.full(len(N2_HALF_TIMES), _inspired(0.0, 1 - AIR_O2))
+
+
+def _load(tissues, start_depth, end_depth, minutes, n2):
+    """Tissue pressures after moving from start_depth to end_depth over `minutes` (Schreiner equation).
+
+    Depths and minutes broadcast against each other with a trailing compartment axis, e.g. (depths, 1).
+    """
+    np = _numpy()
+    k = _coefficients()[0]
+    start = _inspired(start_depth, n2)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        rate = np.where(minutes > 0, n2 * (end_depth - start_depth) / METRES_PER_BAR / minutes, 0.0)
+    return start + rate * (minutes - 1 / k) - (start - tissues - rate / k) * np.exp(-k * minutes)
+
+
+# ============ Residual nitrogen ============
+
+def history_key(dives, at):
+    """Bucketed ((depth, minutes, surface interval after), ...) for the dives in the window before `at`.
+
+    `dives` are (start, duration minutes, max depth) tuples. Returns (key, incomplete): dives without a
+    depth or duration are left out and make `incomplete` true.
+    """
+    usable, incomplete = [], False
+    for start, minutes, depth in sorted(dives, key=lambda dive: dive[0]):
+        if start >= at or start < at - REPETITIVE_WINDOW:
+            continue
+        if not minutes or depth is None:
+            incomplete = True
+            continue
+        usable.append((start, minutes, depth))
+    key = []
+    for index, (start, minutes, depth) in enumerate(usable):
+        following = usable[index + 1][0] if index + 1 < len(usable) else at
+        interval = (following - start).total_seconds() / 60 - minutes
+        key.append((math.ceil(depth / DEPTH_BUCKET) * DEPTH_BUCKET,
+                    math.ceil(minutes / TIME_BUCKET) * TIME_BUCKET,
+                    max(0, int(interval // INTERVAL_BUCKET) * INTERVAL_BUCKET)))
+    return tuple(key), incomplete
+
+
+@lru_cache(maxsize=4096)
+def residual(history):
+    """Tissue pressures at departure after the dives in a history_key(); surface-saturated for ()."""
+    tissues = _surface_tissues()
+    n2 = 1 - AIR_O2
+    for depth, minutes, interval in history:
+        descent = min(depth / DESCENT_RATE, minutes)
+        tissues = _load(tissues, 0.0, depth, descent, n2)
+        tissues = _load(tissues, depth, depth, minutes - descent, n2)
+        tissues = _load(tissues, depth, 0.0, depth / ASCENT_RATE, n2)
+        tissues = _load(tissues, 0.0, 0.0, interval, n2)
+    return tuple(tissues.tolist())
+
+
+# ============ No-decompression limits ============
+
+def ndl_minutes(tissues, depths, o2=AIR_O2, gf=GF_HIGH):
+    """NDL in minutes, counted from leaving the surface, for each depth in `depths` (an array).
+
+    Infinite where no compartment ever reaches its limit; 0 where the descent alone would exceed it.
+    """
+    np = _numpy()
+    k, a, b = _coefficients()
+    n2 = 1 - o2
+    depths = np.asarray(depths, dtype=np.float64)[:, None]
+    descent = depths / DESCENT_RATE
+    arrived = _load(np.asarray(tissues), 0.0, depths, descent, n2)
+    inspired = _inspired(depths, n2)
+    # Highest tissue pressure each compartment may carry and still surface directly
+    limit = SURFACE_PRESSURE + gf * (a + SURFACE_PRESSURE / b - SURFACE_PRESSURE)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        remaining = -np.log((limit - inspired) / (arrived - inspired)) / k
+    remaining = np.where(inspired <= limit, np.inf, remaining)
+    remaining = np.where(arrived >= limit, 0.0, remaining)
+    return descent[:, 0] + remaining.min(axis=1)
+
+
+@lru_cache(maxsize=4096)
+def _ndl_table(history, depths, o2_percent):
+    np = _numpy()
+    o2 = o2_percent / 100
+    ndl = np.floor(ndl_minutes(residual(history), depths, o2))
+    beyond = np.asarray(depths) > max_operating_depth(o2)
+    return tuple(0 if over else None if value > MAX_NDL else int(value)
+                 for value, over in zip(ndl.tolist(), beyond.tolist()))
+
+
+def ndl_table(history, depths, o2=AIR_O2):
+    """{depth: NDL minutes, or None for no limit} for whole-metre depths (rounded up), cached per bucket."""
+    depths = tuple(float(math.ceil(depth)) for depth in depths)
+    # Oxygen rounded down: the leaner mix carries more nitrogen
+    table = _ndl_table(history, depths, math.floor(o2 * 100 + 1e-9))
+    return dict(zip(depths, table))
+
+
+def cache_info():
+    return {'residual': residual.cache_info()._asdict(), 'ndl': _ndl_table.cache_info()._asdict()}
+
+
+# ============ Gas ============
+
+def gas_litres(depths, minutes, sac):
+    """Surface litres for square dives of `minutes` (from leaving the surface) at `depths`, with descent, ascent
+    and safety stop. Arguments broadcast, so a grid of candidate plans is one call."""
+    np = _numpy()
+    depths = np.asarray(depths, dtype=np.float64)
+    minutes = np.asarray(minutes, dtype=np.float64)
+    descent = depths / DESCENT_RATE
+    ascent = depths / ASCENT_RATE
+    bottom = np.maximum(minutes - descent, 0.0)
+    # Descent and ascent at their average depth
+    pressure_minutes = (descent + ascent) * ambient(depths / 2) + bottom * ambient(depths)
+    stop_depth, stop_minutes = SAFETY_STOP
+    pressure_minutes = pressure_minutes + np.where(depths > stop_depth, stop_minutes * ambient(stop_depth), 0.0)
+    return sac * pressure_minutes / SURFACE_PRESSURE
+
+
+def estimate_sac(dives, tank_litres=DEFAULT_TANK_LITRES):
+    """Litres/min at the surface from (duration minutes, max depth, air used) of recent dives, or DEFAULT_SAC.
+
+    air_used is taken as bar unless it only makes sense as psi; the average depth is taken as two thirds
+    of the maximum.
+    """
+    rates = []
+    for minutes, depth, used in dives:
+        if not minutes or depth is None or not used:
+            continue
+        bar = used / PSI_PER_BAR if used > DEFAULT_FILL_BAR * 1.5 else used
+        rates.append(bar * tank_litres / minutes / ambient(depth * 2 / 3) * SURFACE_PRESSURE)
+    if not rates:
+        return DEFAULT_SAC
+    low, high = SAC_RANGE
+    return round(min(max(statistics.median(rates), low), high), 1)
+
+
+# ============ Planning a roster ============
+
+def candidate_depths(depth_min, depth_max, o2=AIR_O2, step=3.0):
+    """Whole-metre depths from the site's shallowest to its deepest point, within the MOD and recreational limit."""
+    deepest = min(depth_max or 18.0, RECREATIONAL_LIMIT, math.floor(max_operating_depth(o2)))
+    shallowest = min(max(depth_min or step, step), deepest)
+    depths = []
+    depth = math.ceil(shallowest / step) * step
+    while depth < deepest:
+        depths.append(float(depth))
+        depth += step
+    return depths + [float(math.ceil(deepest))]
+
+
+def plan(conn, tables, diver_ids, at, depth, minutes, o2=AIR_O2, depths=(), tank_litres=DEFAULT_TANK_LITRES,
+         fill_bar=DEFAULT_FILL_BAR):
+    """NDL, repetitive-dive state and gas for each diver on a dive to `depth` for `minutes` at `at`.
+
+    Two queries for the whole roster: dives in the repetitive window, and recent air consumption.
+    Returns a list of dicts in roster order; `ndl_table` covers `depths` as well as `depth`.
+    """
+    np = _numpy()
+    diver_ids = list(dict.fromkeys(diver_ids))
+    dive, dive_diver = tables['dive'], tables['dive_diver']
+
+    recent = {diver_id: [] for diver_id in diver_ids}
+    for row in conn.execute(
+            select(dive_diver.c.diver_id, dive.c.dive_date, dive.c.duration_minutes, dive.c.max_depth)
+            .join(dive, dive.c.id == dive_diver.c.dive_id)
+            .where(dive_diver.c.diver_id.in_(diver_ids), dive.c.dive_date >= at - REPETITIVE_WINDOW,
+                   dive.c.dive_date < at)):
+        recent[row.diver_id].append((row.dive_date, row.duration_minutes, row.max_depth))
+
+    ranked = select(dive_diver.c.diver_id, dive.c.duration_minutes, dive.c.max_depth, dive.c.air_used,
+                    func.row_number().over(partition_by=dive_diver.c.diver_id,
+                                           order_by=(dive.c.dive_date.desc(), dive.c.id.desc())).label('n')) \
+        .join(dive, dive.c.id == dive_diver.c.dive_id) \
+        .where(dive_diver.c.diver_id.in_(diver_ids), dive.c.air_used.is_not(None), dive.c.dive_date < at) \
+        .subquery()
+    consumption = {diver_id: [] for diver_id in diver_ids}
+    for row in conn.execute(select(ranked).where(ranked.c.n <= SAC_HISTORY)):
+        consumption[row.diver_id].append((row.duration_minutes, row.max_depth, row.air_used))
+
+    all_depths = sorted({float(math.ceil(value)) for value in (*depths, depth)})
+    sacs = [estimate_sac(consumption[diver_id], tank_litres) for diver_id in diver_ids]
+    # One gas evaluation for the whole roster
+    litres = gas_litres(depth, minutes, np.array(sacs)) if diver_ids else []
+    results = []
+    for diver_id, sac, needed in zip(diver_ids, sacs, litres):
+        history, incomplete = history_key(recent[diver_id], at)
+        table = ndl_table(history, all_depths, o2)
+        ndl = table[float(math.ceil(depth))]
+        last = max((start + timedelta(minutes=length or 0) for start, length, _ in recent[diver_id]), default=None)
+        needed_bar = float(needed) / tank_litres
+        results.append({
+            'diver_id': diver_id,
+            'repetitive': bool(history),
+            'incomplete_history': incomplete,
+            'last_surfaced': last,
+            'surface_interval_minutes': int((at - last).total_seconds() // 60) if last else None,
+            'ndl': ndl,
+            'within_ndl': ndl is None or minutes <= ndl,
+            'ndl_table': [{'depth': value, 'ndl': table[value]} for value in all_depths],
+            'sac_litres_per_minute': sac,
+            'gas_litres': round(float(needed)),
+            'gas_bar': round(needed_bar),
+            'enough_gas': needed_bar + RESERVE_BAR <= fill_bar,
+        })
+    return results
+
+
+def check_options(depth, minutes, o2):
+    """Raise ValueError unless a planned depth, bottom time and oxygen fraction are sensible."""
+    if not 0 < depth <= RECREATIONAL_LIMIT:
+        raise ValueError(f'Depth must be between 0 and {RECREATIONAL_LIMIT:g} m')
+    if not 0 < minutes <= MAX_NDL:
+        raise ValueError(f'Dive time must be between 0 and {MAX_NDL} minutes')
+    if not AIR_O2 <= o2 <= 0.4:
+        raise ValueError('Oxygen must be between 21% (air) and 40%')
+
+
+def plan_trip(conn, tables, trip_id, depth=None, minutes=PLAN_MINUTES, o2=AIR_O2):
+    """plan() for a saved trip's roster at its site and departure, or None if there is no such trip.
+
+    depth defaults to the site's deepest point (within the gas's MOD and the recreational limit).
+    """
+    trip, trip_diver, diver, site = tables['trip'], tables['trip_diver'], tables['diver'], tables['dive_site']
+    row = conn.execute(select(trip.c.departure, site.c.depth_min, site.c.depth_max)
+                       .join(site, site.c.id == trip.c.site_id).where(trip.c.id == trip_id)).first()
+    if row is None:
+        return None
+    depths = candidate_depths(row.depth_min, row.depth_max, o2)
+    depth = depths[-1] if depth is None else depth
+    check_options(depth, minutes, o2)
+    roster = conn.execute(select(diver.c.id, diver.c.first_name, diver.c.last_name)
+                          .join(trip_diver, trip_diver.c.diver_id == diver.c.id)
+                          .where(trip_diver.c.trip_id == trip_id).order_by(diver.c.id)).all()
+    results = plan(conn, tables, [member.id for member in roster], row.departure, depth, minutes, o2, depths)
+    for member, result in zip(roster, results):
+        result['name'] = f'{member.first_name} {member.last_name}'
+    return {'depth': depth, 'minutes': minutes, 'o2': o2, 'departure': row.departure,
+            'max_operating_depth': round(max_operating_depth(o2), 1), 'depths': depths, 'divers': results}
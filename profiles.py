@@ -0,0 +1,310 @@
+"""
+Dive profiles: the depth, temperature and tank pressure samples a dive
+computer logs every few seconds.
+
+A profile is one dive_profile row per dive rather than one row per sample.
+Each channel is quantised to integers (seconds, centimetres, tenths of a
+degree and of a bar), delta encoded and zlib compressed into a blob; the
+first byte of the blob is the width of the stored deltas. Regular sampling
+makes the deltas tiny, so a one-hour dive logged every second packs into a
+few kilobytes.
+
+Profiles are read from CSV exports (a header row with time and depth columns
+and optional temperature and pressure columns) or UDDF files (waypoints with
+SI units). Derived metrics and the downsampled chart are computed with NumPy
+on the decoded arrays; NumPy is imported on first use so it does not add to
+startup time.
+"""
+
+import csv
+import io
+import math
+import re
+import zlib
+import xml.etree.ElementTree as ElementTree
+
+from sqlalchemy import delete
+
+# Stored integer = value * scale
+CHANNELS = {'time': 1, 'depth': 100, 'temperature': 10, 'pressure': 10}
+OPTIONAL_CHANNELS = ('temperature', 'pressure')
+FORMATS = ('csv', 'uddf')
+MAX_SAMPLES = 200_000
+
+ASCENT_RATE_LIMIT = 10.0  # m/min
+ASCENT_WINDOW = 10  # seconds the ascent rate is averaged over
+DEPTH_BANDS = (0, 6, 18, 30, 40)  # metres; the last band is open-ended
+CHART_POINTS = 400
+CHART_WIDTH, CHART_HEIGHT = 800, 240
+
+CSV_COLUMNS = {
+    'time': ('time', 'time_s', 'seconds', 'divetime', 'elapsed'),
+    'depth': ('depth', 'depth_m'),
+    'temperature': ('temperature', 'temp', 'temperature_c', 'temp_c'),
+    'pressure': ('pressure', 'pressure_bar', 'tank_pressure', 'tankpressure'),
+}
+
+KELVIN = 273.15
+PASCALS_PER_BAR = 100_000
+
+
+class ProfileError(ValueError):
+    pass
+
+
+def _numpy():
+    import numpy
+    return numpy
+
+
+def detect_format(filename):
+    extension = filename.rsplit('.', 1)[-1].lower() if '.' in filename else ''
+    if extension in ('uddf', 'xml'):
+        return 'uddf'
+    if extension == 'csv':
+        return 'csv'
+    raise ProfileError(f'Cannot tell the format of {filename!r}; expected a .csv or .uddf file')
+
+
+# ============ Parsing ============
+
+def _seconds(value):
+    """Seconds from '754', '754.0', '12:34' or '1:02:34'."""
+    parts = value.strip().split(':')
+    if len(parts) > 3:
+        raise ValueError(value)
+    seconds = 0.0
+    for part in parts:
+        seconds = seconds * 60 + float(part)
+    return seconds
+
+
+def _number(value):
+    value = (value or '').strip()
+    return float(value) if value else math.nan
+
+
+def parse_csv(stream):
+    """{channel: [values]} from a CSV export; missing readings are NaN."""
+    reader = csv.DictReader(stream)
+    header = {re.sub(r'[^a-z_]', '', name.strip().lower().replace(' ', '_')): name for name in reader.fieldnames or ()}
+    columns = {}
+    for channel, aliases in CSV_COLUMNS.items():
+        found = next((header[alias] for alias in aliases if alias in header), None)
+        if found is not None:
+            columns[channel] = found
+    for required in ('time', 'depth'):
+        if required not in columns:
+            raise ProfileError(f"CSV needs a {required} column; expected one of {', '.join(CSV_COLUMNS[required])}")
+    samples = {channel: [] for channel in columns}
+    for row_number, row in enumerate(reader, start=2):
+        try:
+            samples['time'].append(_seconds(row[columns['time']]))
+            for channel in columns.keys() - {'time'}:
+                samples[channel].append(_number(row[columns[channel]]))
+        except (TypeError, ValueError):
+            raise ProfileError(f'Row {row_number}: invalid number') from None
+        if len(samples['time']) > MAX_SAMPLES:
+            raise ProfileError(f'More than {MAX_SAMPLES} samples')
+    return samples
+
+
+def parse_uddf(stream):
+    """{channel: [values]} from the first dive in a UDDF file, converted from kelvin and pascals."""
+    samples = {'time': [], 'depth': [], 'temperature': [], 'pressure': []}
+    try:
+        for event, element in ElementTree.iterparse(stream, events=('end',)):
+            tag = element.tag.rsplit('}', 1)[-1]
+            if tag == 'waypoint':
+                values = {child.tag.rsplit('}', 1)[-1]: (child.text or '').strip() for child in element}
+                if 'divetime' not in values or 'depth' not in values:
+                    raise ProfileError('Every waypoint needs a divetime and a depth')
+                samples['time'].append(float(values['divetime']))
+                samples['depth'].append(float(values['depth']))
+                temperature = _number(values.get('temperature'))
+                samples['temperature'].append(temperature - KELVIN)
+                samples['pressure'].append(_number(values.get('tankpressure')) / PASCALS_PER_BAR)
+                element.clear()
+                if len(samples['time']) > MAX_SAMPLES:
+                    raise ProfileError(f'More than {MAX_SAMPLES} samples')
+            elif tag == 'dive' and samples['time']:
+                break
+    except ElementTree.ParseError as e:
+        raise ProfileError(f'Invalid UDDF: {e}') from None
+    except ValueError as e:
+        if isinstance(e, ProfileError):
+            raise
+        raise ProfileError('Invalid number in a waypoint') from None
+    return samples
+
+
+def parse(binary_stream, fmt):
+    """Read a profile upload into validated NumPy arrays: {channel: array or None}."""
+    if fmt == 'csv':
+        samples = parse_csv(io.TextIOWrapper(binary_stream, encoding='utf-8-sig', newline=''))
+    elif fmt == 'uddf':
+        samples = parse_uddf(binary_stream)
+    else:
+        raise ProfileError(f"Unknown format {fmt!r}; expected one of {', '.join(FORMATS)}")
+    return clean(samples)
+
+
+def clean(samples):
+    """Check the samples and fill gaps: optional channels are forward filled, or dropped if never logged."""
+    np = _numpy()
+    time = np.asarray(samples['time'], dtype=np.float64)
+    depth = np.asarray(samples['depth'], dtype=np.float64)
+    if len(time) < 2:
+        raise ProfileError('A profile needs at least two samples')
+    if not np.all(np.isfinite(time)) or np.any(np.diff(time) <= 0):
+        raise ProfileError('Sample times must increase')
+    if not np.all(np.isfinite(depth)) or np.any(depth < 0):
+        raise ProfileError('Depths must be present and not negative')
+    channels = {'time': time - time[0], 'depth': depth}
+    for channel in OPTIONAL_CHANNELS:
+        values = np.asarray(samples.get(channel, ()), dtype=np.float64)
+        present = np.isfinite(values)
+        if not present.any():
+            channels[channel] = None
+            continue
+        # Index of the latest reading at or before each sample; leading gaps take the first reading.
+        last = np.maximum.accumulate(np.where(present, np.arange(len(values)), -1))
+        last[last < 0] = np.argmax(present)
+        channels[channel] = values[last]
+    return channels
+
+
+# ============ Encoding ============
+
+def encode(values, scale):
+    np = _numpy()
+    deltas = np.diff(np.rint(np.asarray(values) * scale).astype(np.int64), prepend=0)
+    low, high = (int(deltas.min()), int(deltas.max())) if len(deltas) else (0, 0)
+    for width in (1, 2, 4, 8):
+        limit = 1 << (8 * width - 1)
+        if -limit <= low and high < limit:
+            break
+    return bytes([width]) + zlib.compress(deltas.astype(f'<i{width}').tobytes())
+
+
+def decode(blob, scale):
+    np = _numpy()
+    deltas = np.frombuffer(zlib.decompress(blob[1:]), dtype=f'<i{blob[0]}')
+    return np.cumsum(deltas, dtype=np.int64) / scale
+
+
+def encode_profile(channels):
+    """Column values for a dive_profile row."""
+    row = {channel: encode(channels[channel], scale) if channels[channel] is not None else None
+           for channel, scale in CHANNELS.items()}
+    row['sample_count'] = len(channels['time'])
+    row['duration_seconds'] = int(round(channels['time'][-1]))
+    return row
+
+
+def decode_profile(row):
+    """{channel: array or None} from a dive_profile row (a model instance or mapping)."""
+    get = row.get if hasattr(row, 'get') else lambda name: getattr(row, name)
+    return {channel: decode(get(channel), scale) if get(channel) is not None else None
+            for channel, scale in CHANNELS.items()}
+
+
+def remove(conn, tables, dive_ids):
+    """Delete the profiles of these dives; call before deleting the dives."""
+    profile = tables['dive_profile']
+    conn.execute(delete(profile).where(profile.c.dive_id.in_(list(dive_ids))))
+
+
+# ============ Metrics ============
+
+def metrics(channels, tank_litres=None):
+    """Derived figures for one profile: duration, depths, ascent rate violations, gas use and time per depth band."""
+    np = _numpy()
+    time, depth = channels['time'], channels['depth']
+    dt = np.diff(time)
+    mid_depth = (depth[1:] + depth[:-1]) / 2
+    duration = float(time[-1])
+    average_depth = float(np.sum(mid_depth * dt) / duration)
+
+    # Ascent rate over a sliding window, so one noisy sample does not count as a violation
+    ends = np.minimum(np.searchsorted(time, time + ASCENT_WINDOW), len(time) - 1)
+    span = time[ends] - time
+    valid = span > 0
+    rate = np.zeros_like(time)
+    rate[valid] = (depth[valid] - depth[ends][valid]) / span[valid] * 60
+    fast = rate > ASCENT_RATE_LIMIT
+    violations = int(np.count_nonzero(fast[1:] & ~fast[:-1]) + fast[0])
+    fast_seconds = float(np.sum(dt[fast[:-1]]))
+
+    bands = np.histogram(mid_depth, bins=[*DEPTH_BANDS, np.inf], weights=dt)[0]
+    labels = [f'{low}-{high} m' for low, high in zip(DEPTH_BANDS, DEPTH_BANDS[1:])] + [f'{DEPTH_BANDS[-1]}+ m']
+
+    result = {
+        'samples': len(time),
+        'duration_minutes': round(duration / 60, 1),
+        'max_depth': round(float(depth.max()), 1),
+        'average_depth': round(average_depth, 1),
+        'max_ascent_rate': round(float(rate.max()), 1),
+        'ascent_violations': violations,
+        'ascent_violation_seconds': round(fast_seconds),
+        'time_at_depth': [{'band': label, 'minutes': round(float(seconds) / 60, 1)}
+                          for label, seconds in zip(labels, bands)],
+        'min_temperature': None,
+        'gas_used_bar': None,
+        'sac_bar_per_minute': None,
+        'sac_litres_per_minute': None,
+    }
+    if channels['temperature'] is not None:
+        result['min_temperature'] = round(float(channels['temperature'].min()), 1)
+    pressure = channels['pressure']
+    if pressure is not None and pressure[0] > pressure[-1]:
+        # Surface air consumption: gas used per minute, scaled to 1 atm by the mean ambient pressure
+        used = float(pressure[0] - pressure[-1])
+        sac = used / (duration / 60) / (1 + average_depth / 10)
+        result.update(gas_used_bar=round(used, 1), sac_bar_per_minute=round(sac, 2))
+        if tank_litres:
+            result['sac_litres_per_minute'] = round(sac * tank_litres, 1)
+    return result
+
+
+# ============ Downsampling ============
+
+def downsample(channels, points=CHART_POINTS):
+    """Indices of at most `points` samples that keep each bucket's shallowest and deepest point."""
+    np = _numpy()
+    depth = channels['depth']
+    count = len(depth)
+    if count <= points:
+        return np.arange(count)
+    buckets = max(1, (points - 2) // 2)
+    size = -(-count // buckets)
+    padded = np.pad(depth, (0, buckets * size - count), mode='edge').reshape(buckets, size)
+    offsets = np.arange(buckets) * size
+    picked = np.concatenate(([0, count - 1], offsets + padded.argmin(axis=1), offsets + padded.argmax(axis=1)))
+    return np.unique(np.minimum(picked, count - 1))
+
+
+def sampled(channels, points=CHART_POINTS):
+    """Downsampled samples as plain lists, for JSON."""
+    index = downsample(channels, points)
+    return {channel: None if values is None else [round(float(value), 2) for value in values[index]]
+            for channel, values in channels.items()}
+
+
+def chart(channels, points=CHART_POINTS, width=CHART_WIDTH, height=CHART_HEIGHT):
+    """SVG coordinates for a depth-over-time chart, depth increasing downwards."""
+    index = downsample(channels, points)
+    time, depth = channels['time'][index], channels['depth'][index]
+    max_time = float(time[-1]) or 1.0
+    max_depth = max(float(depth.max()), 1.0)
+    xs = time / max_time * width
+    ys = depth / max_depth * height
+    step = next((step for step in (1, 2, 5, 10, 20) if max_depth / step <= 6), 50)
+    return {
+        'width': width,
+        'height': height,
+        'points': ' '.join(f'{x:.1f},{y:.1f}' for x, y in zip(xs, ys)),
+        'depth_ticks': [(tick, round(tick / max_depth * height, 1)) for tick in range(0, int(max_depth) + 1, step)],
+        'minutes': round(max_time / 60),
+        'shown': len(index),
+    }
@@ -0,0 +1,170 @@
+"""
+Request-scoped profiling for the Flask app.
+
+Counts SQL statements and times the database, template rendering and the
+whole request for every endpoint. Results go out as a Server-Timing header,
+are aggregated into per-endpoint histograms for /metrics, and slow requests
+or likely N+1 query patterns are logged.
+"""
+
+import threading
+import time
+from collections import Counter
+
+from flask import g, has_request_context, request, before_render_template, template_rendered
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# Upper bounds (ms) of the latency histogram buckets; the last bucket is open-ended.
+LATENCY_BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500)
+
+
+class RouteHistogram:
+    def __init__(self):
+        self.count = 0
+        self.buckets = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+        self.wall_ms_total = 0.0
+        self.wall_ms_max = 0.0
+        self.db_ms_total = 0.0
+        self.template_ms_total = 0.0
+        self.queries_total = 0
+        self.queries_max = 0
+        self.slow = 0
+        self.n_plus_one = 0
+
+    def observe(self, profile, slow, n_plus_one):
+        wall_ms = profile['wall_ms']
+        index = next((i for i, bound in enumerate(LATENCY_BUCKETS_MS) if wall_ms <= bound),
+                     len(LATENCY_BUCKETS_MS))
+        self.count += 1
+        self.buckets[index] += 1
+        self.wall_ms_total += wall_ms
+        self.wall_ms_max = max(self.wall_ms_max, wall_ms)
+        self.db_ms_total += profile['db_ms']
+        self.template_ms_total += profile['template_ms']
+        self.queries_total += profile['queries']
+        self.queries_max = max(self.queries_max, profile['queries'])
+        self.slow += slow
+        self.n_plus_one += n_plus_one
+
+    def to_dict(self):
+        bounds = list(LATENCY_BUCKETS_MS) + [None]
+        return {
+            'count': self.count,
+            'wall_ms': {
+                'buckets': [{'le': bound, 'count': n} for bound, n in zip(bounds, self.buckets)],
+                'mean': round(self.wall_ms_total / self.count, 2) if self.count else 0,
+                'max': round(self.wall_ms_max, 2),
+            },
+            'db_ms_mean': round(self.db_ms_total / self.count, 2) if self.count else 0,
+            'template_ms_mean': round(self.template_ms_total / self.count, 2) if self.count else 0,
+            'queries_mean': round(self.queries_total / self.count, 2) if self.count else 0,
+            'queries_max': self.queries_max,
+            'slow_requests': self.slow,
+            'n_plus_one_suspected': self.n_plus_one,
+        }
+
+
+class RequestProfiler:
+    def __init__(self, app=None):
+        self._lock = threading.Lock()
+        self._routes = {}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('PROFILER_ENABLED', True)
+        app.config.setdefault('SLOW_REQUEST_MS', 500)
+        app.config.setdefault('N_PLUS_ONE_THRESHOLD', 10)
+        if not app.config['PROFILER_ENABLED']:
+            return
+        self.app = app
+        app.extensions['profiler'] = self
+
+        event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+        before_render_template.connect(_before_render, app)
+        template_rendered.connect(_after_render, app)
+        app.before_request(_start_profile)
+        app.after_request(self._finish_profile)
+
+    def _finish_profile(self, response):
+        profile = g.pop('profile', None)
+        if profile is None:
+            return response
+        profile['wall_ms'] = (time.perf_counter() - profile.pop('started')) * 1000
+        endpoint = request.endpoint or 'unmatched'
+
+        response.headers['Server-Timing'] = ', '.join([
+            f'db;dur={profile["db_ms"]:.2f};desc="{profile["queries"]} queries"',
+            f'tpl;dur={profile["template_ms"]:.2f}',
+            f'total;dur={profile["wall_ms"]:.2f}',
+        ])
+
+        config = self.app.config
+        slow = profile['wall_ms'] >= config['SLOW_REQUEST_MS']
+        statement, repeats = profile['statements'].most_common(1)[0] if profile['statements'] else ('', 0)
+        n_plus_one = repeats >= config['N_PLUS_ONE_THRESHOLD']
+        if slow:
+            self.app.logger.warning('Slow request: %s %s took %.1f ms (%d queries, %.1f ms in db)',
+                                    request.method, request.path, profile['wall_ms'],
+                                    profile['queries'], profile['db_ms'])
+        if n_plus_one:
+            self.app.logger.warning('N+1 suspected on %s: statement ran %d times: %s',
+                                    endpoint, repeats, ' '.join(statement.split())[:200])
+
+        with self._lock:
+            self._routes.setdefault(endpoint, RouteHistogram()).observe(profile, slow, n_plus_one)
+        return response
+
+    def snapshot(self):
+        with self._lock:
+            return {endpoint: hist.to_dict() for endpoint, hist in sorted(self._routes.items())}
+
+    def reset(self):
+        with self._lock:
+            self._routes.clear()
+
+
+def _start_profile():
+    g.profile = {
+        'started': time.perf_counter(),
+        'queries': 0,
+        'db_ms': 0.0,
+        'template_ms': 0.0,
+        'statements': Counter(),
+    }
+
+
+def _current_profile():
+    if has_request_context():
+        return g.get('profile')
+    return None
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info['query_started'].pop()
+    profile = _current_profile()
+    if profile is not None:
+        profile['queries'] += 1
+        profile['db_ms'] += (time.perf_counter() - started) * 1000
+        profile['statements'][statement] += 1
+
+
+def _before_render(sender, template, context, **extra):
+    profile = _current_profile()
+    if profile is not None:
+        profile.setdefault('render_started', []).append(time.perf_counter())
+
+
+def _after_render(sender, template, context, **extra):
+    profile = _current_profile()
+    if profile is not None and profile.get('render_started'):
+        started = profile['render_started'].pop()
+        # A render nested in another (a cached fragment built mid-page) is already inside the outer one's time.
+        if not profile['render_started']:
+            profile['template_ms'] += (time.perf_counter() - started) * 1000
@@ -0,0 +1,18 @@
+#!/usr/bin/env python
+"""
+Rebuild the full-text search index from the source tables.
+
+Triggers keep the index in sync on every write, so this is only needed after
+restoring a database or editing it with triggers disabled.
+"""
+
+from app import app, db
+import search
+import tenants
+
+with app.app_context():
+    for _, engine in tenants.engines(db):
+        with engine.begin() as conn:
+            if not search.install(conn):
+                search.rebuild(conn)
+    print("✓ Search index rebuilt")
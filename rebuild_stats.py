@@ -0,0 +1,17 @@
+#!/usr/bin/env python
+"""
+Recompute per-diver and per-site dive statistics from the dive tables.
+
+Every write path keeps the statistics current, so this is only needed for
+backfills: after restoring a database, or after editing dives outside the app.
+"""
+
+from app import app, db
+import stats
+import tenants
+
+with app.app_context():
+    for _, engine in tenants.engines(db):
+        with engine.begin() as conn:
+            stats.rebuild(conn, db.metadata.tables)
+    print("✓ Dive statistics rebuilt")
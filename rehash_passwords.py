@@ -0,0 +1,47 @@
+#!/usr/bin/env python
+"""
+Report and re-hash stored passwords for the configured PASSWORD_HASH_METHOD.
+
+A hash can only be recomputed from the plain-text password, so accounts using
+an outdated method are upgraded automatically the next time they log in. This
+script lists the accounts still waiting for that, and can set new passwords in
+bulk for accounts whose passwords you manage (shared desk or test accounts).
+
+Usage:
+    python rehash_passwords.py                      # list outdated hashes
+    python rehash_passwords.py --reset me peter     # prompts for the new password
+    python rehash_passwords.py --reset me --password s3cret
+"""
+
+import argparse
+import getpass
+import sys
+
+from app import app, db, User
+
+parser = argparse.ArgumentParser(description='Report and re-hash stored passwords')
+parser.add_argument('--reset', nargs='+', metavar='USERNAME', help='set a new password for these users')
+parser.add_argument('--password', help='password to set with --reset (prompted for when omitted)')
+args = parser.parse_args()
+
+if args.reset and not args.password:
+    args.password = getpass.getpass('New password: ')
+    if not args.password or args.password != getpass.getpass('Repeat new password: '):
+        sys.exit('Passwords are empty or do not match; nothing changed')
+
+with app.app_context():
+    method = app.config['PASSWORD_HASH_METHOD']
+    if args.reset:
+        for username in args.reset:
+            user = User.query.filter_by(username=username).first()
+            if user:
+                user.set_password(args.password)
+                print(f"Password for user '{username}' re-hashed with {method}")
+            else:
+                print(f"User '{username}' not found")
+        db.session.commit()
+    else:
+        outdated = [user for user in User.query.all() if user.password_needs_rehash()]
+        for user in outdated:
+            print(f"{user.username}: {user.password_hash.split('$', 1)[0]}")
+        print(f"{len(outdated)} account(s) not yet on {method}; they are upgraded at their next login")
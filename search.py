@@ -0,0 +1,251 @@
+"""
+Full-text search over dives, dive sites, divers, equipment and certifications.
+
+Everything lives in one SQLite FTS5 table, `search_index`, ranked with bm25.
+The rowid encodes what a document is: rowid = ref_id * 8 + kind code, so
+finding, replacing or deleting a document is a rowid lookup. Triggers on the
+source tables keep the index in sync for every write path (ORM routes, the
+bulk importer, raw SQL).
+
+Who may see a document is indexed too, as tokens in the `tags` column: the
+users owning a dive, diver, equipment or certification (u<user_id>), and for
+a site k2 (its kind code) plus its centre (c<centre_id>, c0 when shared),
+matching the rules of the HTML routes. search() adds them to the MATCH
+expression, so FTS5 narrows the matches to visible ones before ranking them.
+Tags are kept unlike everyday words: bm25 counts a tag's documents across
+every column. A dive's owners come from dive_diver, whose triggers re-index
+the dive; a diver's user_id never changes.
+
+A centre's own database file (TENANT_DATABASES) has no dive_site table: sites
+live in the attached directory and are indexed there. Triggers stored in one
+database cannot read another, so the centre file's dive documents, which carry
+their site's name, are kept in sync by TEMP triggers that each connection
+installs (temp_trigger_ddl()), and search() reads site matches from the
+directory's index.
+"""
+
+import re
+
+from markupsafe import Markup, escape
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+
+KIND_CODES = {
+    'dive': 1,
+    'site': 2,
+    'diver': 3,
+    'equipment': 4,
+    'certification': 5,
+}
+KINDS_BY_CODE = {code: kind for kind, code in KIND_CODES.items()}
+
+# bm25 weights for (title, body): a hit in a name or title counts for more.
+TITLE_WEIGHT = 5.0
+BODY_WEIGHT = 1.0
+
+# Sentinels wrapped around highlighted terms; replaced after HTML escaping.
+HIGHLIGHT_START = '\x02'
+HIGHLIGHT_END = '\x03'
+
+CREATE_TABLE = ("CREATE VIRTUAL TABLE IF NOT EXISTS search_index USING fts5(title, body, tags, "
+                "tokenize='unicode61 remove_diacritics 2')")
+COLUMNS = ('title', 'body', 'tags')
+
+# SQL producing (rowid, title, body, tags) for each kind, given a source row alias.
+DOCUMENTS = {
+    'dive': ("dive", """{row}.id * 8 + 1,
+        (SELECT name FROM dive_site WHERE dive_site.id = {row}.site_id),
+        coalesce({row}.conditions, '') || ' ' || coalesce({row}.notes, ''),
+        coalesce((SELECT group_concat(DISTINCT 'u' || diver.user_id) FROM dive_diver
+            JOIN diver ON diver.id = dive_diver.diver_id WHERE dive_diver.dive_id = {row}.id), '')"""),
+    'site': ("dive_site", """{row}.id * 8 + 2,
+        {row}.name,
+        coalesce({row}.location, '') || ' ' || coalesce({row}.description, ''),
+        'k2 c' || coalesce({row}.centre_id, 0)"""),
+    'diver': ("diver", """{row}.id * 8 + 3,
+        {row}.first_name || ' ' || {row}.last_name,
+        coalesce({row}.certification_number, '') || ' ' || coalesce({row}.certification_level, ''),
+        'u' || {row}.user_id"""),
+    'equipment': ("equipment", """{row}.id * 8 + 4,
+        {row}.equipment_type || ' ' || coalesce({row}.brand, '') || ' ' || coalesce({row}.model, ''),
+        coalesce({row}.serial_number, ''),
+        (SELECT 'u' || user_id FROM diver WHERE diver.id = {row}.diver_id)"""),
+    'certification': ("certification", """{row}.id * 8 + 5,
+        {row}.cert_type || ' ' || coalesce({row}.agency, ''),
+        coalesce({row}.cert_number, ''),
+        (SELECT 'u' || user_id FROM diver WHERE diver.id = {row}.diver_id)"""),
+}
+_INSERT = "INSERT OR REPLACE INTO search_index(rowid, title, body, tags) SELECT"
+
+
+def _triggers(kinds, create='CREATE TRIGGER', schema=''):
+    statements = []
+    for kind in kinds:
+        table, document = DOCUMENTS[kind]
+        code = KIND_CODES[kind]
+        insert = f"{_INSERT} {document.format(row='NEW')};"
+        statements += [
+            f"{create} IF NOT EXISTS search_{table}_insert AFTER INSERT ON {schema}{table} BEGIN {insert} END",
+            f"{create} IF NOT EXISTS search_{table}_update AFTER UPDATE ON {schema}{table} BEGIN {insert} END",
+            f"{create} IF NOT EXISTS search_{table}_delete AFTER DELETE ON {schema}{table} BEGIN "
+            f"DELETE FROM search_index WHERE rowid = OLD.id * 8 + {code}; END",
+        ]
+    if 'dive' in kinds:
+        # Dive documents carry their owners, so adding or removing a diver re-indexes the dive.
+        _, dive_document = DOCUMENTS['dive']
+        for event_name, row in (('insert', 'NEW'), ('delete', 'OLD')):
+            statements.append(
+                f"{create} IF NOT EXISTS search_dive_diver_{event_name} AFTER {event_name.upper()} ON {schema}dive_diver "
+                f"BEGIN {_INSERT} {dive_document.format(row='dive')} FROM dive WHERE dive.id = {row}.dive_id; END")
+    return statements
+
+
+def _rename_trigger(create='CREATE TRIGGER', sites=''):
+    # Dive documents carry their site's name.
+    _, dive_document = DOCUMENTS['dive']
+    return (f"{create} IF NOT EXISTS search_dive_site_rename AFTER UPDATE OF name ON {sites}dive_site BEGIN "
+            f"{_INSERT} {dive_document.format(row='dive')} FROM dive WHERE dive.site_id = NEW.id; END")
+
+
+def trigger_ddl(sites=True):
+    """Triggers stored in the database; sites=False for one whose dive_site is attached from elsewhere."""
+    if sites:
+        return _triggers(DOCUMENTS) + [_rename_trigger()]
+    return _triggers([kind for kind in DOCUMENTS if kind not in ('dive', 'site')])
+
+
+def temp_trigger_ddl(directory):
+    """Per-connection triggers for a database whose dive_site is in the attached schema `directory`."""
+    return _triggers(['dive'], 'CREATE TEMP TRIGGER', 'main.') + [_rename_trigger('CREATE TEMP TRIGGER', f'{directory}.')]
+
+
+def has_sites(conn):
+    """Whether dive_site is stored in this database rather than attached from the directory."""
+    return conn.execute(text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'dive_site'")).first() is not None
+
+
+def drop_triggers(conn):
+    """Stop syncing the index, e.g. during a bulk load; install() and rebuild() restore it."""
+    names = conn.execute(text(
+        "SELECT name FROM sqlite_master WHERE type = 'trigger' AND name LIKE 'search\\_%' ESCAPE '\\'")).scalars().all()
+    for name in names:
+        conn.execute(text(f'DROP TRIGGER "{name}"'))
+
+
+def install(conn):
+    """Create the FTS table and (re)create its triggers, backfilling a new index. Returns True if created.
+
+    An index from before the tags column is dropped and rebuilt.
+    """
+    exists = conn.execute(text("SELECT 1 FROM sqlite_master WHERE name = 'search_index'")).first()
+    if exists is not None:
+        columns = tuple(row[1] for row in conn.execute(text("PRAGMA main.table_info(search_index)")))
+        if columns != COLUMNS:
+            conn.execute(text("DROP TABLE search_index"))
+            exists = None
+    if exists is None:
+        try:
+            conn.execute(text(CREATE_TABLE))
+        except OperationalError:
+            # SQLite built without FTS5; search stays unavailable.
+            return False
+    # Replaced rather than skipped, so changed documents reach existing databases. Without a local
+    # dive_site the dive triggers are left out; temp_trigger_ddl() replaces them.
+    drop_triggers(conn)
+    for statement in trigger_ddl(has_sites(conn)):
+        conn.execute(text(statement))
+    if exists is None:
+        rebuild(conn)
+        return True
+    return False
+
+
+def rebuild(conn):
+    """Re-create every document from the source tables (sites only where dive_site is stored)."""
+    conn.execute(text("DELETE FROM search_index"))
+    sites = has_sites(conn)
+    for kind, (table, document) in DOCUMENTS.items():
+        if kind != 'site' or sites:
+            conn.execute(text(f"INSERT INTO search_index(rowid, title, body, tags) SELECT {document.format(row=table)} FROM {table}"))
+    conn.execute(text("INSERT INTO search_index(search_index) VALUES ('optimize')"))
+
+
+def build_match(query, operator='AND'):
+    """Turn free text into a safe FTS5 query of quoted prefix terms."""
+    terms = re.findall(r'\w+', query.lower())
+    return f' {operator} '.join(f'"{term}"*' for term in terms)
+
+
+_SEARCH = f"""
+SELECT rowid, title, bm25(search_index, {TITLE_WEIGHT}, {BODY_WEIGHT}, 0.0) AS rank,
+       snippet(search_index, 0, '{HIGHLIGHT_START}', '{HIGHLIGHT_END}', '…', 16) AS title_excerpt,
+       snippet(search_index, 1, '{HIGHLIGHT_START}', '{HIGHLIGHT_END}', '…', 16) AS body_excerpt
+FROM {{index}}
+WHERE search_index MATCH :match
+  AND (:kind_code IS NULL OR rowid % 8 = :kind_code)
+ORDER BY rank
+LIMIT :limit
+"""
+
+
+def _match(terms, visible):
+    """FTS5 query: the terms in title or body, and one of the `visible` tags."""
+    return f'{{title body}} : ({terms}) AND tags : ({" OR ".join(visible)})'
+
+
+def _owned(user_id, kind_code):
+    return [] if kind_code == KIND_CODES['site'] else [f'"u{user_id}"']
+
+
+def _visible_sites(centre_id, kind_code):
+    # The centre's own sites and shared ones, like the ORM scoping in tenants.py; every site without a centre.
+    if kind_code not in (None, KIND_CODES['site']):
+        return []
+    return ['"k2"'] if centre_id is None else ['"c0"', f'"c{centre_id}"']
+
+
+def highlight(excerpt):
+    return Markup(str(escape(excerpt)).replace(HIGHLIGHT_START, '<mark>').replace(HIGHLIGHT_END, '</mark>'))
+
+
+def _excerpt(row):
+    # The column with more highlighted terms, the title on a tie, as snippet(-1) picks between title and body.
+    if row.body_excerpt.count(HIGHLIGHT_START) > row.title_excerpt.count(HIGHLIGHT_START):
+        return row.body_excerpt
+    return row.title_excerpt
+
+
+def _matches(conn, terms, user_id, centre_id, kind_code, limit, sites_schema):
+    # The kind narrows the tags searched for; the rowid check is cheaper than a kind tag, which
+    # would make bm25 count every document of that kind.
+    owned, sites = _owned(user_id, kind_code), _visible_sites(centre_id, kind_code)
+    searches = [('search_index', owned + sites)] if sites_schema is None else [
+        ('search_index', owned), (f'{sites_schema}.search_index', sites)]
+    rows = []
+    for index, visible in searches:
+        if visible:
+            params = {'match': _match(terms, visible), 'kind_code': kind_code, 'limit': limit}
+            rows += conn.execute(text(_SEARCH.format(index=index)), params).all()
+    return sorted(rows, key=lambda row: row.rank)[:limit]
+
+
+def search(conn, query, user_id, kind=None, limit=50, centre_id=None, sites_schema=None):
+    """Ranked matches visible to user_id in centre_id. Falls back to matching any term when all terms find nothing.
+
+    sites_schema names the attached schema holding dive_site and its documents when conn's database has none.
+    """
+    if kind is not None and kind not in KIND_CODES:
+        raise ValueError(f"Unknown search kind {kind!r}; expected one of {', '.join(KIND_CODES)}")
+    if not build_match(query):
+        return []
+    scope = (user_id, centre_id, KIND_CODES.get(kind), limit, sites_schema)
+    rows = _matches(conn, build_match(query, 'AND'), *scope)
+    if not rows and len(re.findall(r'\w+', query)) > 1:
+        rows = _matches(conn, build_match(query, 'OR'), *scope)
+    return [{
+        'kind': KINDS_BY_CODE[row.rowid % 8],
+        'id': row.rowid // 8,
+        'title': row.title,
+        'excerpt': highlight(_excerpt(row)),
+        'score': -row.rank,
+    } for row in rows]
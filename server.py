@@ -0,0 +1,235 @@
+#!/usr/bin/env python
+"""
+Serving the app.
+
+`development` runs Flask's built-in Werkzeug server: a thread per connection,
+no keep-alive and the debugger when asked for. `production` runs waitress, a
+pure-Python WSGI server with a fixed pool of worker threads, a cap on open
+connections and HTTP/1.1 keep-alive, so a burst of requests queues for a
+worker instead of spawning a thread each.
+
+On SIGTERM or SIGINT the production server stops accepting connections, lets
+requests already in progress finish and flush (up to SERVER_SHUTDOWN_TIMEOUT
+seconds), then closes idle keep-alive connections and stops its workers.
+
+The entry points bind the listening socket before importing the app, so a
+browser pointed at it while Flask and SQLAlchemy load has its connection
+queued by the kernel rather than refused (see startup.py for the timings).
+
+Usage:
+    python server.py                       # SERVER_MODE, default production
+    python server.py --mode development --port 5002
+"""
+
+import argparse
+import logging
+import os
+import signal
+import socket
+import threading
+import time
+
+import startup
+
+MODES = ('production', 'development')
+# The first alert refresh waits this long so it does not compete with the first page.
+ALERT_STARTUP_DELAY = 10
+# Likewise the first scheduled backup, which also waits for the alert refresh.
+BACKUP_STARTUP_DELAY = 60
+
+logger = logging.getLogger(__name__)
+
+
+class _Stop(Exception):
+    """Raised in the main thread by the shutdown signal handlers."""
+
+
+def settings():
+    """The SERVER_* settings from the environment, for app.config."""
+    return {
+        'SERVER_MODE': os.environ.get('SERVER_MODE', 'production'),
+        'SERVER_HOST': os.environ.get('SERVER_HOST', '127.0.0.1'),
+        'SERVER_PORT': int(os.environ.get('SERVER_PORT', 5001)),
+        'SERVER_THREADS': int(os.environ.get('SERVER_THREADS', 8)),
+        'SERVER_CONNECTION_LIMIT': int(os.environ.get('SERVER_CONNECTION_LIMIT', 100)),
+        # Seconds an idle keep-alive connection is kept open.
+        'SERVER_CHANNEL_TIMEOUT': int(os.environ.get('SERVER_CHANNEL_TIMEOUT', 30)),
+        'SERVER_SHUTDOWN_TIMEOUT': int(os.environ.get('SERVER_SHUTDOWN_TIMEOUT', 10)),
+    }
+
+
+def listen(host, port):
+    """A listening TCP socket for production serving, bound before the app is imported."""
+    family = socket.AF_INET6 if ':' in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(1024)
+    return sock
+
+
+def wait_until_ready(host, port, timeout=30, interval=0.05):
+    """Poll until a TCP connection to host:port succeeds. Returns False after `timeout` seconds."""
+    if host in ('', '0.0.0.0', '::'):
+        host = '127.0.0.1'
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection((host, port), timeout=interval * 10):
+                return True
+        except OSError:
+            time.sleep(interval)
+    return False
+
+
+def _check_pool(app, threads):
+    options = app.config.get('SQLALCHEMY_ENGINE_OPTIONS', {})
+    if 'pool_size' in options:
+        capacity = options['pool_size'] + options.get('max_overflow', 0)
+        if threads > capacity:
+            logger.warning('SERVER_THREADS=%d exceeds the database pool (%d connections); '
+                           'requests will wait for a connection', threads, capacity)
+
+
+def _drain(map, task_dispatcher, timeout):
+    """Stop accepting, let in-flight requests finish and flush, then close everything."""
+    from waitress import wasyncore
+    from waitress.server import BaseWSGIServer
+
+    for dispatcher in list(map.values()):
+        if isinstance(dispatcher, BaseWSGIServer):
+            wasyncore.dispatcher.close(dispatcher)
+    deadline = time.monotonic() + timeout
+    try:
+        while time.monotonic() < deadline and any(
+                getattr(channel, 'requests', None) or getattr(channel, 'total_outbufs_len', 0)
+                for channel in list(map.values())):
+            wasyncore.loop(timeout=0.1, map=map, count=1)
+    finally:
+        task_dispatcher.shutdown(cancel_pending=True, timeout=1)
+        wasyncore.close_all(map)
+
+
+def _mark_first_response(app):
+    done = []
+
+    @app.after_request
+    def first_response(response):
+        if not done:
+            done.append(True)
+            startup.mark('first response')
+        return response
+
+
+def _serve_production(app, host, port, threads, connection_limit, channel_timeout, shutdown_timeout, sock=None):
+    from waitress import create_server
+
+    map = {}
+    where = {'sockets': [sock]} if sock is not None else {'host': host, 'port': port}
+    server = create_server(app, map=map, threads=threads, connection_limit=connection_limit,
+                           channel_timeout=channel_timeout, ident='diving-admin', **where)
+
+    def stop(signum, frame):
+        raise _Stop(signal.Signals(signum).name)
+
+    handlers = {}
+    if threading.current_thread() is threading.main_thread():
+        handlers = {signum: signal.signal(signum, stop) for signum in (signal.SIGTERM, signal.SIGINT)}
+    logger.info('Serving on http://%s:%d with %d threads', host, port, threads)
+    try:
+        server.run()
+    except _Stop as reason:
+        logger.info('%s received; finishing in-flight requests', reason)
+        _drain(map, server.task_dispatcher, shutdown_timeout)
+    finally:
+        for signum, handler in handlers.items():
+            signal.signal(signum, handler)
+    logger.info('Server stopped')
+
+
+def serve(app, mode=None, debug=False, on_ready=None, sock=None):
+    """Run the app with the SERVER_* settings in app.config until shut down.
+
+    on_ready, if given, is called from a background thread once the port accepts connections.
+    sock is a socket from listen() to serve on instead of binding SERVER_HOST/SERVER_PORT (production only).
+    """
+    config = app.config
+    mode = mode or config['SERVER_MODE']
+    if mode not in MODES:
+        raise ValueError(f"Unknown server mode {mode!r}; expected one of {', '.join(MODES)}")
+    host, port = config['SERVER_HOST'], config['SERVER_PORT']
+
+    if on_ready is not None:
+        def notify():
+            if wait_until_ready(host, port):
+                on_ready()
+        threading.Thread(target=notify, name='server-ready', daemon=True).start()
+
+    _mark_first_response(app)
+    if mode == 'development':
+        app.run(host=host, port=port, debug=debug, threaded=True)
+        return
+    _check_pool(app, config['SERVER_THREADS'])
+    _serve_production(app, host, port, config['SERVER_THREADS'], config['SERVER_CONNECTION_LIMIT'],
+                      config['SERVER_CHANNEL_TIMEOUT'], config['SERVER_SHUTDOWN_TIMEOUT'], sock)
+
+
+def uses_reloader(app, mode=None, debug=False):
+    """Whether serve(app, mode, debug) runs the Werkzeug reloader, which serves from a child process."""
+    return (mode or app.config['SERVER_MODE']) == 'development' and debug
+
+
+def start_background_jobs(app, db, on_refresh=None, job_queue=None, reloader=False):
+    """Upgrade the schema and start the schedulers and job workers, as every entry point does before serving.
+
+    With reloader (see uses_reloader()) nothing starts in the reloader's watcher process, only in the
+    child that serves: a second set of workers would claim jobs whose secrets only the child holds,
+    and its start() would mark the child's running jobs as interrupted.
+    """
+    from migrate import upgrade_schema
+    import alerts
+    import backups
+
+    if reloader and os.environ.get('WERKZEUG_RUN_MAIN') != 'true':
+        return
+    with app.app_context():
+        upgrade_schema(db)
+    if app.config['ALERT_REFRESH_INTERVAL']:
+        alerts.start_scheduler(app, db, app.config['ALERT_REFRESH_INTERVAL'], app.config['ALERT_WINDOW_DAYS'],
+                               on_refresh=on_refresh, delay=ALERT_STARTUP_DELAY,
+                               grace_days=app.config['ALERT_GRACE_DAYS'])
+    if job_queue is not None:
+        job_queue.start()
+        if app.config.get('BACKUP_INTERVAL'):
+            backups.start_scheduler(app, app.config['BACKUP_INTERVAL'], lambda: job_queue.enqueue('backup'),
+                                    delay=BACKUP_STARTUP_DELAY)
+    startup.mark('schema')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve the diving admin app')
+    parser.add_argument('--mode', choices=MODES, help='overrides SERVER_MODE')
+    parser.add_argument('--host', help='overrides SERVER_HOST')
+    parser.add_argument('--port', type=int, help='overrides SERVER_PORT')
+    parser.add_argument('--threads', type=int, help='overrides SERVER_THREADS')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+    overrides = {key: value for key, value in (('SERVER_MODE', args.mode), ('SERVER_HOST', args.host),
+                                               ('SERVER_PORT', args.port), ('SERVER_THREADS', args.threads))
+                 if value is not None}
+    config = dict(settings(), **overrides)
+    sock = None
+    if config['SERVER_MODE'] == 'production':
+        sock = listen(config['SERVER_HOST'], config['SERVER_PORT'])
+    startup.mark('listen')
+
+    from app import app, db, invalidate_stats, job_queue
+    startup.mark('imports')
+    app.config.update(overrides)
+    start_background_jobs(app, db, on_refresh=invalidate_stats, job_queue=job_queue)
+    serve(app, sock=sock)
+
+
+if __name__ == '__main__':
+    main()
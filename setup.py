@@ -5,12 +5,13 @@ Run this once to initialize the database with a test account
 """
 
 from app import app, db, User, DiveSite
+from migrate import upgrade_schema
 from datetime import datetime
 
 def setup_database():
     with app.app_context():
-        # Create all tables
-        db.create_all()
+        # Create all tables and bring indexes up to date
+        upgrade_schema(db)
         print("✓ Database tables created")
         
         # Check if test user already exists
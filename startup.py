@@ -0,0 +1,40 @@
+"""
+Startup timing.
+
+mark() records how long each startup phase took since the previous mark.
+With STARTUP_REPORT=1 each mark is also written to stderr as it happens, as
+`startup: <phase> <ms> ms`; run under `python -X importtime` the markers
+interleave with the import timings, which is how benchmarks/startup_budget.py
+attributes imports to phases. Standard library only, so it can be imported
+before anything heavy.
+"""
+
+import os
+import sys
+import threading
+import time
+
+STARTED = time.perf_counter()
+
+_lock = threading.Lock()
+_phases = []
+_last = STARTED
+
+
+def mark(phase):
+    """End `phase` now. Returns its duration in milliseconds."""
+    global _last
+    with _lock:
+        now = time.perf_counter()
+        elapsed_ms = (now - _last) * 1000
+        _phases.append((phase, elapsed_ms))
+        _last = now
+    if os.environ.get('STARTUP_REPORT'):
+        print(f'startup: {phase} {elapsed_ms:.1f} ms', file=sys.stderr, flush=True)
+    return elapsed_ms
+
+
+def phases():
+    """[(phase, milliseconds)] in the order they ended."""
+    with _lock:
+        return list(_phases)
@@ -0,0 +1,178 @@
+"""
+Per-diver and per-site dive statistics, maintained incrementally.
+
+diver_stats / site_stats hold running totals (dive count, bottom time, deepest
+dive, air used) and diver_month_stats / site_month_stats hold dives and
+bottom time per calendar month. Write paths apply deltas for just the dives
+they touch, inside the same transaction as the write:
+
+    add_dives(conn, tables, dive_ids)      after the dive and dive_diver rows exist
+    remove_dives(conn, tables, dive_ids)   before the dives are deleted
+    remove_divers(conn, tables, diver_ids) when divers are deleted
+
+Counters and sums are updated in place; the deepest dive is recomputed for a
+diver or site only when a removed dive was its deepest. Diver.experience_dives
+stays the diver's own figure and is never written here; the logged count is
+diver_stats.dive_count. rebuild() recomputes everything from the source tables
+for backfills and repairs.
+"""
+
+from datetime import date
+
+from sqlalchemy import case, delete, func, select, update
+from sqlalchemy.dialects.sqlite import insert
+
+# subject -> (totals table, per-month table, key column)
+SUBJECTS = {
+    'diver': ('diver_stats', 'diver_month_stats', 'diver_id'),
+    'site': ('site_stats', 'site_month_stats', 'site_id'),
+}
+TOTALS = ('dive_count', 'bottom_time_minutes', 'air_used_total', 'air_dives')
+MONTH_TOTALS = ('dive_count', 'bottom_time_minutes')
+
+
+def _source(tables, subject):
+    """(FROM clause, key column) aggregating dives per diver or per site."""
+    dive = tables['dive']
+    if subject == 'diver':
+        dive_diver = tables['dive_diver']
+        return dive.join(dive_diver, dive_diver.c.dive_id == dive.c.id), dive_diver.c.diver_id
+    return dive, dive.c.site_id
+
+
+def _month(tables):
+    return func.strftime('%Y-%m', tables['dive'].c.dive_date)
+
+
+def _totals_query(tables, subject, dive_ids=None):
+    dive = tables['dive']
+    source, key = _source(tables, subject)
+    query = select(
+        key.label(SUBJECTS[subject][2]),
+        func.count().label('dive_count'),
+        func.coalesce(func.sum(dive.c.duration_minutes), 0).label('bottom_time_minutes'),
+        func.max(dive.c.max_depth).label('deepest_dive'),
+        func.coalesce(func.sum(dive.c.air_used), 0).label('air_used_total'),
+        func.count(dive.c.air_used).label('air_dives'),
+    ).select_from(source).group_by(key)
+    return query if dive_ids is None else query.where(dive.c.id.in_(dive_ids))
+
+
+def _months_query(tables, subject, dive_ids=None):
+    dive = tables['dive']
+    source, key = _source(tables, subject)
+    month = _month(tables)
+    query = select(
+        key.label(SUBJECTS[subject][2]),
+        month.label('month'),
+        func.count().label('dive_count'),
+        func.coalesce(func.sum(dive.c.duration_minutes), 0).label('bottom_time_minutes'),
+    ).select_from(source).group_by(key, month)
+    return query if dive_ids is None else query.where(dive.c.id.in_(dive_ids))
+
+
+def add_dives(conn, tables, dive_ids):
+    """Add newly written dives (and their dive_diver rows) to every statistic."""
+    if not dive_ids:
+        return
+    for subject, (totals_name, months_name, key) in SUBJECTS.items():
+        rows = [dict(row) for row in conn.execute(_totals_query(tables, subject, dive_ids)).mappings()]
+        if not rows:
+            continue
+        totals = tables[totals_name]
+        statement = insert(totals)
+        deepest = func.max(func.coalesce(totals.c.deepest_dive, statement.excluded.deepest_dive),
+                           func.coalesce(statement.excluded.deepest_dive, totals.c.deepest_dive))
+        conn.execute(statement.on_conflict_do_update(
+            index_elements=[key],
+            set_=dict({name: totals.c[name] + statement.excluded[name] for name in TOTALS}, deepest_dive=deepest),
+        ), rows)
+
+        months = tables[months_name]
+        statement = insert(months)
+        conn.execute(statement.on_conflict_do_update(
+            index_elements=[key, 'month'],
+            set_={name: months.c[name] + statement.excluded[name] for name in MONTH_TOTALS},
+        ), [dict(row) for row in conn.execute(_months_query(tables, subject, dive_ids)).mappings()])
+
+
+def remove_dives(conn, tables, dive_ids):
+    """Take dives out of every statistic. Call before the dive and dive_diver rows are deleted."""
+    if not dive_ids:
+        return
+    dive = tables['dive']
+    for subject, (totals_name, months_name, key) in SUBJECTS.items():
+        totals, months = tables[totals_name], tables[months_name]
+        source, source_key = _source(tables, subject)
+        for row in conn.execute(_totals_query(tables, subject, dive_ids)).mappings().all():
+            remaining_deepest = select(func.max(dive.c.max_depth)).select_from(source).where(
+                source_key == row[key], dive.c.id.not_in(dive_ids)).scalar_subquery()
+            values = {name: totals.c[name] - row[name] for name in TOTALS}
+            if row['deepest_dive'] is not None:
+                values['deepest_dive'] = case(
+                    (totals.c.deepest_dive <= row['deepest_dive'], remaining_deepest), else_=totals.c.deepest_dive)
+            conn.execute(update(totals).where(totals.c[key] == row[key]).values(**values))
+        for row in conn.execute(_months_query(tables, subject, dive_ids)).mappings().all():
+            conn.execute(update(months).where(months.c[key] == row[key], months.c.month == row['month']).values(
+                **{name: months.c[name] - row[name] for name in MONTH_TOTALS}))
+        conn.execute(delete(totals).where(totals.c.dive_count <= 0))
+        conn.execute(delete(months).where(months.c.dive_count <= 0))
+
+
+def remove_divers(conn, tables, diver_ids):
+    """Drop the statistics of deleted divers; their dives stay in the site statistics."""
+    totals_name, months_name, key = SUBJECTS['diver']
+    for name in (totals_name, months_name):
+        conn.execute(delete(tables[name]).where(tables[name].c[key].in_(diver_ids)))
+
+
+def rebuild(conn, tables):
+    """Recompute every statistic from the dive tables."""
+    for subject, (totals_name, months_name, key) in SUBJECTS.items():
+        for name, query in ((totals_name, _totals_query(tables, subject)), (months_name, _months_query(tables, subject))):
+            conn.execute(delete(tables[name]))
+            conn.execute(tables[name].insert().from_select(list(query.selected_columns.keys()), query))
+
+
+def _summary(row):
+    summary = dict(row)
+    summary['avg_bottom_time'] = summary['bottom_time_minutes'] / summary['dive_count'] if summary['dive_count'] else None
+    summary['avg_air_used'] = summary['air_used_total'] / summary['air_dives'] if summary['air_dives'] else None
+    return summary
+
+
+def summary(conn, tables, subject, key_id, months=12):
+    """Totals and averages for one diver or site plus its most recent `months` months, newest first."""
+    totals_name, months_name, key = SUBJECTS[subject]
+    totals, monthly = tables[totals_name], tables[months_name]
+    row = conn.execute(select(totals).where(totals.c[key] == key_id)).mappings().first()
+    if row is None:
+        return None
+    result = _summary(row)
+    result['months'] = [dict(month) for month in conn.execute(
+        select(monthly.c.month, monthly.c.dive_count, monthly.c.bottom_time_minutes)
+        .where(monthly.c[key] == key_id).order_by(monthly.c.month.desc()).limit(months)
+    ).mappings()]
+    return result
+
+
+def months_ago(months, today=None):
+    """The 'YYYY-MM' month `months` calendar months before today's."""
+    today = today or date.today()
+    year, month = divmod(today.year * 12 + today.month - 1 - months, 12)
+    return f'{year:04d}-{month + 1:02d}'
+
+
+def site_summaries(conn, tables, recent_months=12):
+    """{site_id: totals and averages, with dives in the last `recent_months` months} for every site with dives."""
+    site_stats, site_month_stats = tables['site_stats'], tables['site_month_stats']
+    summaries = {row['site_id']: _summary(row) for row in conn.execute(select(site_stats)).mappings()}
+    for site in summaries.values():
+        site['recent_dives'] = 0
+    recent = conn.execute(
+        select(site_month_stats.c.site_id, func.sum(site_month_stats.c.dive_count))
+        .where(site_month_stats.c.month > months_ago(recent_months)).group_by(site_month_stats.c.site_id))
+    for site_id, count in recent:
+        if site_id in summaries:
+            summaries[site_id]['recent_dives'] = count
+    return summaries
@@ -0,0 +1,90 @@
+"""
+SQLite storage profiles.
+
+A profile bundles the connection pragmas and pool settings for the database.
+`production` runs SQLite in WAL mode so readers never block the writer, waits
+on a locked database instead of failing straight away, and sizes the page
+cache and memory map from the database file. `default` leaves SQLite's own
+settings alone and is kept for comparison and troubleshooting.
+"""
+
+import sqlite3
+
+from sqlalchemy import event
+
+MiB = 1024 * 1024
+
+PROFILES = {
+    'default': {
+        'pragmas': {},
+        'pool': {},
+    },
+    'production': {
+        'pragmas': {
+            'journal_mode': 'WAL',
+            'synchronous': 'NORMAL',
+            'busy_timeout': 5000,
+            'foreign_keys': 'ON',
+            'temp_store': 'MEMORY',
+            'cache_size': 'auto',
+            'mmap_size': 'auto',
+        },
+        'pool': {
+            'pool_size': 10,
+            'max_overflow': 20,
+            'pool_timeout': 30,
+        },
+    },
+}
+
+
+def get_profile(name):
+    try:
+        return PROFILES[name]
+    except KeyError:
+        raise ValueError(f"Unknown storage profile {name!r}; expected one of {', '.join(PROFILES)}") from None
+
+
+def engine_options(profile_name, database_uri):
+    """SQLALCHEMY_ENGINE_OPTIONS for the given profile."""
+    options = {'connect_args': {'check_same_thread': False}}
+    # In-memory databases use a single static connection; pool sizing does not apply.
+    if database_uri.startswith('sqlite') and ':memory:' not in database_uri and database_uri != 'sqlite://':
+        options.update(get_profile(profile_name)['pool'])
+    return options
+
+
+def auto_cache_size(db_bytes):
+    """Page cache in KiB (negative, as PRAGMA cache_size expects): a quarter of the file, 8-64 MiB."""
+    return -(min(max(db_bytes // 4, 8 * MiB), 64 * MiB) // 1024)
+
+
+def auto_mmap_size(db_bytes):
+    """Map the whole file with room to grow, 64 MiB to 1 GiB."""
+    return min(max(db_bytes * 2, 64 * MiB), 1024 * MiB)
+
+
+def apply_pragmas(dbapi_connection, pragmas):
+    cursor = dbapi_connection.cursor()
+    try:
+        page_size = cursor.execute('PRAGMA page_size').fetchone()[0]
+        page_count = cursor.execute('PRAGMA page_count').fetchone()[0]
+        db_bytes = page_size * page_count
+        for name, value in pragmas.items():
+            if value == 'auto':
+                value = auto_cache_size(db_bytes) if name == 'cache_size' else auto_mmap_size(db_bytes)
+            cursor.execute(f'PRAGMA {name}={value}')
+    finally:
+        cursor.close()
+
+
+def install_pragmas(engine, profile_name, **overrides):
+    """Apply the profile's pragmas, with any overrides, to every new connection the engine opens."""
+    pragmas = dict(get_profile(profile_name)['pragmas'], **overrides)
+    if engine.dialect.name != 'sqlite' or not pragmas:
+        return
+
+    @event.listens_for(engine, 'connect')
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        if isinstance(dbapi_connection, sqlite3.Connection):
+            apply_pragmas(dbapi_connection, pragmas)
@@ -0,0 +1,219 @@
+"""
+Dive centres (tenants).
+
+Every user belongs to at most one centre (user.centre_id); users without one
+behave as before, and an admin without one manages the whole deployment.
+The active centre is the signed-in user's, or the one a deployment admin has
+switched to; it lives on flask.g for the request (or job) and is read with
+current().
+
+Scoping happens at the session level. Every ORM query on a model registered
+with scope() gets its centre's criteria added automatically, so a centre
+admin's user list or a diver's site list only ever contains their centre's
+rows (plus shared sites, whose centre_id is NULL). New scoped rows default to
+the active centre. Pass execution_options(all_centres=True) to look across
+centres, as login does.
+
+With TENANT_DATABASES=1 each centre's data also lives in its own SQLite file,
+instance/centres/centre-<id>.db, so one busy centre's working set and write
+lock never touch the others. The main database stays the directory: it holds
+centres, users, dive sites, jobs and the audit log, plus the data of users
+without a centre. Every site lives there, shared or not, so sites keep one id
+space and a centre sees the shared ones next to its own. Centre files contain
+every other table and ATTACH the directory on each connection, so `user` and
+`dive_site` resolve by name; SQLite cannot enforce foreign keys across files,
+so centre files run without foreign_keys, rely on the explicit deletes in
+deletes.py, and routes check a site is visible before pointing at it.
+TenantSession routes the session to the active centre's file; engines() lists
+every database for maintenance work.
+"""
+
+import os
+import threading
+from contextlib import contextmanager
+
+from flask import current_app, g, has_app_context
+from flask_sqlalchemy.session import Session
+from sqlalchemy import create_engine, event, or_, select, text
+from sqlalchemy.orm import with_loader_criteria
+
+import search
+import storage
+
+# Tables that only exist in the main database; centre files reach them through ATTACH.
+DIRECTORY_TABLES = ('centre', 'user', 'dive_site', 'job', 'audit_log')
+DIRECTORY_SCHEMA = 'directory'
+
+_scoped = {}  # model -> whether rows without a centre are shared with every centre
+
+
+def current():
+    """The active centre id, or None."""
+    return g.get('centre_id') if has_app_context() else None
+
+
+@contextmanager
+def use(centre_id):
+    """Make centre_id the active centre inside the current app context, e.g. in a background job."""
+    previous = g.get('centre_id')
+    g.centre_id = centre_id
+    try:
+        yield
+    finally:
+        g.centre_id = previous
+
+
+def scope(model, shared=False):
+    """Filter every ORM query on `model` (which needs a centre_id column) to the active centre."""
+    _scoped[model] = shared
+    return model
+
+
+class TenantSession(Session):
+    """db.session class: sends everything to the active centre's database when TENANT_DATABASES is on."""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None:
+            router = current_app.extensions.get('tenants')
+            centre_id = current()
+            if router is not None and router.enabled and centre_id is not None:
+                return router.engine(centre_id)
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+@event.listens_for(TenantSession, 'do_orm_execute')
+def _add_centre_criteria(state):
+    if not state.is_select or state.execution_options.get('all_centres'):
+        return
+    centre_id = current()
+    if centre_id is None:
+        return
+    for model, shared in _scoped.items():
+        criteria = model.centre_id == centre_id
+        if shared:
+            criteria = or_(criteria, model.centre_id.is_(None))
+        state.statement = state.statement.options(with_loader_criteria(model, criteria, include_aliases=True))
+
+
+@event.listens_for(TenantSession, 'before_flush')
+def _default_centre(session, flush_context, instances):
+    centre_id = current()
+    if centre_id is None:
+        return
+    for obj in session.new:
+        if type(obj) in _scoped and obj.centre_id is None:
+            obj.centre_id = centre_id
+
+
+# ============ Routing ============
+
+class Router:
+    """Engines for the per-centre database files, created (and upgraded) on first use."""
+
+    def __init__(self, app, db, enabled=False):
+        self.app = app
+        self.db = db
+        self.enabled = enabled
+        self.root = os.path.join(app.instance_path, 'centres')
+        self._engines = {}
+        self._lock = threading.Lock()
+        app.extensions['tenants'] = self
+
+    def path(self, centre_id):
+        return os.path.join(self.root, f'centre-{int(centre_id)}.db')
+
+    def tables(self):
+        return [table for table in self.db.metadata.sorted_tables if table.name not in DIRECTORY_TABLES]
+
+    def engine(self, centre_id):
+        engine = self._engines.get(centre_id)
+        if engine is not None:
+            return engine
+        with self._lock:
+            if centre_id not in self._engines:
+                self._engines[centre_id] = self._create(centre_id)
+            return self._engines[centre_id]
+
+    def _create(self, centre_id):
+        from migrate import upgrade_schema
+
+        with self.app.app_context():
+            directory = self.db.engine.url.database
+        if not directory or directory == ':memory:':
+            raise RuntimeError('TENANT_DATABASES needs the main database in a file')
+        os.makedirs(self.root, exist_ok=True)
+        uri = f'sqlite:///{self.path(centre_id)}'
+        profile = self.app.config['STORAGE_PROFILE']
+        engine = create_engine(uri, **storage.engine_options(profile, uri))
+        storage.install_pragmas(engine, profile, foreign_keys='OFF')
+
+        @event.listens_for(engine, 'connect')
+        def attach_directory(dbapi_connection, connection_record):
+            dbapi_connection.execute(f'ATTACH DATABASE ? AS {DIRECTORY_SCHEMA}', (directory,))
+            # Not on an index from before its tags column; upgrade_schema() replaces that one.
+            columns = dbapi_connection.execute("SELECT name FROM pragma_table_info('search_index', 'main')").fetchall()
+            if tuple(name for name, in columns) == search.COLUMNS:
+                for statement in search.temp_trigger_ddl(DIRECTORY_SCHEMA):
+                    dbapi_connection.execute(statement)
+
+        self._move_sites(engine, centre_id)
+        upgrade_schema(self.db, engine=engine, tables=self.tables())
+        # Connections opened before the search index existed lack its triggers.
+        engine.dispose()
+        return engine
+
+    def _move_sites(self, engine, centre_id):
+        """Move a centre file's own dive_site (from before sites moved to the directory) into the directory.
+
+        The sites get new ids there; the file's dives and trips follow them and its statistics are rebuilt.
+        """
+        import stats
+
+        with engine.begin() as conn:
+            if not search.has_sites(conn):
+                return
+            local = set(conn.execute(text("SELECT name FROM sqlite_master WHERE type = 'table'")).scalars())
+            site = self.db.metadata.tables['dive_site']
+            conn.execute(text('CREATE TEMP TABLE moved_site (old INTEGER PRIMARY KEY, new INTEGER NOT NULL)'))
+            for row in conn.execute(text('SELECT * FROM main.dive_site')).mappings().all():
+                values = {column.name: row[column.name] for column in site.columns
+                          if column.name != 'id' and column.name in row}
+                values['centre_id'] = values.get('centre_id') or centre_id
+                new_id = conn.execute(text(
+                    f"INSERT INTO {DIRECTORY_SCHEMA}.dive_site ({', '.join(values)}) "
+                    f"VALUES ({', '.join(':' + name for name in values)})"), values).lastrowid
+                conn.execute(text('INSERT INTO moved_site (old, new) VALUES (:old, :new)'), {'old': row['id'], 'new': new_id})
+            for table in ('dive', 'trip'):
+                if table in local:
+                    conn.execute(text(f'UPDATE main.{table} SET site_id = (SELECT new FROM moved_site '
+                                      f'WHERE moved_site.old = {table}.site_id) '
+                                      'WHERE site_id IN (SELECT old FROM moved_site)'))
+            conn.execute(text('DROP TABLE moved_site'))
+            conn.execute(text('DROP TABLE main.dive_site'))
+            conn.execute(text('DROP TABLE IF EXISTS main.site_rtree'))
+            if 'search_index' in local:
+                # Without the site documents, and with dive titles read from the directory's sites
+                if not search.install(conn):
+                    search.rebuild(conn)
+            if 'site_stats' in local:
+                stats.rebuild(conn, self.db.metadata.tables)
+
+
+def sites_schema():
+    """The attached schema holding dive_site when the session runs on a centre's own file, else None."""
+    router = current_app.extensions.get('tenants')
+    if router is not None and router.enabled and current() is not None:
+        return DIRECTORY_SCHEMA
+    return None
+
+
+def engines(db):
+    """[(centre id or None, engine)]: the main database, then every centre's file when they are routed."""
+    result = [(None, db.engine)]
+    router = current_app.extensions.get('tenants')
+    if router is not None and router.enabled:
+        centre = db.metadata.tables['centre']
+        with db.engine.connect() as conn:
+            centre_ids = conn.execute(select(centre.c.id).order_by(centre.c.id)).scalars().all()
+        result += [(centre_id, router.engine(centre_id)) for centre_id in centre_ids]
+    return result
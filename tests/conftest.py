@@ -0,0 +1,89 @@
+"""
+Shared fixtures. Every test gets a fresh SQLite database in a temporary
+directory, initialised by setup.py (users admin/admin123 and diver/diver123,
+four shared dive sites); DATABASE_URL is set before app.py is imported.
+"""
+
+import os
+import sys
+import tempfile
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+DATABASE_DIR = tempfile.mkdtemp(prefix='diving-admin-tests-')
+DATABASE_PATH = os.path.join(DATABASE_DIR, 'test.db')
+os.environ['DATABASE_URL'] = f'sqlite:///{DATABASE_PATH}'
+# setup.py and logins hash passwords; the production cost only slows the suite down.
+os.environ['PASSWORD_HASH_METHOD'] = 'pbkdf2:sha256:1000'
+os.environ['ALERT_REFRESH_INTERVAL'] = '0'
+
+
+def _remove_database():
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(DATABASE_PATH + suffix):
+            os.remove(DATABASE_PATH + suffix)
+
+
+@pytest.fixture
+def app():
+    import app as application
+    import setup
+
+    flask_app, db = application.app, application.db
+    application.audit_writer.flush()
+    with flask_app.app_context():
+        db.session.remove()
+        db.engine.dispose()
+    _remove_database()
+    for cache in (application.stats_cache, application.auth_cache, application.page_cache):
+        cache.clear()
+    setup.setup_database()
+    yield flask_app
+    application.audit_writer.flush()
+
+
+@pytest.fixture
+def db(app):
+    from app import db
+    return db
+
+
+def login(app, username, password):
+    client = app.test_client()
+    response = client.post('/login', data={'username': username, 'password': password})
+    assert response.status_code == 302
+    return client
+
+
+@pytest.fixture
+def admin(app):
+    return login(app, 'admin', 'admin123')
+
+
+@pytest.fixture
+def diver(app):
+    return login(app, 'diver', 'diver123')
+
+
+@pytest.fixture
+def users(app, db):
+    """username -> user id for the two accounts setup.py creates."""
+    from app import User
+    with app.app_context():
+        return {user.username: user.id for user in User.query}
+
+
+@pytest.fixture
+def make_diver(app, db):
+    """make_diver(user_id, first_name, **columns) -> id of a new diver."""
+    from app import Diver
+
+    def make(user_id, first_name='Test', last_name='Diver', **columns):
+        with app.app_context():
+            diver = Diver(user_id=user_id, first_name=first_name, last_name=last_name, **columns)
+            db.session.add(diver)
+            db.session.commit()
+            return diver.id
+    return make
@@ -0,0 +1,67 @@
+from datetime import date, timedelta
+
+import pytest
+
+import alerts
+
+TODAY = date(2030, 6, 15)
+
+
+@pytest.fixture
+def due(app, db, users, make_diver):
+    """due(kind, *offsets) -> {offset: status or None} after a refresh, for items due `offset` days from TODAY."""
+    from app import Certification, Equipment
+
+    diver_id = make_diver(users['diver'])
+
+    def check(kind, *offsets, **windows):
+        with app.app_context():
+            items = {}
+            for offset in offsets:
+                when = TODAY + timedelta(days=offset)
+                if kind == 'certification':
+                    item = Certification(diver_id=diver_id, cert_type=f'Cert {offset}', date_issued=date(2020, 1, 1),
+                                         expiration_date=when)
+                else:
+                    item = Equipment(diver_id=diver_id, equipment_type='Regulator', next_maintenance=when)
+                db.session.add(item)
+                db.session.flush()
+                items[offset] = item.id
+            conn = db.session.connection()
+            alerts.refresh(conn, db.metadata.tables, users['diver'], today=TODAY, **windows)
+            found = alerts.statuses(conn, db.metadata.tables, users['diver'], kind)
+            db.session.rollback()
+        return {offset: found.get(ref_id) for offset, ref_id in items.items()}
+    return check
+
+
+def test_certifications_within_the_window_and_grace(due):
+    assert due('certification', -91, -90, -1, 0, 90, 91) == {
+        -91: None, -90: 'expired', -1: 'expired', 0: 'expiring', 90: 'expiring', 91: None}
+
+
+def test_equipment_within_the_window_and_grace(due):
+    assert due('equipment', -91, -90, -1, 0, 90, 91) == {
+        -91: None, -90: 'overdue', -1: 'overdue', 0: 'due_soon', 90: 'due_soon', 91: None}
+
+
+def test_windows_are_configurable(due):
+    assert due('certification', -8, -7, 30, 31, window_days=30, grace_days=7) == {
+        -8: None, -7: 'expired', 30: 'expiring', 31: None}
+
+
+def test_zero_grace_drops_everything_past_due(due):
+    assert due('equipment', -1, 0, grace_days=0) == {-1: None, 0: 'due_soon'}
+
+
+def test_items_without_a_date_are_never_due(app, db, users, make_diver):
+    from app import Certification
+
+    diver_id = make_diver(users['diver'])
+    with app.app_context():
+        db.session.add(Certification(diver_id=diver_id, cert_type='Open Water', date_issued=date(2020, 1, 1)))
+        db.session.flush()
+        conn = db.session.connection()
+        alerts.refresh(conn, db.metadata.tables, users['diver'], today=TODAY)
+        assert alerts.statuses(conn, db.metadata.tables, users['diver'], 'certification') == {}
+        db.session.rollback()
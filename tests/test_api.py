@@ -0,0 +1,80 @@
+import json
+
+import pytest
+from sqlalchemy import select
+
+
+@pytest.fixture
+def shared_dive(app, db, admin, users, make_diver):
+    """A dive admin logged through the API, with a diver of the other user on it too."""
+    from app import dive_diver
+
+    ids = {'admin': make_diver(users['admin'], 'Ada'), 'admin_buddy': make_diver(users['admin'], 'Abe'),
+           'diver': make_diver(users['diver'], 'Dora')}
+    response = admin.post('/api/v1/dives', json={'site_id': 1, 'dive_date': '2025-05-01T10:00:00',
+                                                 'notes': 'shared reef', 'divers': [ids['admin']]})
+    assert response.status_code == 201
+    ids['dive'] = response.get_json()['data']['id']
+    with app.app_context():
+        db.session.execute(dive_diver.insert().values(dive_id=ids['dive'], diver_id=ids['diver']))
+        db.session.commit()
+    return ids
+
+
+def roster(app, db, dive_id):
+    from app import dive_diver
+    with app.app_context():
+        return sorted(db.session.execute(select(dive_diver.c.diver_id).where(dive_diver.c.dive_id == dive_id)).scalars())
+
+
+def test_batch_update_replaces_only_the_callers_divers(app, db, admin, shared_dive):
+    response = admin.post('/api/v1/dives/batch', json={'update': [{'id': shared_dive['dive'],
+                                                                   'divers': [shared_dive['admin_buddy']]}]})
+    assert response.status_code == 200
+    assert response.get_json()['data']['updated'] == [shared_dive['dive']]
+    assert roster(app, db, shared_dive['dive']) == sorted([shared_dive['admin_buddy'], shared_dive['diver']])
+
+
+def test_other_owner_keeps_the_shared_dive(app, db, admin, diver, shared_dive):
+    admin.post('/api/v1/dives/batch', json={'update': [{'id': shared_dive['dive'], 'divers': [shared_dive['admin_buddy']]}]})
+    response = diver.get(f"/api/v1/dives/{shared_dive['dive']}")
+    assert response.status_code == 200
+    assert response.get_json()['data']['notes'] == 'shared reef'
+
+
+def test_either_owner_may_update_a_shared_dive(app, db, diver, shared_dive):
+    response = diver.post('/api/v1/dives/batch', json={'update': [{'id': shared_dive['dive'], 'notes': 'strong current',
+                                                                   'divers': [shared_dive['diver']]}]})
+    assert response.status_code == 200
+    assert roster(app, db, shared_dive['dive']) == sorted([shared_dive['admin'], shared_dive['diver']])
+    assert diver.get(f"/api/v1/dives/{shared_dive['dive']}").get_json()['data']['notes'] == 'strong current'
+
+
+def test_audit_records_the_full_roster(app, db, admin, shared_dive):
+    from app import AuditLog, audit_writer
+
+    admin.post('/api/v1/dives/batch', json={'update': [{'id': shared_dive['dive'], 'divers': [shared_dive['admin_buddy']]}]})
+    audit_writer.flush()
+    with app.app_context():
+        entry = AuditLog.query.filter_by(action='update', table_name='dive').order_by(AuditLog.id.desc()).first()
+    before = sorted([shared_dive['admin'], shared_dive['diver']])
+    after = sorted([shared_dive['admin_buddy'], shared_dive['diver']])
+    assert json.loads(entry.changes)['divers'] == [before, after]
+
+
+def test_batch_cannot_touch_another_users_dive(app, db, admin, diver, users, make_diver):
+    own = make_diver(users['admin'])
+    dive_id = admin.post('/api/v1/dives', json={'site_id': 1, 'dive_date': '2025-05-02T10:00:00',
+                                                'divers': [own]}).get_json()['data']['id']
+    response = diver.post('/api/v1/dives/batch', json={'update': [{'id': dive_id, 'notes': 'mine now'}]})
+    assert response.status_code == 422
+    assert response.get_json()['errors'] == [{'op': 'update', 'index': 0, 'error': f'not found: {dive_id}'}]
+
+
+def test_rejected_batch_writes_nothing(app, db, admin, shared_dive):
+    response = admin.post('/api/v1/dives/batch', json={
+        'update': [{'id': shared_dive['dive'], 'divers': [shared_dive['admin_buddy']]}],
+        'create': [{'site_id': 1, 'dive_date': 'not a date', 'divers': [shared_dive['admin']]}],
+    })
+    assert response.status_code == 422
+    assert roster(app, db, shared_dive['dive']) == sorted([shared_dive['admin'], shared_dive['diver']])
@@ -0,0 +1,123 @@
+import math
+import random
+
+import pytest
+
+import geo
+
+
+def in_boxes(boxes, latitude, longitude):
+    return any(south <= latitude <= north and west <= longitude <= east for south, north, west, east in boxes)
+
+
+def destination(latitude, longitude, bearing, km):
+    """The point km along a great circle from (latitude, longitude), longitude wrapped to [-180, 180)."""
+    phi, lam, theta, angle = math.radians(latitude), math.radians(longitude), math.radians(bearing), \
+        km / geo.EARTH_RADIUS_KM
+    phi2 = math.asin(math.sin(phi) * math.cos(angle) + math.cos(phi) * math.sin(angle) * math.cos(theta))
+    lam2 = lam + math.atan2(math.sin(theta) * math.sin(angle) * math.cos(phi),
+                            math.cos(angle) - math.sin(phi) * math.sin(phi2))
+    return math.degrees(phi2), (math.degrees(lam2) + 540) % 360 - 180
+
+
+def test_box_away_from_the_antimeridian():
+    [(south, north, west, east)] = geo.bounding_boxes(10.0, 20.0, 111.0)
+    assert south == pytest.approx(9.0, abs=0.01) and north == pytest.approx(11.0, abs=0.01)
+    assert west == pytest.approx(18.98, abs=0.01) and east == pytest.approx(21.02, abs=0.01)
+
+
+@pytest.mark.parametrize('longitude, expected', [
+    (179.5, [(178.5, 180.0), (-180.0, -179.5)]),
+    (-179.5, [(179.5, 180.0), (-180.0, -178.5)]),
+])
+def test_boxes_split_at_the_antimeridian(longitude, expected):
+    boxes = geo.bounding_boxes(0.0, longitude, 111.2)
+    assert [(west, east) for _, _, west, east in boxes] == [
+        (pytest.approx(west, abs=0.01), pytest.approx(east, abs=0.01)) for west, east in expected]
+
+
+@pytest.mark.parametrize('latitude', [89.5, -89.5, 85.0])
+def test_boxes_reaching_a_pole_cover_every_longitude(latitude):
+    [(south, north, west, east)] = geo.bounding_boxes(latitude, 30.0, 600.0)
+    assert (west, east) == (-180.0, 180.0)
+    assert north == 90.0 if latitude > 0 else south == -90.0
+
+
+def test_circle_wider_than_a_hemisphere_is_the_whole_globe():
+    assert geo.bounding_boxes(0.0, 0.0, geo.MAX_DISTANCE_KM) == [(-90.0, 90.0, -180.0, 180.0)]
+
+
+@pytest.mark.parametrize('latitude, longitude, radius_km', [
+    (0.0, 179.9, 50.0), (-16.8, -179.95, 300.0), (65.0, 179.0, 800.0), (88.0, -170.0, 400.0),
+    (-78.0, 10.0, 1500.0), (45.0, 0.0, 5000.0),
+])
+def test_boxes_enclose_the_circle(latitude, longitude, radius_km):
+    boxes = geo.bounding_boxes(latitude, longitude, radius_km)
+    rng = random.Random(f'{latitude},{longitude}')
+    for _ in range(500):
+        point = destination(latitude, longitude, rng.uniform(0, 360), radius_km * 0.999 * rng.random() ** 0.5)
+        assert in_boxes(boxes, *point), point
+    for bearing in range(0, 360, 5):
+        assert in_boxes(boxes, *destination(latitude, longitude, bearing, radius_km * 0.999))
+
+
+@pytest.fixture
+def sites(app, db):
+    """Sites either side of the antimeridian off Fiji and near the north pole, by name -> id."""
+    from app import DiveSite
+
+    points = {'Taveuni East': (-16.8, 179.95), 'Taveuni West': (-16.8, -179.95), 'Rabi': (-16.5, -179.9),
+              'Suva': (-18.1, 178.4), 'Pole A': (89.9, 0.0), 'Pole B': (89.9, 180.0)}
+    with app.app_context():
+        ids = {}
+        for name, (latitude, longitude) in points.items():
+            site = DiveSite(name=name, location='Test', latitude=latitude, longitude=longitude)
+            db.session.add(site)
+            db.session.flush()
+            ids[name] = site.id
+        db.session.commit()
+    return ids
+
+
+def named(ids, ranked):
+    names = {site_id: name for name, site_id in ids.items()}
+    return [names.get(site_id) for site_id, _ in ranked]
+
+
+def test_within_crosses_the_antimeridian(app, db, sites):
+    with app.app_context():
+        ranked = geo.within(db.session.connection(), -16.8, 179.99, 60.0)
+    assert named(sites, ranked) == ['Taveuni East', 'Taveuni West', 'Rabi']
+    assert ranked[1][1] == pytest.approx(geo.haversine_km(-16.8, 179.99, -16.8, -179.95))
+
+
+def test_within_reaches_across_the_pole(app, db, sites):
+    with app.app_context():
+        ranked = geo.within(db.session.connection(), 89.9, 0.0, 30.0)
+    assert named(sites, ranked) == ['Pole A', 'Pole B']
+    assert ranked[1][1] == pytest.approx(22.24, abs=0.1)
+
+
+def test_nearest_crosses_the_antimeridian(app, db, sites):
+    with app.app_context():
+        conn = db.session.connection()
+        assert named(sites, geo.nearest(conn, -16.8, -179.99, 2)) == ['Taveuni West', 'Taveuni East']
+        assert named(sites, geo.nearest(conn, -16.8, -179.99, 4)) == ['Taveuni West', 'Taveuni East', 'Rabi', 'Suva']
+        assert geo.nearest(conn, -16.8, -179.99, 4, max_km=50) == geo.within(conn, -16.8, -179.99, 50)
+
+
+def test_without_the_rtree_the_answers_match(app, db, sites):
+    from sqlalchemy import text
+
+    with app.app_context():
+        conn = db.session.connection()
+        indexed = geo.within(conn, -16.8, 179.99, 60.0), geo.within(conn, 89.9, 0.0, 30.0)
+        geo.drop_triggers(conn)
+        conn.execute(text('DROP TABLE site_rtree'))
+        assert (geo.within(conn, -16.8, 179.99, 60.0), geo.within(conn, 89.9, 0.0, 30.0)) == indexed
+        db.session.rollback()
+
+
+def test_invalid_points_are_rejected(app, db):
+    with app.app_context(), pytest.raises(ValueError):
+        geo.within(db.session.connection(), 91.0, 0.0, 10.0)
@@ -0,0 +1,106 @@
+import json
+import time
+
+import pytest
+from sqlalchemy import select, update
+
+import jobs
+import server
+
+
+@pytest.fixture
+def queue(app, db):
+    """A queue of its own with one fast-polling worker, stopped after the test."""
+    queue = jobs.JobQueue(app, db, workers=1, poll_interval=0.1)
+    yield queue
+    queue.stop()
+
+
+def wait_for(queue, job_id, timeout=10):
+    for _ in range(int(timeout / 0.05)):
+        job = queue.get(job_id)
+        if job['status'] not in ('queued', 'running'):
+            return job
+        time.sleep(0.05)
+    raise AssertionError(f'job {job_id} still {job["status"]}')
+
+
+def mark_running(queue, *job_ids):
+    with queue.engine.begin() as conn:
+        conn.execute(update(queue.table).where(queue.table.c.id.in_(job_ids)).values(status='running'))
+
+
+def test_start_requeues_restartable_jobs_and_fails_the_rest(queue):
+    ran, discarded = [], []
+    queue.register('export', lambda ctx: ran.append(ctx.params) or 'ok', restartable=True)
+    queue.register('import', lambda ctx: ran.append(ctx.params), discard=discarded.append)
+    export_id = queue.enqueue('export', {'format': 'csv'})
+    import_id = queue.enqueue('import', {'path': 'upload.csv'})
+    mark_running(queue, export_id, import_id)
+
+    queue.start()
+    assert wait_for(queue, export_id)['status'] == 'done'
+    failed = queue.get(import_id)
+    assert (failed['status'], failed['error']) == ('failed', 'interrupted by a restart')
+    assert discarded == [{'path': 'upload.csv'}]
+    assert ran == [{'format': 'csv'}]
+
+
+def test_unknown_kinds_are_failed_at_start(queue):
+    queue.register('import', lambda ctx: None)
+    job_id = queue.enqueue('import')
+    mark_running(queue, job_id)
+    queue.kinds.pop('import')
+
+    queue.start()
+    assert queue.get(job_id)['status'] == 'failed'
+
+
+def test_secret_reaches_the_handler_but_is_never_stored(queue):
+    seen = []
+    queue.register('reset_passwords', lambda ctx: seen.append(ctx.secret) or 'reset')
+    job_id = queue.enqueue('reset_passwords', {'user_ids': [1]}, secret='hunter2')
+    with queue.engine.connect() as conn:
+        stored = conn.execute(select(queue.table).where(queue.table.c.id == job_id)).mappings().one()
+    assert 'hunter2' not in json.dumps(dict(stored), default=str)
+
+    queue.start()
+    assert wait_for(queue, job_id)['status'] == 'done'
+    assert seen == ['hunter2']
+    assert job_id not in queue._secrets
+
+
+def test_cancelled_jobs_drop_their_secret(queue):
+    discarded = []
+    queue.register('import', lambda ctx: None, discard=discarded.append)
+    job_id = queue.enqueue('import', {'path': 'upload.csv'}, secret='hunter2')
+    assert queue.cancel(job_id)
+    assert queue.get(job_id)['status'] == 'cancelled'
+    assert job_id not in queue._secrets
+    assert discarded == [{'path': 'upload.csv'}]
+
+
+class StartCounter:
+    def __init__(self):
+        self.starts = 0
+
+    def start(self):
+        self.starts += 1
+
+
+def test_reloader_watcher_starts_no_jobs(app, db, monkeypatch):
+    monkeypatch.setitem(app.config, 'BACKUP_INTERVAL', 0)
+    monkeypatch.delenv('WERKZEUG_RUN_MAIN', raising=False)
+    counter = StartCounter()
+    server.start_background_jobs(app, db, job_queue=counter, reloader=True)
+    assert counter.starts == 0
+
+    monkeypatch.setenv('WERKZEUG_RUN_MAIN', 'true')
+    server.start_background_jobs(app, db, job_queue=counter, reloader=True)
+    assert counter.starts == 1
+
+
+def test_uses_reloader(app):
+    assert server.uses_reloader(app, 'development', debug=True)
+    assert not server.uses_reloader(app, 'development', debug=False)
+    assert not server.uses_reloader(app, 'production', debug=True)
@@ -0,0 +1,68 @@
+from sqlalchemy import text
+
+import search
+from migrate import upgrade_schema
+
+STATS_TABLES = ('diver_stats', 'site_stats', 'diver_month_stats', 'site_month_stats')
+
+
+def log_dives(client, diver_id, count):
+    for day in range(1, count + 1):
+        response = client.post('/dives', data={'site_id': 1, 'dive_date': f'2025-03-{day:02d}T09:00',
+                                               'duration_minutes': 40, 'max_depth': 18, 'diver_ids': [diver_id]})
+        assert response.status_code == 302
+
+
+def downgrade(db, statements):
+    """Undo part of the schema and forget the fingerprint, as on a database from before it existed."""
+    with db.engine.begin() as conn:
+        for statement in statements:
+            conn.execute(text(statement))
+        conn.execute(text('PRAGMA user_version = 0'))
+
+
+def test_upgrade_backfills_statistics_and_keeps_experience_dives(app, db, admin, users, make_diver):
+    from app import Diver, DiverStats
+
+    diver_id = make_diver(users['admin'], experience_dives=150)
+    log_dives(admin, diver_id, 3)
+    with app.app_context():
+        downgrade(db, [f'DROP TABLE {name}' for name in STATS_TABLES])
+        changes = upgrade_schema(db)
+        assert 'backfilled dive statistics' in changes
+        assert db.session.get(DiverStats, diver_id).dive_count == 3
+        assert db.session.get(Diver, diver_id).experience_dives == 150
+
+
+def test_logging_dives_leaves_experience_dives_alone(app, db, admin, users, make_diver):
+    from app import Diver
+
+    diver_id = make_diver(users['admin'], experience_dives=40)
+    log_dives(admin, diver_id, 2)
+    response = admin.post(f'/diver/{diver_id}/edit', data={'first_name': 'Test', 'last_name': 'Diver',
+                                                           'experience_dives': '41'})
+    assert response.status_code == 302
+    log_dives(admin, diver_id, 1)
+    with app.app_context():
+        assert db.session.get(Diver, diver_id).experience_dives == 41
+
+
+def test_upgrade_replaces_a_search_index_without_tags(app, db, admin, users, make_diver):
+    diver_id = make_diver(users['admin'], first_name='Zelda')
+    log_dives(admin, diver_id, 1)
+    with app.app_context():
+        with db.engine.begin() as conn:
+            search.drop_triggers(conn)
+        downgrade(db, ['DROP TABLE search_index',
+                       "CREATE VIRTUAL TABLE search_index USING fts5(title, body)"])
+        assert 'created full-text search index' in upgrade_schema(db)
+        with db.engine.connect() as conn:
+            columns = tuple(row[1] for row in conn.execute(text('PRAGMA table_info(search_index)')))
+            assert columns == search.COLUMNS
+            kinds = [result['kind'] for result in search.search(conn, 'zelda', users['admin'])]
+    assert kinds == ['diver']
+
+
+def test_upgrade_is_skipped_once_the_fingerprint_matches(app, db):
+    with app.app_context():
+        assert upgrade_schema(db) == []
@@ -0,0 +1,66 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+import planner
+
+pytest.importorskip('numpy')
+
+# Air no-decompression limits in minutes from the PADI Recreational Dive Planner (metric)
+# and the U.S. Navy Diving Manual (Rev. 7, feet converted to the nearest metre).
+PADI_RDP = {12: 147, 14: 98, 16: 72, 18: 56, 20: 45, 22: 37, 25: 29, 30: 20, 35: 14, 40: 9, 42: 8}
+US_NAVY = {12: 163, 15: 92, 18: 63, 21: 48, 24: 39, 27: 33, 30: 25, 33: 20, 36: 15, 40: 12}
+
+
+@pytest.mark.parametrize('table', [PADI_RDP, US_NAVY], ids=['padi', 'usn'])
+def test_air_ndls_are_no_longer_than_published_tables(table):
+    ndls = planner.ndl_table((), table)
+    for depth, published in table.items():
+        assert 0 < ndls[float(depth)] <= published, depth
+
+
+def test_air_ndls_are_not_far_below_the_rdp():
+    # GF_HIGH trades some bottom time for margin, but not more than about a third of it
+    ndls = planner.ndl_table((), PADI_RDP)
+    for depth, published in PADI_RDP.items():
+        assert ndls[float(depth)] >= 0.6 * published, depth
+
+
+def test_ndls_shorten_with_depth():
+    ndls = list(planner.ndl_table((), range(12, 43, 3)).values())
+    assert ndls == sorted(ndls, reverse=True)
+
+
+def test_shallow_dives_have_no_limit():
+    assert planner.ndl_table((), [6, 9]) == {6.0: None, 9.0: None}
+
+
+def test_nitrox_extends_the_limit_within_its_operating_depth():
+    air = planner.ndl_table((), [18, 30])
+    ean32 = planner.ndl_table((), [18, 30, 40], o2=0.32)
+    assert ean32[18.0] > air[18.0] and ean32[30.0] > air[30.0]
+    # 40 m is past EAN32's maximum operating depth at 1.4 bar
+    assert ean32[40.0] == 0
+
+
+def test_depths_round_up_and_oxygen_rounds_down():
+    assert planner.ndl_table((), [17.2]) == {18.0: planner.ndl_table((), [18])[18.0]}
+    assert planner.ndl_table((), [18], o2=0.329) == planner.ndl_table((), [18], o2=0.32)
+
+
+def test_repetitive_dive_credit():
+    at = datetime(2030, 6, 15, 14, 0)
+    first = (at - timedelta(minutes=105), 45, 18.0)
+    key, incomplete = planner.history_key([first, (at - timedelta(days=3), 50, 30.0)], at)
+    assert key == ((18.0, 45, 60),) and not incomplete
+
+    fresh, repeat = planner.ndl_table((), [12, 18]), planner.ndl_table(key, [12, 18])
+    assert repeat[12.0] < fresh[12.0] and repeat[18.0] < fresh[18.0]
+    # After a long enough interval the tissues are back to where they started
+    assert planner.ndl_table(((18.0, 45, 600),), [12, 18]) == fresh
+
+
+def test_dives_without_depth_make_the_history_incomplete():
+    at = datetime(2030, 6, 15, 14, 0)
+    key, incomplete = planner.history_key([(at - timedelta(hours=2), 40, None)], at)
+    assert key == () and incomplete
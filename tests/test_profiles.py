@@ -0,0 +1,77 @@
+import io
+
+import pytest
+
+import profiles
+
+np = pytest.importorskip('numpy')
+
+UDDF = b"""<?xml version="1.0" encoding="UTF-8"?>
+<uddf><profiledata><repetitiongroup><dive><samples>
+<waypoint><divetime>0</divetime><depth>0</depth><temperature>300.15</temperature><tankpressure>20000000</tankpressure></waypoint>
+<waypoint><divetime>10</divetime><depth>3.25</depth><temperature>299.15</temperature></waypoint>
+<waypoint><divetime>20</divetime><depth>7.5</depth><temperature>298.65</temperature><tankpressure>19500000</tankpressure></waypoint>
+</samples></dive></repetitiongroup></profiledata></uddf>
+"""
+
+
+@pytest.mark.parametrize('values, scale, width', [
+    ([0, 0.5, 1.27, 1.01, 0.99, 0.3], 100, 1),
+    ([0, 40.0, 0.0], 100, 2),
+    ([0, 2_000_000, -3_000_000], 1, 4),
+    ([0, 2 ** 40, 0], 1, 8),
+    ([18.4, 18.1, 17.9, 17.9], 10, 2),
+])
+def test_encode_decode_round_trip(values, scale, width):
+    blob = profiles.encode(values, scale)
+    assert blob[0] == width
+    np.testing.assert_allclose(profiles.decode(blob, scale), values, atol=0.5 / scale)
+
+
+def test_encode_rounds_to_the_scale():
+    decoded = profiles.decode(profiles.encode([0.004, 0.006, 1.23456], 100), 100)
+    assert decoded.tolist() == [0.0, 0.01, 1.23]
+
+
+def test_empty_channel_round_trips():
+    assert len(profiles.decode(profiles.encode([], 10), 10)) == 0
+
+
+def test_long_profile_round_trips():
+    time = np.arange(0, 3600, 2.0)
+    depth = np.round(18 * np.sin(time / 3600 * np.pi) + 0.01 * (time % 7), 2)
+    np.testing.assert_allclose(profiles.decode(profiles.encode(depth, 100), 100), depth, atol=0.005)
+
+
+def test_profile_round_trip_keeps_missing_channels():
+    channels = profiles.parse(io.BytesIO(b'time,depth,temp\n0:00,0,24\n0:10,4.2,\n0:20,8.55,23.5\n'), 'csv')
+    assert channels['pressure'] is None
+    row = profiles.encode_profile(channels)
+    assert (row['sample_count'], row['duration_seconds'], row['pressure']) == (3, 20, None)
+
+    decoded = profiles.decode_profile(row)
+    assert decoded['pressure'] is None
+    np.testing.assert_allclose(decoded['time'], [0, 10, 20])
+    np.testing.assert_allclose(decoded['depth'], [0, 4.2, 8.55])
+    np.testing.assert_allclose(decoded['temperature'], [24, 24, 23.5])
+
+
+def test_uddf_profile_round_trip():
+    channels = profiles.parse(io.BytesIO(UDDF), 'uddf')
+    decoded = profiles.decode_profile(profiles.encode_profile(channels))
+    np.testing.assert_allclose(decoded['depth'], [0, 3.25, 7.5])
+    np.testing.assert_allclose(decoded['temperature'], [27, 26, 25.5], atol=0.05)
+    np.testing.assert_allclose(decoded['pressure'], [200, 200, 195], atol=0.05)
+
+
+def test_decode_profile_reads_model_instances():
+    class Row:
+        pass
+
+    row = Row()
+    for name, value in profiles.encode_profile({'time': [0, 5], 'depth': [0, 1.5], 'temperature': None,
+                                                'pressure': None}).items():
+        setattr(row, name, value)
+    decoded = profiles.decode_profile(row)
+    assert decoded['depth'].tolist() == [0, 1.5]
+    assert decoded['temperature'] is None
@@ -0,0 +1,94 @@
+import pytest
+from sqlalchemy import delete, insert, update
+
+import search
+
+
+def results(app, db, query, user_id, kind=None, centre_id=None):
+    with app.app_context():
+        return [(result['kind'], result['id']) for result in
+                search.search(db.session.connection(), query, user_id, kind, centre_id=centre_id)]
+
+
+@pytest.fixture
+def dive(app, db, admin, users, make_diver):
+    """admin's dive at Blue Hole (site 2) noting a hammerhead."""
+    diver_id = make_diver(users['admin'], 'Hank')
+    response = admin.post('/api/v1/dives', json={'site_id': 2, 'dive_date': '2025-06-01T08:00:00',
+                                                 'notes': 'hammerhead at the wall', 'divers': [diver_id]})
+    return response.get_json()['data']['id']
+
+
+def test_dives_are_found_by_their_owner_only(app, db, users, dive):
+    assert results(app, db, 'hammerhead', users['admin']) == [('dive', dive)]
+    assert results(app, db, 'hammerhead', users['diver']) == []
+
+
+def test_shared_dive_is_found_by_every_owner(app, db, users, dive, make_diver):
+    from app import dive_diver
+
+    buddy = make_diver(users['diver'], 'Bea')
+    with app.app_context():
+        db.session.execute(insert(dive_diver).values(dive_id=dive, diver_id=buddy))
+        db.session.commit()
+    assert results(app, db, 'hammerhead', users['diver']) == [('dive', dive)]
+
+    with app.app_context():
+        db.session.execute(delete(dive_diver).where(dive_diver.c.diver_id == buddy))
+        db.session.commit()
+    assert results(app, db, 'hammerhead', users['diver']) == []
+
+
+def test_dive_titles_follow_a_site_rename(app, db, users, dive):
+    from app import DiveSite
+
+    with app.app_context():
+        db.session.execute(update(DiveSite).where(DiveSite.id == 2).values(name='Great Blue Hole'))
+        db.session.commit()
+    assert ('dive', dive) in results(app, db, 'great blue', users['admin'])
+
+
+def test_kind_filter(app, db, users, dive):
+    # "blue" is the site's name and the title of the dive there
+    assert sorted(results(app, db, 'blue', users['admin'])) == [('dive', dive), ('site', 2)]
+    assert results(app, db, 'blue', users['admin'], kind='dive') == [('dive', dive)]
+    assert results(app, db, 'blue', users['admin'], kind='site') == [('site', 2)]
+    assert results(app, db, 'blue', users['admin'], kind='equipment') == []
+    with pytest.raises(ValueError):
+        results(app, db, 'blue', users['admin'], kind='boat')
+
+
+def test_equipment_and_divers_are_owned(app, db, admin, users, make_diver):
+    diver_id = make_diver(users['admin'], 'Quentin', certification_number='PADI-4242')
+    admin.post('/equipment', data={'diver_id': diver_id, 'equipment_type': 'Regulator', 'brand': 'Apeks',
+                                   'model': 'XTX50', 'serial_number': 'AP-55321'})
+    assert results(app, db, 'quentin', users['admin']) == [('diver', diver_id)]
+    assert results(app, db, '4242', users['admin']) == [('diver', diver_id)]
+    assert [kind for kind, _ in results(app, db, 'AP-55321', users['admin'])] == ['equipment']
+    assert results(app, db, 'quentin', users['diver']) == []
+    assert results(app, db, 'AP-55321', users['diver']) == []
+
+
+def test_sites_are_scoped_to_the_centre(app, db, admin, users):
+    from app import Centre, DiveSite
+
+    with app.app_context():
+        alpha, beta = Centre(name='Alpha'), Centre(name='Beta')
+        db.session.add_all([alpha, beta])
+        db.session.flush()
+        db.session.add(DiveSite(name='Alpha Lagoon', location='Reef', centre_id=alpha.id))
+        db.session.commit()
+        alpha_id, beta_id = alpha.id, beta.id
+    assert results(app, db, 'belize', users['admin'], centre_id=beta_id) == [('site', 2)]
+    assert [kind for kind, _ in results(app, db, 'lagoon', users['admin'], centre_id=alpha_id)] == ['site']
+    assert results(app, db, 'lagoon', users['admin'], centre_id=beta_id) == []
+    # Without a centre every site is visible
+    assert [kind for kind, _ in results(app, db, 'lagoon', users['admin'])] == ['site']
+
+
+def test_terms_never_match_the_owner_tags(app, db, users, dive):
+    assert results(app, db, f"u{users['admin']}", users['admin']) == []
+
+
+def test_falls_back_to_any_term(app, db, users, dive):
+    assert results(app, db, 'hammerhead zeppelin', users['admin']) == [('dive', dive)]
@@ -0,0 +1,93 @@
+"""
+Data versions for cheap change detection.
+
+data_version holds one counter per scope: 'user:<id>' covers everything a
+user owns (divers, their dives, equipment and certifications) and 'sites'
+covers the shared dive sites. SQLite triggers on the source tables bump the
+counter and its changed_at timestamp on every insert, update and delete, so
+the ORM routes, the bulk importer and raw SQL are all covered. Comparing one
+counter tells a client or a cache whether anything it showed has changed
+without querying the data itself.
+
+A centre's own database file (TENANT_DATABASES) has no dive_site table, so
+the 'sites' counter is kept by the directory it attaches; read it there.
+"""
+
+from functools import lru_cache
+
+from sqlalchemy import MetaData, select, text
+
+SITES_SCOPE = 'sites'
+
+_BUMP = ("INSERT INTO data_version (scope, version, changed_at) {select} "
+         "ON CONFLICT(scope) DO UPDATE SET version = version + 1, changed_at = CURRENT_TIMESTAMP;")
+
+
+def user_scope(user_id):
+    return f'user:{user_id}'
+
+
+def _bump_user(user_id_sql):
+    return _BUMP.format(select=f"SELECT 'user:' || {user_id_sql}, 1, CURRENT_TIMESTAMP WHERE true")
+
+
+def _bump_diver_owner(diver_id_sql):
+    return _BUMP.format(select=f"SELECT 'user:' || user_id, 1, CURRENT_TIMESTAMP FROM diver WHERE id = {diver_id_sql}")
+
+
+def trigger_ddl(sites=True):
+    """Version triggers; sites=False for a database without dive_site."""
+    statements = []
+
+    def triggers(table, on_insert, on_update, on_delete):
+        for event, body in (('insert', on_insert), ('update', on_update), ('delete', on_delete)):
+            if body:
+                statements.append(f"CREATE TRIGGER IF NOT EXISTS version_{table}_{event} "
+                                  f"AFTER {event.upper()} ON {table} BEGIN {body} END")
+
+    triggers('diver', _bump_user('NEW.user_id'),
+             _bump_user('NEW.user_id') + _bump_user('OLD.user_id'), _bump_user('OLD.user_id'))
+    for table in ('equipment', 'certification', 'dive_diver'):
+        triggers(table, _bump_diver_owner('NEW.diver_id'),
+                 _bump_diver_owner('NEW.diver_id') + _bump_diver_owner('OLD.diver_id'),
+                 _bump_diver_owner('OLD.diver_id'))
+    # Dives are linked to their owners through dive_diver, whose own triggers cover inserts and deletes.
+    triggers('dive', None, _BUMP.format(select=(
+        "SELECT DISTINCT 'user:' || diver.user_id, 1, CURRENT_TIMESTAMP FROM dive_diver "
+        "JOIN diver ON diver.id = dive_diver.diver_id WHERE dive_diver.dive_id = NEW.id")), None)
+    site = _BUMP.format(select=f"SELECT '{SITES_SCOPE}', 1, CURRENT_TIMESTAMP WHERE true")
+    if sites:
+        triggers('dive_site', site, site, site)
+    return statements
+
+
+def drop_triggers(conn):
+    """Stop versioning, e.g. during a bulk load; install() restores it."""
+    names = conn.execute(text(
+        "SELECT name FROM sqlite_master WHERE type = 'trigger' AND name LIKE 'version\\_%' ESCAPE '\\'")).scalars().all()
+    for name in names:
+        conn.execute(text(f'DROP TRIGGER "{name}"'))
+
+
+def install(conn):
+    """Create any missing version triggers. Returns True if any were created."""
+    existing = set(conn.execute(text(
+        "SELECT name FROM sqlite_master WHERE type = 'trigger' AND name LIKE 'version\\_%' ESCAPE '\\'")).scalars())
+    statements = trigger_ddl(sites=conn.execute(text(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'dive_site'")).first() is not None)
+    for statement in statements:
+        conn.execute(text(statement))
+    return len(existing) < len(statements)
+
+
+@lru_cache(maxsize=None)
+def _attached(table, schema):
+    return table.to_metadata(MetaData(), schema=schema)
+
+
+def current(conn, tables, scope, schema=None):
+    """(version, changed_at) for a scope; (0, None) if it has never changed. schema: an attached database to read."""
+    data_version = tables['data_version'] if schema is None else _attached(tables['data_version'], schema)
+    row = conn.execute(select(data_version.c.version, data_version.c.changed_at)
+                       .where(data_version.c.scope == scope)).first()
+    return (row.version, row.changed_at) if row else (0, None)